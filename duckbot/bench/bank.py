@@ -0,0 +1,154 @@
+# Last Updated: 2.4.0
+# Bank scale benchmark. Memory per player and the time of each bulk job for
+# the columnar bank, next to the dict per player layout it replaced. Regen
+# isn't a bulk job in the columnar bank, it's settled when a balance is read
+# The +1 bet line is the columnar bank again once everyone has one ledger
+# entry, the dicts never kept any history
+# Usage (from the duckbot directory):
+#   python -m bench.bank [--players N ...]
+# Python imports
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+# Project imports
+import util.common as util
+from util.bank import Bank
+
+# Fill a columnar bank
+# Params: count - number of players
+#         rand  - random.Random to fill with
+# Return: Bank instance
+def buildBank(count, rand):
+#{{{
+    bank = Bank(store=None)
+    bank.gacha_pool = list(Bank.DEFAULT_POOL)
+    for num in range(count):
+        user = "U" + str(num).zfill(8)
+        bank.addUser(user)
+        # Straight into the columns, an adjust would give everyone a ledger
+        # entry and pulls would spend the whole build stealing
+        bank.balances[num] = rand.randrange(200)
+        if rand.random() < 0.1:
+            bank.pools[num * Bank.POOL_SIZE + rand.randrange(Bank.POOL_SIZE)] += 1
+    bank._buildIndex()
+    return bank
+#}}}
+
+# Fill the old layout, a dict of player dicts each with a pool list
+# Params: count - number of players
+#         rand  - random.Random to fill with
+# Return: players dict
+def buildDicts(count, rand):
+#{{{
+    players = {}
+    for num in range(count):
+        pool = list(Bank.STARTING_POOL)
+        if rand.random() < 0.1:
+            pool[rand.randrange(Bank.POOL_SIZE)] += 1
+        players["U" + str(num).zfill(8)] = {
+             "balance" : rand.randrange(200)
+            ,"pool"    : pool
+            ,"pull"    : True
+        }
+    return players
+#}}}
+
+#{{{ - Old layout bulk jobs, same loops the dict bank ran
+def dictRegen(players):
+    for player in players:
+        balance = players[player]["balance"]
+        if balance <= 95:
+            players[player]["balance"] += 5
+        elif balance < 100:
+            players[player]["balance"] = 100
+
+def dictNuke(players):
+    for player in players:
+        players[player]["pool"] = list(Bank.STARTING_POOL)
+
+def dictRefresh(players):
+    for player in players:
+        players[player]["pull"] = True
+
+def dictSteal(players):
+    holders = [player for player in players if
+               players[player]["pool"][7] and player not in ["U00000000"]]
+    return holders[random.randrange(len(holders))]
+#}}}
+
+# Give every player one bet, so each has a ledger ring like anyone who's
+# played has
+# Params: bank - Bank to bet in
+# Return: None
+def betAll(bank):
+#{{{
+    for user in bank.users:
+        bank.settleBet(user, 1, True)
+#}}}
+
+# Build something under tracemalloc
+# Params: build - function returning the built thing
+# Return: built thing and bytes it holds
+def measure(build):
+#{{{
+    tracemalloc.start()
+    built = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return built, size
+#}}}
+
+# Time one call
+# Params: func - function taking no arguments
+# Return: milliseconds
+def timeOnce(func):
+#{{{
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+#}}}
+
+# Mainline code
+# Params: None
+# Return: 0
+def main():
+#{{{
+    cl_parser = argparse.ArgumentParser(description='Bank scale benchmark')
+    cl_parser.add_argument('--players', type=int, nargs='+',
+                           default=[1000, 100000, 1000000])
+    cl_parser.add_argument('--seed', type=int, default=0)
+    args = cl_parser.parse_args()
+    util.bank_file = False
+
+    print("{:>8} {:<8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "players", "layout", "bytes/pl", "regen ms", "nuke ms", "refresh ms",
+        "steal ms"))
+    for count in args.players:
+    #{{{
+        bank, size = measure(lambda: buildBank(count, random.Random(args.seed)))
+        # Steal before the nuke leaves nobody to steal from
+        steal = timeOnce(lambda: bank._steal(7, "U00000000"))
+        times = [timeOnce(bank.nuke), timeOnce(bank.refreshPulls), steal]
+        print("{:>8} {:<8} {:>10.1f} {:>10} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            count, "columns", size / count, "lazy", *times))
+        _, ledger = measure(lambda: betAll(bank))
+        print("{:>8} {:<8} {:>10.1f} {:>10} {:>10} {:>10} {:>10}".format(
+            count, "+1 bet", (size + ledger) / count, "-", "-", "-", "-"))
+        del bank
+
+        players, size = measure(lambda: buildDicts(count, random.Random(args.seed)))
+        steal = timeOnce(lambda: dictSteal(players))
+        times = [timeOnce(lambda: dictRegen(players)),
+                 timeOnce(lambda: dictNuke(players)),
+                 timeOnce(lambda: dictRefresh(players)), steal]
+        print("{:>8} {:<8} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            count, "dicts", size / count, *times))
+        del players
+    #}}}
+    return 0
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# Last Updated: 2.4.0
+# Microbenchmark for event parsing and dispatch. Pushes a synthetic rtm mix,
+# mostly typing and presence noise like a real workspace, straight through
+# Event.parse and Duckbot.handleEvent with no network involved, next to the
+# dict backed Event and if/elif dispatch they replaced
+# Usage (from the duckbot directory):
+#   python -m bench.events [--events N] [--noise PCT]
+# Python imports
+import os
+import sys
+import time
+import random
+import argparse
+# Project imports
+import util.common as util
+from util.logger import Logger
+from util.apiPool import ApiPool
+from util.event import Event
+from util.replay import FakeSlackClient
+
+BOT_ID = "UDUCKBOT0"
+CHANNEL = "C00000001"
+
+#{{{ - Dict backed Event and if/elif dispatch, as they were before
+class DictEvent:
+    # Fields a frame didn't set read as None, like on the slotted Event
+    subtype = user = text = ts = channel = name = None
+
+    def __init__(self, event_p):
+        self.type = event_p["type"] if "type" in event_p else None
+        if self.type in self.EVENT_PARSERS:
+            self.EVENT_PARSERS[self.type](self, event_p)
+
+    def parseMessageEvent(event_new, event_old):
+        if "user" in event_old and event_old["user"] == "USLACKBOT":
+            event_new.type = None
+            return
+        event_new.channel = event_old["channel"]
+        if "subtype" not in event_old:
+            event_new.user = event_old["user"]
+            event_new.text = event_old["text"]
+            event_new.ts   = event_old["ts"]
+        elif event_old["subtype"] == "message_changed":
+            event_new.user = event_old["message"]["user"]
+            event_new.text = event_old["message"]["text"]
+            event_new.ts   = event_old["message"]["ts"]
+        elif event_old["subtype"] == "channel_purpose":
+            event_new.user = event_old["user"]
+            event_new.text = event_old["purpose"]
+            event_new.ts   = event_old["ts"]
+            event_new.type = "update"
+            event_new.subtype = "channel_purpose"
+        elif event_old["subtype"] == "bot_message":
+            event_new.type = "bot_message"
+            event_new.text = event_old["text"]
+            event_new.user = event_old["bot_id"]
+            event_new.name = event_old["username"]
+            event_new.ts   = event_old["ts"]
+        else:
+            event_new.type = None
+
+    def parseReactionAddedEvent(event_new, event_old):
+        event_new.user     = event_old["user"]
+        event_new.reaction = {
+             "emoji" : event_old["reaction"]
+            ,"type"  : event_old["item"]["type"]
+        }
+        if event_new.reaction["type"] == "message":
+            event_new.channel = event_old["item"]["channel"]
+            event_new.ts      = event_old["item"]["ts"]
+        elif (event_new.reaction["type"] == "file" or
+              event_new.reaction["type"] == "file_comment"):
+            event_new.file = event_old["item"]["file"]
+
+    def parseTeamJoinEvent(event_new, event_old):
+        event_new.user = event_old["user"]["id"]
+
+    def parseChannelJoinedEvent(event_new, event_old):
+        event_new.type    = "update"
+        event_new.subtype = "channel_joined"
+        event_new.channel = event_old["channel"]["id"]
+        event_new.channel_data = event_old["channel"]
+
+    EVENT_PARSERS = {
+         "message"        : parseMessageEvent
+        ,"reaction_added" : parseReactionAddedEvent
+        ,"team_join"      : parseTeamJoinEvent
+        ,"channel_joined" : parseChannelJoinedEvent
+    }
+
+def chainDispatch(duckbot, event_p):
+    event = DictEvent(event_p)
+    if event.type == None:
+        return 0
+    elif event.type == "message":
+        return duckbot._handleMessage(event)
+    elif event.type == "bot_message":
+        return duckbot._handleBotMessage(event)
+    elif event.type == "update":
+        if (event.subtype == "channel_purpose" or
+            event.subtype == "channel_joined"):
+            duckbot._channelListUpdate(event)
+        return 0
+    else:
+        return 0
+#}}}
+
+# Build the frames to push
+# Params: count - number of frames
+#         noise - percent of frames that are typing/presence noise
+#         seed  - random seed
+# Return: list of raw rtm events
+def buildFrames(count, noise, seed):
+#{{{
+    rand = random.Random(seed)
+    frames = []
+    for num in range(count):
+        user = "U" + str(rand.randrange(1000)).zfill(8)
+        ts = str(num)
+        if rand.random() * 100 < noise:
+            if rand.random() < 0.7:
+                frames.append({"type": "user_typing", "channel": CHANNEL,
+                               "user": user})
+            else:
+                frames.append({"type": "presence_change", "user": user,
+                               "presence": "active"})
+        elif rand.random() < 0.9:
+            frames.append({"type": "message", "channel": CHANNEL, "user": user,
+                           "text": "just some chatter " + ts, "ts": ts})
+        else:
+            frames.append({"type": "message", "channel": CHANNEL, "user": user,
+                           "text": ":duckbot: coin", "ts": ts})
+    return frames
+#}}}
+
+# Time a function over every frame
+# Params: func   - function taking one raw event
+#         frames - list of raw rtm events
+# Return: nanoseconds per frame
+def timePerFrame(func, frames):
+#{{{
+    start = time.perf_counter_ns()
+    for frame in frames:
+        func(frame)
+    return (time.perf_counter_ns() - start) / len(frames)
+#}}}
+
+# Count memory blocks held per parsed frame
+# Params: parse  - function turning a raw event into an event or None
+#         frames - list of raw rtm events
+# Return: blocks per frame that parsed into an event, bytes per event
+def parseFootprint(parse, frames):
+#{{{
+    before = sys.getallocatedblocks()
+    events = [parse(frame) for frame in frames]
+    kept = [event for event in events
+            if event is not None and event.type is not None]
+    blocks = sys.getallocatedblocks() - before
+    size = sum(sys.getsizeof(event) + sys.getsizeof(getattr(event, "__dict__", 0))
+               for event in kept[:1000]) / max(1, min(1000, len(kept)))
+    return blocks / max(1, len(kept)), size
+#}}}
+
+# Mainline code
+# Params: None
+# Return: 0
+def main():
+#{{{
+    cl_parser = argparse.ArgumentParser(description='Event dispatch microbenchmark')
+    cl_parser.add_argument('--events', type=int, default=200000)
+    cl_parser.add_argument('--noise', type=float, default=70,
+                           help='percent of frames that are typing/presence')
+    cl_parser.add_argument('--seed', type=int, default=0)
+    args = cl_parser.parse_args()
+
+    # Same globals the replayer sets, no sockets and a quiet log
+    from duckbot import Duckbot
+    random.seed(args.seed)
+    util.debug = False
+    util.bank_file = False
+    util.outbox = None
+    util.logger = Logger(fn=os.devnull)
+    util.sc = FakeSlackClient(BOT_ID)
+    util.api_pool = ApiPool()
+    duckbot = Duckbot(BOT_ID, {})
+
+    frames = buildFrames(args.events, args.noise, args.seed)
+    # The old path first, it doesn't fill the seen cache the new one checks
+    paths = (("old", DictEvent, lambda frame: chainDispatch(duckbot, frame)),
+             ("new", Event.parse, duckbot.handleEvent))
+    results = []
+    for name, parse, dispatch in paths:
+        blocks, size = parseFootprint(parse, frames)
+        results.append((name, timePerFrame(parse, frames), blocks, size,
+                        timePerFrame(dispatch, frames)))
+    util.api_pool.shutdown()
+
+    print("{} frames, {:.0f}% noise".format(args.events, args.noise))
+    for name, parse_ns, blocks, size, dispatch_ns in results:
+        print("{} parse     {:>8.0f} ns/frame  {:>5.2f} blocks/event  {:>5.0f} bytes/event".format(
+            name, parse_ns, blocks, size))
+        print("{} dispatch  {:>8.0f} ns/frame  {:>9.0f} frames/sec".format(
+            name, dispatch_ns, 1e9 / dispatch_ns))
+    return 0
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
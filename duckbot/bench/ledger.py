@@ -0,0 +1,97 @@
+# Last Updated: 2.4.0
+# Ledger benchmark. Bets and pulls through the bank with the ledger noting
+# them, next to the same with recording switched off, then a history page
+# read once most of it has spilled to the ledger file, and the ledger
+# opened again with its saved index and without
+# Usage (from the duckbot directory):
+#   python -m bench.ledger [--players N] [--ops N]
+# Python imports
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+# Project imports
+import util.common as util
+from util.bank import Bank
+from util.ledger import Ledger
+
+# Time bets and pulls on a bank
+# Params: bank  - Bank to hit
+#         users - user id to use for each op
+# Return: microseconds per bet and per pull
+def timeOps(bank, users):
+#{{{
+    roll = lambda: 2
+    start = time.perf_counter()
+    for user in users:
+        bank.settleBet(user, 1, True)
+    bet = time.perf_counter() - start
+    start = time.perf_counter()
+    for user in users:
+        bank.pull(user, 1, 0, roll)
+    pull = time.perf_counter() - start
+    return bet * 1e6 / len(users), pull * 1e6 / len(users)
+#}}}
+
+# Mainline code
+# Params: None
+# Return: 0
+def main():
+#{{{
+    cl_parser = argparse.ArgumentParser(description='Ledger benchmark')
+    cl_parser.add_argument('--players', type=int, default=10000)
+    cl_parser.add_argument('--ops', type=int, default=200000)
+    cl_parser.add_argument('--seed', type=int, default=0)
+    args = cl_parser.parse_args()
+    util.bank_file = False
+    rand = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as folder:
+    #{{{
+        bank = Bank(store=None)
+        bank.ledger = Ledger(bank, os.path.join(folder, "bank.ledger"))
+        # Frozen clock, regen would add entries of its own
+        now = time.time()
+        bank.clock = lambda: now
+        bank.gacha_pool = list(Bank.DEFAULT_POOL)
+        users = ["U" + str(num).zfill(8) for num in range(args.players)]
+        for user in users:
+            bank.addUser(user)
+        ops = [rand.choice(users) for _ in range(args.ops)]
+
+        print("{:<10} {:>10} {:>10}".format("ledger", "bet us", "pull us"))
+        print("{:<10} {:>10.2f} {:>10.2f}".format("on", *timeOps(bank, ops)))
+        record = bank.ledger.record
+        bank.ledger.record = lambda *entry: None
+        print("{:<10} {:>10.2f} {:>10.2f}".format("off", *timeOps(bank, ops)))
+        bank.ledger.record = record
+
+        bank.flush()
+        start = time.perf_counter()
+        bank.history(ops[0], 0, 10)
+        first = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for user in ops[:1000]:
+            bank.history(user, Ledger.RING_SIZE, 10)
+        page = (time.perf_counter() - start) * 1000 / 1000
+        print(str(bank.ledger.records) + " records spilled, first history"
+              " " + str(round(first, 1)) + " ms, pages past the ring"
+              " " + str(round(page, 3)) + " ms")
+        bank.ledger.close()
+
+        # Opening indexes the file, from the saved index then without it
+        for name in ("saved index", "no index"):
+            start = time.perf_counter()
+            bank.ledger = Ledger(bank, bank.ledger.fn)
+            opened = (time.perf_counter() - start) * 1000
+            print("open with " + name + " " + str(round(opened, 1)) + " ms")
+            bank.ledger.close()
+            os.remove(bank.ledger.index_fn)
+    #}}}
+    return 0
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
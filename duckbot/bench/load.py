@@ -0,0 +1,317 @@
+# Last Updated: 2.4.0
+# Run the bot end to end against a local fake slack and push synthetic
+# load at it, reporting reply latency as seen on the wire
+# Usage (from the duckbot directory):
+#   python -m bench.load [--rate N] [--duration S] [--mix kind=weight,...]
+#                        [--channels N] [--users N] [--async] [--ramp]
+# Python imports
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+# Project imports
+import util.common as util
+from util.logger import Logger
+from util.replay import percentile
+from util.fakeSlack import FakeSlackServer
+import main as duckmain
+
+BOT_ID = "UDUCKBOT0"
+MENTION_REGEX = re.compile(r"^<@(U[A-Z0-9]{8})>", re.MULTILINE)
+DEFAULT_MIX = "chatter=60,mention=10,roll=10,bet=8,pull=5,bot=5,purpose=2"
+# Kinds of events that get a reply to time
+COMMANDS = {
+     "roll" : ":duckbot: roll 2d20"
+    ,"bet"  : "<@" + BOT_ID + "> bet 1 coin heads"
+    ,"pull" : "<@" + BOT_ID + "> pull"
+}
+
+# Load generator class
+# Emits a weighted mix of events at a target rate and matches replies back
+# to the commands that caused them
+class LoadGenerator:
+
+    # Constructor for load generator
+    # Params: server   - running FakeSlackServer
+    #         mix      - dict of event kind to weight
+    #         channels - list of channel ids to spread events over
+    #         users    - number of synthetic users
+    #         seed     - random seed
+    # Return: LoadGenerator instance
+    def __init__(self, server, mix, channels, users, seed = 0):
+    #{{{
+        self.server = server
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.channels = channels
+        self.users = ["U" + str(num).zfill(8) for num in range(users)]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # user to time their command hit the wire, None until it does
+        self.pending = {}
+        self.latencies = []
+        self.ts = 0
+        server.on_send = self._onSend
+        server.on_message = self._onMessage
+    #}}}
+
+    # Sign every user up to the bank and wait for the replies
+    # Params: timeout - most seconds to wait
+    # Return: None
+    def warmup(self, timeout = 30):
+    #{{{
+        for user in self.users:
+            self._command(user, "<@" + BOT_ID + "> join")
+        self._settle(timeout)
+        self.latencies = []
+    #}}}
+
+    # Push load for a while
+    # Params: rate     - target events per second
+    #         duration - seconds to push for
+    #         grace    - seconds to wait for stragglers after
+    # Return: dict of results
+    def run(self, rate, duration, grace = 5):
+    #{{{
+        self.latencies = []
+        commands = 0
+        sent = 0
+        start = time.monotonic()
+        interval = 1 / rate
+        while time.monotonic() - start < duration:
+        #{{{
+            # Pace off the schedule, not the last send, so we don't drift
+            target = start + sent * interval
+            delay = target - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            kind = self.random.choices(self.kinds, self.weights)[0]
+            if kind in COMMANDS:
+                user = self._idleUser()
+                if user:
+                    self._command(user, COMMANDS[kind])
+                    commands += 1
+                else:
+                    kind = "chatter"
+            if kind not in COMMANDS:
+                self.server.push(self._event(kind))
+            sent += 1
+        #}}}
+        pushed = time.monotonic() - start
+        lost = self._settle(grace)
+        times = sorted(self.latencies)
+        return {
+             "rate"     : rate
+            ,"sent"     : sent
+            ,"achieved" : sent / pushed
+            ,"commands" : commands
+            ,"replies"  : len(times)
+            ,"lost"     : lost
+            ,"p50"      : percentile(times, 50)
+            ,"p99"      : percentile(times, 99)
+        }
+    #}}}
+
+    # Build a non command event
+    # Params: kind - event kind from the mix
+    # Return: raw rtm event
+    def _event(self, kind):
+    #{{{
+        self.ts += 1
+        channel = self.random.choice(self.channels)
+        user = self.random.choice(self.users)
+        event = {"type": "message", "channel": channel, "user": user,
+                 "ts": str(self.ts)}
+        if kind == "mention":
+            event["text"] = "<@" + BOT_ID + "> what do you think about this"
+        elif kind == "bot":
+            event["subtype"] = "bot_message"
+            event["bot_id"] = "B" + str(self.random.randrange(10)).zfill(8)
+            event["username"] = "loadbot"
+            event["text"] = "beep boop"
+            del event["user"]
+        elif kind == "purpose":
+            event["subtype"] = "channel_purpose"
+            event["purpose"] = "[:label: :slot_machine:]"
+        else:
+            event["text"] = "just some chatter going on in here " + str(self.ts)
+        return event
+    #}}}
+
+    # Push a command from a user and start timing it
+    # Params: user - user id sending
+    #         text - command text
+    # Return: None
+    def _command(self, user, text):
+    #{{{
+        self.ts += 1
+        with self.lock:
+            self.pending[user] = None
+        self.server.push({"type": "message",
+                          "channel": self.random.choice(self.channels),
+                          "user": user, "text": text, "ts": str(self.ts),
+                          "client_msg_id": user})
+    #}}}
+
+    # Pick a user with no command waiting on a reply
+    # Params: None
+    # Return: user id or None if everyone is busy
+    def _idleUser(self):
+    #{{{
+        for _ in range(8):
+            user = self.random.choice(self.users)
+            if user not in self.pending:
+                return user
+        return None
+    #}}}
+
+    # Wait for outstanding replies
+    # Params: timeout - most seconds to wait
+    # Return: number of commands that never got a reply
+    def _settle(self, timeout):
+    #{{{
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self.lock:
+            lost = len(self.pending)
+            self.pending.clear()
+        return lost
+    #}}}
+
+    # Server hook, stamp commands as they go out on the wire
+    # Params: event - raw rtm event written
+    #         stamp - monotonic time written
+    # Return: None
+    def _onSend(self, event, stamp):
+    #{{{
+        user = event.get("client_msg_id")
+        if user:
+            with self.lock:
+                if user in self.pending:
+                    self.pending[user] = stamp
+    #}}}
+
+    # Server hook, match a reply to the commands it answers
+    # Params: data  - frame sent by the bot
+    #         stamp - monotonic time received
+    # Return: None
+    def _onMessage(self, data, stamp):
+    #{{{
+        # Replies for the same channel can be merged, one per line
+        with self.lock:
+            for user in MENTION_REGEX.findall(data.get("text", "")):
+                sent = self.pending.get(user)
+                if sent is not None:
+                    self.latencies.append(stamp - sent)
+                    del self.pending[user]
+    #}}}
+
+# Parse the mix option
+# Params: text - kind=weight pairs, comma separated
+# Return: dict of kind to weight
+def parseMix(text):
+#{{{
+    mix = {}
+    for pair in text.split(","):
+        kind, weight = pair.split("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+#}}}
+
+# Print one result line
+# Params: result - dict from LoadGenerator.run
+# Return: None
+def report(result):
+#{{{
+    print("target {:>7.0f}/s  achieved {:>7.0f}/s  commands {:>6}  replies {:>6}"
+          "  lost {:>5}  p50 {:>8.2f}ms  p99 {:>8.2f}ms".format(
+            result["rate"], result["achieved"], result["commands"],
+            result["replies"], result["lost"],
+            result["p50"] * 1000, result["p99"] * 1000))
+#}}}
+
+# Mainline code
+# Params: None
+# Return: 0
+def main():
+#{{{
+    cl_parser = argparse.ArgumentParser(description='Load test Duckbot locally')
+    cl_parser.add_argument('--rate', type=float, default=50)
+    cl_parser.add_argument('--duration', type=float, default=10)
+    cl_parser.add_argument('--mix', default=DEFAULT_MIX)
+    cl_parser.add_argument('--channels', type=int, default=20)
+    cl_parser.add_argument('--users', type=int, default=200)
+    cl_parser.add_argument('--async', dest='aio', action='store_true')
+    cl_parser.add_argument('--ramp', action='store_true')
+    cl_parser.add_argument('--slo', type=float, default=1.0,
+                           help='p99 seconds allowed while ramping')
+    cl_parser.add_argument('--max-rate', dest='max_rate', type=float,
+                           default=10000)
+    cl_parser.add_argument('--seed', type=int, default=0)
+    args = cl_parser.parse_args()
+
+    channels = [{"id": "C" + str(num).zfill(8), "name": "load" + str(num),
+                 "purpose": {"value": "[:label: :slot_machine:]"}}
+                for num in range(args.channels)]
+    server = FakeSlackServer(BOT_ID, channels)
+    server.start()
+
+    # Same globals initProgram would set, quiet logging
+    util.debug = False
+    util.bank_file = False
+    util.aio = args.aio
+    util.recorder = None
+    util.logger = Logger(fn=os.devnull)
+    return_code, duckbot = duckmain.duckboot("xoxb-local", server.client)
+    if return_code:
+        print("Bot failed to start, RC=" + str(return_code))
+        return return_code
+    bot_thread = threading.Thread(target=duckmain.start, args=(duckbot,),
+                                  daemon=True)
+    bot_thread.start()
+
+    # Let the channel list stream in so gambling channels are approved
+    deadline = time.monotonic() + 10
+    while len(duckbot.channels) < len(channels) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    generator = LoadGenerator(server, parseMix(args.mix),
+                              [channel["id"] for channel in channels],
+                              args.users, args.seed)
+    generator.warmup()
+
+    rate = args.rate
+    best = None
+    while True:
+        result = generator.run(rate, args.duration)
+        report(result)
+        if not args.ramp:
+            break
+        # Stop ramping once replies go missing, get too slow or we can't
+        # push any faster ourselves
+        if (result["lost"] or result["p99"] > args.slo or
+            result["achieved"] < 0.9 * rate or rate >= args.max_rate):
+            break
+        best = result
+        rate *= 2
+    if args.ramp:
+        if best:
+            print("Max sustainable rate: {:.0f} events/s".format(best["achieved"]))
+        else:
+            print("No sustainable rate found at or above " + str(args.rate))
+
+    # Shut the bot down the same way a user would
+    generator._command(generator.users[0], "<@" + BOT_ID + "> update")
+    bot_thread.join(10)
+    util.api_pool.shutdown()
+    util.work_pool.shutdown()
+    server.stop()
+    return 0
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# Last Updated: 2.4.0
+# Leaderboard benchmark. Time to build the boards once, then a top 10, a
+# rank lookup and a balance change with the boards kept up, next to sorting
+# everyone for each query the way a board without the index would
+# Usage (from the duckbot directory):
+#   python -m bench.rank [--players N ...] [--queries N]
+# Python imports
+import sys
+import time
+import random
+import argparse
+# Project imports
+import util.common as util
+from util.bank import Bank
+from bench.bank import buildBank, timeOnce
+
+#{{{ - Sort everyone per query
+def sortTop(bank, count):
+    return sorted(range(len(bank.users)),
+                  key=lambda row: -bank.balances[row])[:count]
+
+def sortRank(bank, user):
+    score = bank.balances[bank.index[user]]
+    return sum(1 for balance in bank.balances if balance > score) + 1
+#}}}
+
+# Time a function over some calls
+# Params: func  - function taking one argument
+#         args  - argument for each call
+# Return: milliseconds per call
+def timeEach(func, args):
+#{{{
+    start = time.perf_counter()
+    for arg in args:
+        func(arg)
+    return (time.perf_counter() - start) * 1000 / len(args)
+#}}}
+
+# Mainline code
+# Params: None
+# Return: 0
+def main():
+#{{{
+    cl_parser = argparse.ArgumentParser(description='Leaderboard benchmark')
+    cl_parser.add_argument('--players', type=int, nargs='+',
+                           default=[100000, 1000000])
+    cl_parser.add_argument('--queries', type=int, default=1000)
+    cl_parser.add_argument('--seed', type=int, default=0)
+    args = cl_parser.parse_args()
+    util.bank_file = False
+
+    print("{:>8} {:<8} {:>10} {:>10} {:>10} {:>10}".format(
+        "players", "board", "build ms", "top ms", "rank ms", "update ms"))
+    for count in args.players:
+    #{{{
+        rand = random.Random(args.seed)
+        bank = buildBank(count, rand)
+        # Frozen clock, regen settling would count as an update
+        now = time.time()
+        bank.clock = lambda: now
+        users = [rand.choice(bank.users) for _ in range(args.queries)]
+        build = timeOnce(bank._getBoards)
+        board = Bank.BALANCE_BOARD
+        times = [timeEach(lambda _: bank.leaders(board, 10), users),
+                 timeEach(lambda user: bank.rank(board, user), users),
+                 timeEach(lambda user: bank.balance(user, rand.randrange(-5, 6)),
+                          users)]
+        print("{:>8} {:<8} {:>10.1f} {:>10.4f} {:>10.4f} {:>10.4f}".format(
+            count, "ranked", build, *times))
+
+        # Sorting is slow enough that a few queries tell the story
+        few = users[:10]
+        times = [timeEach(lambda _: sortTop(bank, 10), few),
+                 timeEach(lambda user: sortRank(bank, user), few)]
+        print("{:>8} {:<8} {:>10} {:>10.4f} {:>10.4f} {:>10}".format(
+            count, "sorted", "-", *times, "-"))
+        del bank
+    #}}}
+    return 0
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+# Last Updated: 2.4.0
+# Replay a recorded rtm capture through the bot and report timings
+# Usage (from the duckbot directory):
+#   python -m bench.replay <capture> [--realtime] [--sent]
+# Python imports
+import sys
+import argparse
+# Project imports
+from util.replay import Replayer
+
+# Mainline code
+# Params: None
+# Return: 0
+def main():
+#{{{
+    cl_parser = argparse.ArgumentParser(description='Replay an rtm capture')
+    cl_parser.add_argument('capture')
+    cl_parser.add_argument('--realtime', action='store_true')
+    cl_parser.add_argument('--sent', action='store_true')
+    cl_parser.add_argument('--seed', type=int, default=0)
+    args = cl_parser.parse_args()
+
+    replayer = Replayer(args.capture, realtime=args.realtime, seed=args.seed)
+    results = replayer.replay()
+    for line in replayer.report(results):
+        print(line)
+    # Show what the bot would have said
+    if args.sent:
+        for channel, message in results["sent"]:
+            print(channel + ": " + message.replace("\n", "\n    "))
+    return 0
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
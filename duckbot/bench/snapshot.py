@@ -0,0 +1,68 @@
+# Last Updated: 2.4.0
+# Bank snapshot benchmark. Save and load times of the bank.dat text format
+# next to the bank.bin binary one, load being a whole Bank read back in
+# Usage (from the duckbot directory):
+#   python -m bench.snapshot [--players N ...] [--runs N]
+# Python imports
+import os
+import sys
+import random
+import argparse
+import tempfile
+# Project imports
+import util.common as util
+from util.bank import Bank
+from util.bankStore import FileStore, BinaryStore
+from bench.bank import buildBank
+from bench.store import timeRuns
+
+# Check a loaded bank came back the same as the one saved
+# Params: bank   - bank that was saved
+#         loaded - bank read back in
+# Return: True if every column matches
+def sameBank(bank, loaded):
+#{{{
+    return (bank.users == loaded.users and bank.balances == loaded.balances and
+            bank.pools == loaded.pools and bank.pulled == loaded.pulled and
+            bank.settled == loaded.settled and
+            list(bank.gacha_pool) == list(loaded.gacha_pool))
+#}}}
+
+# Mainline code
+# Params: None
+# Return: 0 if every format read back what it wrote, 1 otherwise
+def main():
+#{{{
+    cl_parser = argparse.ArgumentParser(description='Bank snapshot benchmark')
+    cl_parser.add_argument('--players', type=int, nargs='+',
+                           default=[100000, 1000000])
+    cl_parser.add_argument('--runs', type=int, default=5)
+    cl_parser.add_argument('--seed', type=int, default=0)
+    args = cl_parser.parse_args()
+    # Banks get their store handed in
+    util.bank_file = False
+
+    return_code = 0
+    print("{:>8}  {:<8} {:>10} {:>12} {:>12} {:>6}".format(
+        "players", "format", "size KB", "save ms", "load ms", "same"))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for count in args.players:
+        #{{{
+            bank = buildBank(count, random.Random(args.seed))
+            for name, store in (
+                     ("text",   FileStore(os.path.join(temp_dir, "bank.dat")))
+                    ,("binary", BinaryStore(os.path.join(temp_dir, "bank.bin"),
+                                            import_fn=None))):
+                save, _ = timeRuns(lambda: store.save(bank), args.runs)
+                load, _ = timeRuns(lambda: Bank(store=store), args.runs)
+                same = sameBank(bank, Bank(store=store))
+                return_code |= not same
+                print("{:>8}  {:<8} {:>10.0f} {:>12.2f} {:>12.2f} {:>6}".format(
+                    count, name, os.path.getsize(store.fn) / 1024, save, load,
+                    str(same)))
+        #}}}
+    return return_code
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# Last Updated: 2.4.0
+# Time a cold start against a local fake slack, from the first import to the
+# first reply, with and without the startup cache. Every run is a fresh
+# process so imports count
+# Usage (from the duckbot directory):
+#   python -m bench.startup [--runs N] [--channels N] [--api-delay S]
+# Python imports
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+BOT_ID = "UDUCKBOT0"
+
+# Start the bot once and time it, run in a child process
+# Params: args - parsed command line
+# Return: None, prints timings as a json line
+def child(args):
+#{{{
+    start = time.perf_counter()
+    import util.common as util
+    from util.logger import Logger
+    from util.startCache import StartCache
+    import main as duckmain
+    imported = time.perf_counter()
+
+    # Server start up isn't part of the bot's time
+    from util.fakeSlack import FakeSlackServer
+    channels = [{"id": "C" + str(num).zfill(8), "name": "chan" + str(num),
+                 "purpose": {"value": "[:label: :slot_machine: :duckbot:]"}}
+                for num in range(args.channels)]
+    server = FakeSlackServer(BOT_ID, channels)
+    server.api_delay = args.api_delay
+    server.start()
+    replied = threading.Event()
+    reply = [None]
+    def onMessage(data, stamp):
+        reply[0] = time.perf_counter()
+        replied.set()
+    server.on_message = onMessage
+
+    booting = time.perf_counter()
+    util.debug = False
+    util.bank_file = False
+    util.aio = False
+    util.recorder = None
+    util.start_cache = StartCache(args.cache_file) if args.cache_file else None
+    util.logger = Logger(fn=os.devnull)
+    return_code, duckbot = duckmain.duckboot("xoxb-local", server.client)
+    booted = time.perf_counter()
+    bot_thread = threading.Thread(target=duckmain.start, args=(duckbot,),
+                                  daemon=True)
+    bot_thread.start()
+    server.push({"type": "message", "channel": channels[0]["id"],
+                 "user": "U00000001", "text": ":duckbot: roll 1d6", "ts": "1"})
+    replied.wait(10)
+
+    print(json.dumps({
+         "import" : imported - start
+        ,"boot"   : booted - booting
+        ,"reply"  : (imported - start) + (reply[0] - booting)
+    }))
+    # Let the channel stream finish so the cache gets written
+    deadline = time.monotonic() + 60
+    while (len(duckbot.channels) < len(channels) and
+           time.monotonic() < deadline):
+        time.sleep(0.05)
+    time.sleep(0.2)
+    server.push({"type": "message", "channel": channels[0]["id"],
+                 "user": "U00000001", "text": "<@" + BOT_ID + "> update",
+                 "ts": "2"})
+    bot_thread.join(10)
+    util.api_pool.shutdown()
+    util.work_pool.shutdown()
+    server.stop()
+#}}}
+
+# Run one child and get its timings
+# Params: args       - parsed command line
+#         cache_file - cache file for the child, None for no cache
+# Return: dict of timings
+def runChild(args, cache_file):
+#{{{
+    command = [sys.executable, "-m", "bench.startup", "--child",
+               "--channels", str(args.channels),
+               "--api-delay", str(args.api_delay)]
+    if cache_file:
+        command += ["--cache-file", cache_file]
+    output = subprocess.run(command, capture_output=True, text=True,
+                            check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+#}}}
+
+# Print the median of each timing
+# Params: name - label for the line
+#         runs - list of timing dicts
+# Return: None
+def report(name, runs):
+#{{{
+    def median(key):
+        values = sorted(run[key] for run in runs)
+        return values[len(values) // 2] * 1000
+    print("{:<10} import {:>8.1f}ms  boot {:>8.1f}ms  first reply {:>8.1f}ms".format(
+        name, median("import"), median("boot"), median("reply")))
+#}}}
+
+# Mainline code
+# Params: None
+# Return: 0
+def main():
+#{{{
+    cl_parser = argparse.ArgumentParser(description='Time Duckbot startup')
+    cl_parser.add_argument('--runs', type=int, default=5)
+    cl_parser.add_argument('--channels', type=int, default=2000)
+    cl_parser.add_argument('--api-delay', dest='api_delay', type=float,
+                           default=0.2, help='seconds added to each api call')
+    cl_parser.add_argument('--child', action='store_true')
+    cl_parser.add_argument('--cache-file', dest='cache_file', default=None)
+    args = cl_parser.parse_args()
+    if args.child:
+        child(args)
+        return 0
+
+    print("{} runs, {} channels, {}s api delay".format(
+        args.runs, args.channels, args.api_delay))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_file = os.path.join(temp_dir, "startup.cache")
+        report("no cache", [runChild(args, None) for _ in range(args.runs)])
+        # First run writes the cache, the rest start off it
+        runChild(args, cache_file)
+        report("cached", [runChild(args, cache_file) for _ in range(args.runs)])
+    return 0
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
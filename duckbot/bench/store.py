@@ -0,0 +1,113 @@
+# Last Updated: 2.4.0
+# Bank persistence benchmark. Times a full bank.dat rewrite, which is all the
+# file store can do, against sqlite commits and synced journal appends of the
+# players changed since the last flush
+# Usage (from the duckbot directory):
+#   python -m bench.store [--players N ...] [--batch N ...] [--runs N]
+# Python imports
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+# Project imports
+import util.common as util
+from util.bank import Bank
+from util.bankStore import FileStore, SqliteStore, JournalStore
+
+# Build a bank full of players with no store behind it
+# Params: count - number of players
+#         rand  - random.Random to fill with
+# Return: Bank instance
+def buildBank(count, rand):
+#{{{
+    bank = Bank(store=None)
+    for num in range(count):
+        user = "U" + str(num).zfill(8)
+        bank.addUser(user)
+        bank.balance(user, rand.randrange(1000) - Bank.STARTING_BUX)
+        base = num * Bank.POOL_SIZE
+        for pid in range(Bank.POOL_SIZE):
+            bank.pools[base + pid] = rand.randrange(5)
+        bank.setFreePull(rand.random() < 0.5, user)
+    return bank
+#}}}
+
+# Time a function a number of times
+# Params: func - function taking no arguments
+#         runs - number of timed calls
+#         prep - function to call untimed before each run
+# Return: median and worst time in milliseconds
+def timeRuns(func, runs, prep = None):
+#{{{
+    times = []
+    for _ in range(runs):
+        if prep:
+            prep()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2], times[-1]
+#}}}
+
+# Mainline code
+# Params: None
+# Return: 0
+def main():
+#{{{
+    cl_parser = argparse.ArgumentParser(description='Bank store benchmark')
+    cl_parser.add_argument('--players', type=int, nargs='+',
+                           default=[10000, 100000])
+    cl_parser.add_argument('--batch', type=int, nargs='+', default=[1, 50],
+                           help='players changed between flushes')
+    cl_parser.add_argument('--runs', type=int, default=20)
+    cl_parser.add_argument('--seed', type=int, default=0)
+    args = cl_parser.parse_args()
+    rand = random.Random(args.seed)
+    # Banks get their store handed in, nothing read from disk
+    util.bank_file = False
+
+    print("{:>8}  {:<22} {:>10} {:>10}".format("players", "write", "median ms",
+                                               "worst ms"))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for count in args.players:
+        #{{{
+            bank = buildBank(count, rand)
+            users = list(bank.users)
+
+            file_store = FileStore(os.path.join(temp_dir, "bank.dat"))
+            median, worst = timeRuns(lambda: file_store.save(bank), args.runs)
+            print("{:>8}  {:<22} {:>10.2f} {:>10.2f}".format(
+                count, "bank.dat rewrite", median, worst))
+
+            db_fn = os.path.join(temp_dir, "bank" + str(count) + ".db")
+            sql_store = SqliteStore(db_fn, import_fn=None)
+            sql_store.markAll()
+            sql_store.markPool()
+            sql_store.flush(bank)
+            journal_store = JournalStore(file_store.fn,
+                                         os.path.join(temp_dir, "bank.journal"))
+            journal_store.load()
+            # Big enough that the timed flushes never compact
+            journal_store.COMPACT_MIN = 1 << 40
+            for name, store in (("sqlite commit", sql_store),
+                                ("journal append", journal_store)):
+                for size in args.batch:
+                    # Change a batch of players the way commands would
+                    def change():
+                        for user in rand.sample(users, size):
+                            bank.balance(user, 1)
+                            store.mark(user)
+                    median, worst = timeRuns(lambda: store.flush(bank),
+                                             args.runs, change)
+                    print("{:>8}  {:<22} {:>10.2f} {:>10.2f}".format(
+                        count, name + " " + str(size), median, worst))
+                store.close()
+        #}}}
+    return 0
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
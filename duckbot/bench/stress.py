@@ -0,0 +1,132 @@
+# Last Updated: 2.4.0
+# Bank concurrency stress check. Threads hammer one bank with bets, pulls
+# and transfers through the transactions, then the totals get checked: bux
+# only move by what the transactions said they did, no item is made or lost
+# between the players and the gacha pool, and the pool indexes still match
+# the pools
+# Usage (from the duckbot directory):
+#   python -m bench.stress [--players N] [--threads N] [--ops N]
+# Python imports
+import sys
+import time
+import random
+import argparse
+import threading
+# Project imports
+import util.common as util
+from util.bank import Bank
+
+# One thread's worth of transactions
+# Params: bank    - Bank to hit
+#         users   - user ids to pick from
+#         ops     - number of transactions
+#         seed    - seed for this thread
+#         results - list to put (bux moved, counts) on when done
+# Return: None
+def worker(bank, users, ops, seed, results):
+#{{{
+    rand = random.Random(seed)
+    # Pulls without nukes, a nuke wipes items out and nothing would add up
+    roll = lambda: rand.choice((-1, rand.randrange(Bank.POOL_SIZE)))
+    moved = 0
+    counts = {"bet": 0, "pull": 0, "transfer": 0, "refused": 0}
+    for _ in range(ops):
+        user = rand.choice(users)
+        kind = rand.choice(("bet", "pull", "transfer"))
+        if kind == "bet":
+            amount = rand.randrange(1, 50)
+            won = rand.random() < 0.5
+            done = bank.settleBet(user, amount, won) is not None
+            if done:
+                moved += amount if won else -amount
+        elif kind == "pull":
+            amount = rand.randrange(1, 4)
+            pulls = bank.pull(user, amount, 10, roll)
+            done = pulls is not None
+            if done:
+                moved -= (amount - pulls[0]) * 10
+        else:
+            done = bank.transfer(user, rand.choice(users), rand.randrange(1, 30))
+        counts[kind if done else "refused"] += 1
+    results.append((moved, counts))
+#}}}
+
+# Check the pool indexes against the pools
+# Params: bank - Bank to check
+# Return: True if every holder set and top matches
+def indexesMatch(bank):
+#{{{
+    size = Bank.POOL_SIZE
+    for pid in range(size):
+        holding = {row for row, count in enumerate(bank.pools[pid::size]) if count}
+        if holding != set(bank.holders[pid]):
+            return False
+    for row in range(len(bank.users)):
+        held = [pid for pid in range(size) if bank.pools[row * size + pid]]
+        if bank.tops[row] != (held[-1] if held else -1):
+            return False
+    return True
+#}}}
+
+# Mainline code
+# Params: None
+# Return: 0 if everything adds up, 1 otherwise
+def main():
+#{{{
+    cl_parser = argparse.ArgumentParser(description='Bank stress check')
+    cl_parser.add_argument('--players', type=int, default=200)
+    cl_parser.add_argument('--threads', type=int, default=8)
+    cl_parser.add_argument('--ops', type=int, default=2000,
+                           help='transactions per thread')
+    cl_parser.add_argument('--seed', type=int, default=0)
+    args = cl_parser.parse_args()
+    util.bank_file = False
+    # Switch threads as often as possible to shake out races
+    sys.setswitchinterval(1e-6)
+
+    bank = Bank(store=None)
+    # Frozen clock, regen would move bux on its own
+    now = time.time()
+    bank.clock = lambda: now
+    bank.gacha_pool = list(Bank.DEFAULT_POOL)
+    users = ["U" + str(num).zfill(8) for num in range(args.players)]
+    for user in users:
+        bank.addUser(user)
+        # Deep enough pockets that most transactions go through
+        bank.balance(user, 100000)
+    start_bux = sum(bank.balances)
+
+    results = []
+    threads = [threading.Thread(target=worker,
+                                args=(bank, users, args.ops, args.seed + num,
+                                      results))
+               for num in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    moved = sum(result[0] for result in results)
+    counts = {}
+    for _, thread_counts in results:
+        for kind, count in thread_counts.items():
+            counts[kind] = counts.get(kind, 0) + count
+    checks = {
+         "bux add up"    : sum(bank.balances) == start_bux + moved
+        ,"no overdrafts" : min(bank.balances) >= 0
+        ,"items add up"  : all(
+            sum(bank.pools[pid::Bank.POOL_SIZE]) + bank.gacha_pool[pid] == total
+            for pid, total in enumerate(Bank.DEFAULT_POOL) if total >= 0)
+        ,"indexes match" : indexesMatch(bank)
+    }
+    print(str(args.threads * args.ops) + " transactions in " +
+          str(round(elapsed, 2)) + "s " + str(counts))
+    for check, passed in checks.items():
+        print("{:<14} {}".format(check, "ok" if passed else "FAILED"))
+    return 0 if all(checks.values()) else 1
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,17 @@
-# Last Updated: 2.3.0
+# Last Updated: 2.4.0
+# Python imports
+import time
+import subprocess
+from datetime import datetime
 # Project imports
 import util.common as util
 from util.diagMessage import DiagMessage
 from util.event import Event
-from datetime import datetime
+from util.scheduler import Scheduler
+from util.reloader import Reloader
+from util.lazy import Lazy
+from util.prefilter import Prefilter
+from util.seenCache import SeenCache
 # Event handler imports
 from handlers.event.message import MessageHandler
 from handlers.event.bot import BotHandler
@@ -16,15 +24,22 @@ from handlers.command.gamble import GambleHandler
 # Duckbot class delegates event handlers and keeps track of time
 class Duckbot:
 
-    TICK_ROLLOVER = 3600 # 60 minutes
     WISH_TIME     = datetime(1,1,1,16) # 16:00
     WISH_CHANNEL  = 'random'
+    BOT_COOLDOWN  = 120 # seconds between bot interactions
+    LOOKUP_POLL   = 0.1 # seconds between bot lookup checks
+    DAY           = 86400
+    DAILY_SLACK   = 60  # daily jobs this close to their time just fired
+    UPDATE_POLL   = 0.5 # seconds between update pull checks
+    REFRESH_POLL  = 0.1 # seconds between channel stream checks
+    UPDATE_TIMEOUT = 120 # seconds to let git pull run
 
     # Constructor for the bot
     # Params: bot_id       - bot user id, used to detect mentions
-    #         bot_channels - dict containing channel ids to channel data
+    #         bot_channels - dict containing channel ids to Channel
+    #         clock        - monotonic clock for timers, replays swap it out
     # Return: Duckbot instance
-    def __init__(self, bot_id, bot_channels):
+    def __init__(self, bot_id, bot_channels, clock = time.monotonic):
     #{{{
         # Param fields
         self.id = bot_id
@@ -32,32 +47,65 @@ class Duckbot:
 
         self.debug = util.debug
         self.logger = util.logger
-        self.ticks = 0
-        self.cooldown_g = 0
-
-        self._getWishTime()
+        self.scheduler = Scheduler(clock)
+        self.prefilter = Prefilter(bot_id, bot_channels)
+        # Messages already acted on, edits and redelivered frames skip out
+        self.seen = SeenCache(clock=clock)
+        self.cooldown_until = 0
+        # Bot messages waiting on a bot id lookup
+        self.pending_bots = []
+        # In process updates, git pull future and channel that asked
+        self.reloader = Reloader()
+        self.update = None
 
         self.logger.log(DiagMessage("BOT0000I"))
+        self._setHandlers(self._createHandlers())
+        self._startTimers()
+        self.logger.log(DiagMessage("BOT0002I"))
+    #}}}
+
+    # Create the command and event handlers
+    # Params: bank    - live Bank to hand the gamble handler, new one if None
+    #         lookups - bot id lookups to hand the bot handler
+    # Return: dict of handler attribute names to handlers
+    def _createHandlers(self, bank = None, lookups = None):
+    #{{{
         # Create command handlers
-        self.roll_handler = RollHandler()
+        roll_handler = RollHandler()
         util.logger.log(DiagMessage("BOT0001D","Roll")) if util.debug else None
-        self.help_handler = HelpHandler(bot_id)
+        help_handler = HelpHandler(self.id)
         util.logger.log(DiagMessage("BOT0001D","Help")) if util.debug else None
-        self.gamble_handler = GambleHandler(bot_channels)
+        # Loading the bank waits until someone actually gambles
+        gamble_handler = Lazy(lambda: GambleHandler(self.channels, bank))
         util.logger.log(DiagMessage("BOT0001D","Gamble")) if util.debug else None
         # Create event handlers
-        self.msg_handler = MessageHandler(
-            bot_id,
-            gamble_handler=self.gamble_handler,
-            help_handler=self.help_handler,
-            roll_handler=self.roll_handler
+        msg_handler = MessageHandler(
+            self.id,
+            gamble_handler=gamble_handler,
+            help_handler=help_handler,
+            roll_handler=roll_handler
         )
-        self.logger.log(DiagMessage("BOT0001D","Message")) if self.debug else None
-        self.bot_handler = BotHandler()
-        self.logger.log(DiagMessage("BOT0001D","Bot")) if self.debug else None
-        self.logger.log(DiagMessage("BOT0002I"))
+        util.logger.log(DiagMessage("BOT0001D","Message")) if util.debug else None
+        bot_handler = BotHandler()
+        if lookups is not None:
+            bot_handler.lookups = lookups
+        util.logger.log(DiagMessage("BOT0001D","Bot")) if util.debug else None
+        return {
+             "roll_handler"   : roll_handler
+            ,"help_handler"   : help_handler
+            ,"gamble_handler" : gamble_handler
+            ,"msg_handler"    : msg_handler
+            ,"bot_handler"    : bot_handler
+        }
     #}}}
 
+    # Swap in a set of handlers
+    # Params: handlers - dict from _createHandlers
+    # Return: None
+    def _setHandlers(self, handlers):
+        for name, handler in handlers.items():
+            setattr(self, name, handler)
+
     # Handles incoming events, calling event specific handlers as needed
     # Params: event_p - incoming event to process
     # Return: 0 - everything processed successfully
@@ -65,116 +113,348 @@ class Duckbot:
     #         2 - bot needs to update
     def handleEvent(self, event_p):
     #{{{
-#         print(event_p)
-        # Create standardized event
-        event = Event(event_p)
-
-        # No event type, get out
-        if event.type == None:
+        # Chatter that isn't for us goes no further than the raw dict
+        if not self.prefilter.check(event_p):
             return 0
-
-        # Message event, pass to message handler
-        elif event.type == "message":
-        #{{{
-            # Display user and their message
-            if event.text:
-                self.logger.log(DiagMessage("BOT0010U",event.user,event.text))
-            response = self.msg_handler.act(event)
-
-            # Send message if one was returned
-            if response:
-                util.sendMessage(event.channel, response, event.user)
-                return 0
-            # None response signals an update needed
-            elif response == None:
-                util.sendMessage(event.channel,
-                    "Shutting down for update. Kweh! :duckbot:")
-                return 2
-            # Otherwise do nothing
-            else:
-                return 0
-        #}}}
-
-        # Bot message event
-        elif event.type == "bot_message":
-        #{{{
-            self.bot_handler.checkBotId(event.user)
-            # Do something sassy with the bot
-            if not self.cooldown_g:
-                self.cooldown_g = 120
-                self.bot_handler.act(event)
+        # Create standardized event, nothing to do if it's not one we handle
+        event = Event.parse(event_p)
+        if event is None:
             return 0
-        #}}}
-
-        # Update event, respond based on the event subtype
-        elif event.type == "update":
-        #{{{
-            # channel_purpose and channel_joined require channel list update
-            if (event.subtype == "channel_purpose" or
-                event.subtype == "channel_joined"):
-                self._channelListUpdate(event)
+        if (event.type == "message" and
+            self.seen.seen(event.channel, event.ts)):
             return 0
-        #}}}
+        handler = self.EVENT_HANDLERS.get((event.type, event.subtype))
+        return handler(self, event) if handler else 0
+    #}}}
+
+    # Message event, pass to message handler
+    # Params: event - message Event
+    # Return: bot return code, see handleEvent
+    def _handleMessage(self, event):
+    #{{{
+        # Display user and their message
+        if event.text:
+            self.logger.log(DiagMessage("BOT0010U",event.user,event.text))
+        response = self.msg_handler.act(event)
 
-        # Unhandled event type
+        # Send message if one was returned
+        if response:
+            util.sendMessage(event.channel, response, event.user)
+            return 0
+        # None response signals an update needed
+        elif response == None and util.hot_reload:
+            self._startUpdate(event.channel)
+            return 0
+        elif response == None:
+            util.sendMessage(event.channel,
+                "Shutting down for update. Kweh! :duckbot:")
+            return 2
+        # Otherwise do nothing
         else:
-            # Don't do anything right now
             return 0
     #}}}
 
-    # Handle tick based bot functions
-    # Params: None
-    # Return: None
-    def tick(self):
-    #{{{
-        # Tick function is called roughly every second, so the tick count rolls
-        # over about every hour. Roll over point can be changed if time needs to
-        # be tracked longer than an hour at a time.
-        self.ticks = (self.ticks + 1) % self.TICK_ROLLOVER
-        # Flush the buffer every hour or so if there aren't enough messages
-        if self.ticks % util.LOG_TIME == 0:
-            self.logger.log(DiagMessage("LOG0010I"), flush=True)
-        # Save bank data timer
-        if util.bank_file and self.ticks % util.SAVE_STATE_TIME == 0:
-            self.gamble_handler.saveState()
-        # Tick down the global cooldown
-        if self.cooldown_g:
-            self.cooldown_g -= 1
-        # Regen some bux for the poor people
-        if self.ticks % util.REGEN_TIME == 0:
-            self.gamble_handler.regenBux()
-        # Refresh the free pulls
-        if self.gamble_handler.pull_timer:
-            self.gamble_handler.pull_timer -= 1
-        else:
-            self.gamble_handler.refreshPulls()
-        # Wonderful day wish
-        if self.wish_timer:
-            self.wish_timer -= 1
-        else:
-            util.sendMessage(self.WISH_CHANNEL, "Go, have a wonderful day.")
-            self._getWishTime()
+    # Bot message event, do something sassy with the bot
+    # Params: event - bot_message Event
+    # Return: 0
+    def _handleBotMessage(self, event):
+    #{{{
+        lookup = self.bot_handler.checkBotId(event.user)
+        now = self.scheduler.clock()
+        if now >= self.cooldown_until:
+            self.cooldown_until = now + self.BOT_COOLDOWN
+            # Still looking the bot up, act on it once that's back
+            if lookup.done():
+                self.bot_handler.act(event)
+            else:
+                if not self.pending_bots:
+                    self.scheduler.after(self.LOOKUP_POLL,
+                        self._checkPendingBots, "bot lookups")
+                self.pending_bots.append((lookup, event))
+        return 0
     #}}}
 
-    # Make updates to channel lists
-    # Params: event - Event containing data to update with
+    # Take in channels as they're streamed in, dropping the ones we started
+    # with that didn't show up once the stream is done
+    # Params: stream - started ChannelStream
+    #         stale  - channel ids to drop if not seen, the current ones
     # Return: None
+    def watchChannels(self, stream, stale = None):
+    #{{{
+        if stale is None:
+            stale = set(self.channels)
+        # Check before draining so the last page can't slip past
+        done = stream.done
+        gamble_built = self.gamble_handler.lazyBuilt()
+        for channel in stream.drain():
+            self.channels[channel.id] = channel
+            self.prefilter.checkChannel(channel)
+            if gamble_built:
+                self.gamble_handler.checkChannel(channel, channel.labels)
+        if not done:
+            self.scheduler.after(self.REFRESH_POLL,
+                lambda: self.watchChannels(stream, stale), "channel stream")
+            return
+        # Keep whatever we have if the listing broke part way
+        if stream.error:
+            util.logger.log(DiagMessage("BOT0110E", str(stream.error)))
+            return
+
+        gone = stale - stream.seen
+        for channel_id in gone:
+            self.channels.pop(channel_id, None)
+            self.prefilter.optouts.discard(channel_id)
+        if gone and gamble_built:
+            self.gamble_handler.setChannels(self.channels)
+        if util.start_cache:
+            util.start_cache.save(util.sc.token, self.id, self.channels)
+        if util.recorder:
+            util.recorder.header(self.id, self.channels)
+        util.logger.log(DiagMessage("BOT0110I", str(len(self.channels)),
+                                    str(stream.pages) + " pages"))
+    #}}}
+
+    # Run any timers that are due
+    # Params: None
+    # Return: number of timers run
+    def runTimers(self):
+        return self.scheduler.run()
+
+    # Time until the next timer is due
+    # Params: None
+    # Return: seconds until the next timer, None if there are none
+    def nextTimer(self):
+        return self.scheduler.nextDeadline()
+
+    # Make updates to channel lists, channel_purpose and channel_joined
+    # Params: event - update Event containing data to update with
+    # Return: 0
     def _channelListUpdate(self, event):
     #{{{
         # Make change to internal channel list
         self.channels = util.updateChannels(self.channels, event)
         # Update gambler channel list
-        event.channel = self.channels[event.channel]
-        labels = util.parseLabels(event.channel["purpose"]["value"])
-        self.gamble_handler.checkChannel(event.channel, labels)
+        channel = self.channels[event.channel]
+        self.prefilter.checkChannel(channel)
+        # An unbuilt bank approves channels off the list when it's built
+        if self.gamble_handler.lazyBuilt():
+            self.gamble_handler.checkChannel(channel, channel.labels)
+        return 0
+    #}}}
+
+    # Act on bot messages whose lookups have come back
+    # Params: None
+    # Return: None
+    def _checkPendingBots(self):
+    #{{{
+        waiting = []
+        for lookup, event in self.pending_bots:
+            if lookup.done():
+                self.bot_handler.act(event)
+            else:
+                waiting.append((lookup, event))
+        self.pending_bots = waiting
+        # Check back on the stragglers
+        if waiting:
+            self.scheduler.after(self.LOOKUP_POLL, self._checkPendingBots,
+                                 "bot lookups")
+    #}}}
+
+    # Register the bot timers
+    # Params: None
+    # Return: None
+    def _startTimers(self):
+    #{{{
+        # Flush the buffer every so often if there aren't enough messages
+        self.scheduler.every(util.LOG_TIME, self._flushLog, "log flush")
+        # Save bank data timer
+        if util.bank_file:
+            self.scheduler.every(util.SAVE_STATE_TIME, self._saveState,
+                                 "save state")
+            self.scheduler.every(util.BANK_FLUSH_TIME, self._flushBank,
+                                 "bank flush")
+        # Daily free pull refresh and wonderful day wish
+        self.scheduler.after(GambleHandler.getRefreshTime(),
+                             self._refreshPulls, "refresh pulls")
+        self.scheduler.after(self._getWishTime(), self._wish, "wish")
+    #}}}
+
+    # Log the prefilter and seen cache counts and flush the log buffer
+    # Params: None
+    # Return: None
+    def _flushLog(self):
+    #{{{
+        self.logger.log(DiagMessage("BOT0120I",
+            "filtered " + str(self.prefilter.filtered),
+            "processed " + str(self.prefilter.processed)))
+        self.logger.log(DiagMessage("BOT0130I",
+            "hits " + str(self.seen.hits),
+            "misses " + str(self.seen.misses)))
+        self.logger.log(DiagMessage("LOG0010I"), flush=True)
+    #}}}
+
+    # Save the bank and wait for it, for when the bot is exiting
+    # Params: None
+    # Return: None
+    def saveBank(self):
+    #{{{
+        if self.gamble_handler.lazyBuilt():
+            bank = self.gamble_handler.bank
+            bank.flush()
+            bank.saveState(wait=True)
+            bank.ledger.close()
+            # Stores with work of their own still going finish it here
+            if bank.store:
+                bank.store.close()
+    #}}}
+
+    # Save the bank, goes through the current handler so reloads are picked up
+    # Params: None
+    # Return: None
+    def _saveState(self):
+    #{{{
+        if self.gamble_handler.lazyBuilt():
+            self.gamble_handler.bank.saveState()
+    #}}}
+
+    # Write out bank changes, nothing to do if the bank was never loaded
+    # Params: None
+    # Return: None
+    def _flushBank(self):
+    #{{{
+        if self.gamble_handler.lazyBuilt():
+            self.gamble_handler.bank.flush()
+    #}}}
+
+    # Pull the latest code in the background, reloading once it's down
+    # Params: channel - channel id the update was asked for in
+    # Return: None
+    def _startUpdate(self, channel):
+    #{{{
+        if self.update:
+            util.sendMessage(channel, "Already updating, hold on. Kweh!")
+            return
+        util.logger.log(DiagMessage("BOT0102I"))
+        util.sendMessage(channel, "Updating in place. Kweh! :duckbot:")
+        pull = util.work_pool.submit("git pull", subprocess.run,
+            ["git", "pull"], capture_output=True, text=True,
+            timeout=self.UPDATE_TIMEOUT)
+        self.update = (pull, channel)
+        self.scheduler.after(self.UPDATE_POLL, self._checkUpdate, "update")
+    #}}}
+
+    # Reload once the pull is back
+    # Params: None
+    # Return: None
+    def _checkUpdate(self):
+    #{{{
+        pull, channel = self.update
+        if not pull.done():
+            self.scheduler.after(self.UPDATE_POLL, self._checkUpdate, "update")
+            return
+        self.update = None
+
+        # Errors from the pool come back as an api style error dict
+        result = pull.result()
+        if isinstance(result, dict) or result.returncode:
+            error = (result.get("error") if isinstance(result, dict)
+                     else result.stderr.strip())
+            util.logger.log(DiagMessage("BOT0103E", str(error)))
+            util.sendMessage(channel, "Pull failed, staying on the old code. "
+                                      "Kweh :duck:")
+            return
+
+        error = self._reload()
+        if error:
+            util.sendMessage(channel, "Update failed to load, staying on the "
+                                      "old code. Kweh :duck:\n" + error)
+        else:
+            util.sendMessage(channel, "Update done. Kweh! :duckbot:")
+    #}}}
+
+    # Reload the bot's code in place
+    # Params: None
+    # Return: None if the reload went through, error string otherwise
+    def _reload(self):
+    #{{{
+        # Handlers are made again, only what they hold has to carry over
+        handlers = [self.roll_handler, self.help_handler, self.gamble_handler,
+                    self.msg_handler, self.bot_handler]
+        if self.gamble_handler.lazyBuilt():
+            handlers.append(self.gamble_handler.lazyGet())
+        return self.reloader.reload(self._reloadHandlers, (self,), handlers)
+    #}}}
+
+    # Rebuild the handlers from freshly reloaded modules, keeping the bank,
+    # bot lookups, channels, timers and connection as they are. The reloader
+    # moves those onto the new code itself
+    # Params: None
+    # Return: None
+    def _reloadHandlers(self):
+    #{{{
+        # Bank that was never loaded can stay that way
+        bank = None
+        if self.gamble_handler.lazyBuilt():
+            bank = self.gamble_handler.bank
+        handlers = self._createHandlers(bank, self.bot_handler.lookups)
+        # A loaded bank gets its new handler built now, so the new gamble
+        # code runs before the reload counts and a failure rolls it back
+        if bank is not None:
+            handlers["gamble_handler"].lazyGet()
+        self._setHandlers(handlers)
+    #}}}
+
+    # Refresh the free pulls and set up the next refresh
+    # Params: None
+    # Return: None
+    def _refreshPulls(self):
+    #{{{
+        # A bank that isn't loaded works out the day when it is
+        if self.gamble_handler.lazyBuilt():
+            self.gamble_handler.refreshPulls()
+        self.scheduler.after(self._nextDay(GambleHandler.getRefreshTime()),
+                             self._refreshPulls, "refresh pulls")
     #}}}
 
-    # Set time until next wonderful day message
+    # Send the wonderful day wish and set up the next one
     # Params: None
     # Return: None
+    def _wish(self):
+    #{{{
+        # Sends go by id, the wish channel is only known by name
+        channel_id = next((channel.id for channel in self.channels.values()
+                           if channel.name == self.WISH_CHANNEL), None)
+        if channel_id is None:
+            util.logger.log(DiagMessage("BOT0111E", self.WISH_CHANNEL))
+        else:
+            util.sendMessage(channel_id, "Go, have a wonderful day.",
+                             priority=util.PRIORITIES["SCHEDULED"])
+        self.scheduler.after(self._nextDay(self._getWishTime()),
+                             self._wish, "wish")
+    #}}}
+
+    # Get time until next wonderful day message
+    # Params: None
+    # Return: seconds until the wish time
     def _getWishTime(self):
     #{{{
         # Get current time
         current_time = datetime.now().replace(year = 1, month = 1, day = 1)
-        self.wish_timer = (self.WISH_TIME - current_time).seconds
+        return (self.WISH_TIME - current_time).seconds
+    #}}}
+
+    # Push a daily delay out a day if the job fired a little early and the
+    # wall clock hasn't passed its time yet
+    # Params: seconds - seconds until the daily time
+    # Return: seconds until the next run
+    def _nextDay(self, seconds):
+        return seconds + self.DAY if seconds < self.DAILY_SLACK else seconds
+
+    #{{{ - EVENT_HANDLERS, keyed on standardized (type, subtype)
+    EVENT_HANDLERS = {
+         ("message", None)             : _handleMessage
+        ,("bot_message", None)         : _handleBotMessage
+        ,("update", "channel_purpose") : _channelListUpdate
+        ,("update", "channel_joined")  : _channelListUpdate
+    }
     #}}}
@@ -1,19 +1,29 @@
-# Last Updated: 2.3.0
+# Last Updated: 2.4.0
 # Python imports
 from datetime import datetime
 # Project imports
 import util.common as util
 from util.rangeDict import rangedict
 from util.bank import Bank
+from util.ledger import Ledger
 import util.bankMessage as bank_msgs
 import handlers.games as Games
 
 # Gambling handler class
 class GambleHandler:
     CURRENCY = "dux"
-    REFRESH_TIME = datetime(1,1,1,12)
+    REFRESH_TIME = Bank.REFRESH_TIME
     PULL_RANGE = range(1,11)
     PULL_COST  = 10
+    LEADERBOARD_SIZE = 10
+    LEADERBOARD_MAX  = 25
+    HISTORY_PAGE = 10
+    BOARDS = {
+         "BUX"   : Bank.BALANCE_BOARD
+        ,"DUX"   : Bank.BALANCE_BOARD
+        ,"POOL"  : Bank.POOL_BOARD
+        ,"GACHA" : Bank.POOL_BOARD
+    }
     #{{{ - Gacha ranges
     GACHA_RANGES = rangedict({
          range(50,150)    : 0
@@ -38,17 +48,32 @@ class GambleHandler:
         ,"1000-chan"
     ]
     #}}}
+    #{{{ - History lines by ledger kind
+    HISTORY_LINES = {
+         Ledger.JOIN   : "Joined the bank with {amount} {currency}"
+        ,Ledger.BET    : "Bet, {signed} {currency}"
+        ,Ledger.PULL   : "Pulls, {signed} {currency}"
+        ,Ledger.REGEN  : "Regen, {signed} {currency}"
+        ,Ledger.GIVE   : "Sent to {other}, {signed} {currency}"
+        ,Ledger.GET    : "Sent by {other}, {signed} {currency}"
+        ,Ledger.STEAL  : "Stole a {item} from {other}"
+        ,Ledger.STOLEN : "{other} stole your {item}"
+        ,Ledger.LOSE   : "Lost a {item}"
+        ,Ledger.NUKE   : "{other} set off the nuke"
+        ,Ledger.ADJUST : "Adjusted, {signed} {currency}"
+    }
+    #}}}
 
     # Constructor for gamble handler
-    # Params: channels - list of channels to check for approved labels
+    # Params: channels - dict of channel ids to Channel to check for labels
+    #         bank     - bank to use, a new one is loaded if None
     # Return: GambleHandler instance with approved channels added
-    def __init__(self, channels):
+    def __init__(self, channels, bank = None):
     #{{{
         self.GAMES = Games.GAMES
         self.logger = util.logger
         self.approved_channels = self._getApproved(channels)
-        self.bank = Bank()
-        self.pull_timer = self._getRefreshTime()
+        self.bank = Bank() if bank is None else bank
     #}}}
 
     # Add user to bank if not in already
@@ -78,14 +103,14 @@ class GambleHandler:
 
     # Check a user's bank balance
     # Params: user   - user id requesting balance
-    #         target - (maybe) user id str to get balance of
+    #         target - (maybe) token naming the user to get balance of
     #                  default None gets user balance
     # Return: Message contains users balance
     def checkbux(self, user, target = None):
     #{{{
         # There's text to check for a target
         if target:
-            return_code, target = self._checkGambleStatus(target)
+            return_code, target = self._checkGambleStatus(target.norm)
             # User and in the bank
             if return_code == 0:
                 balance = self.bank.balance(target)
@@ -113,14 +138,14 @@ class GambleHandler:
 
     # Check a user's gacha collection
     # Params: user   - user id requesting
-    #         target - user id str to check
+    #         target - token naming the user to check
     #                  default None gets user collection
     # Return: Message containing collection
     def checkPool(self, user, target = None):
     #{{{
         # Check for target
         if target:
-            return_code, target = self._checkGambleStatus(target)
+            return_code, target = self._checkGambleStatus(target.norm)
             # Is a user and in bank
             if return_code == 0:
                 pool = self.bank.getPool(target)
@@ -150,10 +175,96 @@ class GambleHandler:
             return None
     #}}}
 
+    # Show the top of a leaderboard
+    # Params: parms - (maybe) tokens naming the board and how many to show
+    #                 default balance board and LEADERBOARD_SIZE players
+    # Return: Message containing the leaderboard
+    def leaderboard(self, parms):
+    #{{{
+        board, parms = self._parseBoard(parms)
+        count = self.LEADERBOARD_SIZE
+        if parms:
+            count = max(1, min(parms[0].number(count), self.LEADERBOARD_MAX))
+        leaders = self.bank.leaders(board, count)
+        if not leaders:
+            return "Nobody is registered for this bank yet :duck:"
+
+        unit = self.CURRENCY if board == Bank.BALANCE_BOARD else "points"
+        msg = ("Top " + str(len(leaders)) + " by"
+               " " + ("balance" if board == Bank.BALANCE_BOARD else "collection") + ":")
+        for place, (user, score) in enumerate(leaders, 1):
+            msg += "\n" + str(place) + ". <@" + user + "> " + str(score) + " " + unit
+        return msg
+    #}}}
+
+    # Check where a user stands on a leaderboard
+    # Params: user  - user id requesting
+    #         parms - (maybe) tokens naming the board and the user to rank
+    #                 default balance board and the user requesting
+    # Return: Message containing the rank
+    def rank(self, user, parms):
+    #{{{
+        board, parms = self._parseBoard(parms)
+        unit = self.CURRENCY if board == Bank.BALANCE_BOARD else "points"
+        # There's text to check for a target
+        if parms:
+            return_code, target = self._checkGambleStatus(parms[0].norm)
+            # User and in the bank
+            if return_code == 0:
+                rank, score, total = self.bank.rank(board, target)
+                return ("<@" + target + "> is ranked " + str(rank) + " of"
+                        " " + str(total) + " with " + str(score) + " " + unit)
+            # User not in the bank
+            elif return_code == 2:
+                return "<@" + target + "> is not currently registered for this bank :duck:"
+
+        # Either there was no text for a target or the text wasn't a user
+        return_code, _ = self._checkGambleStatus(user)
+        # User in the bank
+        if return_code == 0:
+            rank, score, total = self.bank.rank(board, user)
+            return ("You are ranked " + str(rank) + " of"
+                    " " + str(total) + " with " + str(score) + " " + unit)
+        # Or not
+        elif return_code == 2:
+            return bank_msgs.NOT_A_MEMBER
+        # Illegal user id
+        else:
+            # TODO: Malformed user id code
+            return None
+    #}}}
+
+    # Page through a user's recent transactions
+    # Params: user - user id requesting
+    #         page - (maybe) token with the page number, newest page is 1
+    # Return: Message containing the page
+    def history(self, user, page = None):
+    #{{{
+        return_code, _ = self._checkGambleStatus(user)
+        # Not in the bank
+        if return_code == 2:
+            return bank_msgs.NOT_A_MEMBER
+        # Illegal user id
+        elif return_code != 0:
+            # TODO: Malformed user id code
+            return None
+
+        page = max(1, page.number(1)) if page else 1
+        entries = self.bank.history(user, (page - 1) * self.HISTORY_PAGE,
+                                    self.HISTORY_PAGE)
+        if not entries:
+            return "Nothing on page " + str(page) + " of your history :duck:"
+        msg = "Your history, page " + str(page) + ":"
+        for when, kind, amount, other in entries:
+            msg += ("\n" + datetime.fromtimestamp(when).strftime("%Y-%m-%d %H:%M") +
+                    " " + self._historyLine(kind, amount, other))
+        return msg
+    #}}}
+
     # Bet bucks on a game to win more
     # Params: user    - user id of player
     #         channel - channel id playing from
-    #         bet_ops - bet options (amount, game, game_ops)
+    #         bet_ops - bet option tokens (amount, game, game_ops)
     # Return: Message containing results
     def bet(self, user, channel, bet_ops):
     #{{{
@@ -188,15 +299,18 @@ class GambleHandler:
                    "\n" + self.checkbux(user))
 
         return_code, response = self.GAMES[game](game_ops)
+        # Settled in one go, the balance could have dropped since the check
+        if (return_code in (0, 1) and
+            self.bank.settleBet(user, amount, return_code == 1) is None):
+            return ("Your balance is too low to make this bet"
+                   "\n" + self.checkbux(user))
         # Lost
         if return_code == 0:
-            self.bank.balance(user, -amount)
             return (response + "\nYou lost! You're down"
                    " " + str(amount) + " " + self.CURRENCY + " "
                    "\n" + self.checkbux(user))
         # Won
         elif return_code == 1:
-            self.bank.balance(user, amount)
             return (response + "\nYou won! You've gained"
                    " " + str(2*amount) + " " + self.CURRENCY + " "
                    "\n" + self.checkbux(user))
@@ -208,7 +322,7 @@ class GambleHandler:
     # Buy a gacha pull
     # Params: user    - uid of player
     #         channel - channel id playing from
-    #         amount  - number of pulls to do
+    #         amount  - token with the number of pulls to do
     # Return: Message containing results
     def pull(self, user, channel, amount):
     #{{{
@@ -224,49 +338,34 @@ class GambleHandler:
             # Need infrastructure for return codes with messages
             return None
 
-        # Convert amount
-        if amount:
-            # Number?
-            try:
-                amount = int(amount)
-            # Emoji?
-            except ValueError:
-                amount = util.EMOJI_ROLLS.get(amount,1)
-        else:
-            amount = 1
+        # Convert amount, number or emoji
+        amount = amount.number(1) if amount else 1
         # Check amount and total cost
         if amount not in self.PULL_RANGE:
             return (bank_msgs.PULL_RANGE + "\nAllowed range is from"
                 " " + str(min(self.PULL_RANGE)) + " to"
                 " " + str(max(self.PULL_RANGE)))
 
-        response = ""
-        # Check balance for free pull
-        if (self.bank.hasFreePull(user) and
-           (amount - 1) * self.PULL_COST <= self.bank.balance(user)):
-
-            self.bank.balance(user, -((amount - 1) * self.PULL_COST))
-            response += "Free pull was available, -1 pull cost\n"
-            self.bank.setFreePull(False, user)
-        # Check balance for no free pull
-        elif (not self.bank.hasFreePull(user) and
-             amount * self.PULL_COST <= self.bank.balance(user)):
-
-            self.bank.balance(user, -(amount * self.PULL_COST))
+        # Paying, pulling and stealing all happen in one bank transaction
+        pulls = self.bank.pull(user, amount, self.PULL_COST,
+                               lambda: self._doPull(user))
         # Not enough funds
-        else:
+        if pulls is None:
             return bank_msgs.INSUFFICIENT_FUNDS
 
+        free, pulls = pulls
+        response = ""
+        if free:
+            response += "Free pull was available, -1 pull cost\n"
+
         response += "Your pull results: "
-        for i in range(0,amount):
-            pull_id = self._doPull(user)
+        for pull_id, result in pulls:
             # Nuked
             if pull_id == -2:
-                self.bank.nuke()
                 return bank_msgs.NUKE
             # Bad pull
             if pull_id == -1:
-                pull_id = self.bank.removeBest(user)
+                pull_id = result
 
                 # Didn't have anything to lose
                 if pull_id < 0:
@@ -287,7 +386,6 @@ class GambleHandler:
             # Good pull
             else:
                 pull_name = self.GACHA_NAMES[pull_id]
-                result = self.bank.addPool(pull_id, user)
                 if result:
                     if result == user:
                         response += "\nYou have received a " + pull_name
@@ -301,29 +399,38 @@ class GambleHandler:
         return response
     #}}}
 
-    # Regen some bux when players are low (gets called every five minutes or so)
-    # Params: None
-    # Return: None
-    def regenBux(self):
-        self.bank.regen()
-
     # Reset players' daily pull
     # Params: None
     # Return: None
     def refreshPulls(self):
+        self.bank.refreshPulls()
+
+    # Get the seconds until next pull refresh
+    # Params: None
+    # Return: Seconds unil daily pulls refresh
+    @classmethod
+    def getRefreshTime(cls):
     #{{{
-        self.pull_timer = self._getRefreshTime()
-        self.bank.setFreePull(True)
+        # Get current time
+        current_time = datetime.now().replace(year = 1, month = 1, day = 1)
+        # Send back diff
+        return (cls.REFRESH_TIME - current_time).seconds
     #}}}
 
+    # Replace the channel list, approving channels from scratch
+    # Params: channels - dict of channel ids to Channel to check
+    # Return: None
+    def setChannels(self, channels):
+        self.approved_channels = self._getApproved(channels)
+
     # Check for required labels and add channel id if good
     # Params: channel - channel to potentially add
     #         lables  - label list to check
     # Return: None
     def checkChannel(self, channel, labels):
     #{{{
-        channel_id   = channel["id"]
-        channel_name = channel["name"]
+        channel_id   = channel.id
+        channel_name = channel.name
         if (util.LABELS["GAMBLE"] in labels and
             channel_id not in self.approved_channels):
             self.approved_channels.append(channel_id)
@@ -340,14 +447,14 @@ class GambleHandler:
     #}}}
 
     # Go through channel list and get add approved to list
-    # Params: channels - dict of channels to channel data to check
+    # Params: channels - dict of channel ids to Channel to check
     # Return: list of approved channel ids
     def _getApproved(self, channels):
     #{{{
         approved = []
         for key, channel in channels.items():
-            if util.LABELS["GAMBLE"] in channel["labels"]:
-                approved.append(channel["id"])
+            if util.LABELS["GAMBLE"] in channel.labels:
+                approved.append(channel.id)
         return approved
     #}}}
 
@@ -374,7 +481,7 @@ class GambleHandler:
     #}}}
 
     # Parse needed values out of bet options
-    # Params: bet_ops - list of options to parse out
+    # Params: bet_ops - list of option tokens to parse out
     # Return: return code and converted bet_ops list
     def _parseBetOps(self, bet_ops):
     #{{{
@@ -382,31 +489,40 @@ class GambleHandler:
         if len(bet_ops) < 2:
             return 1, None
         # Grab the options
-        u_ops = [x.upper() for x in bet_ops]
-        bet_amount, game, *game_ops = u_ops
-        # Check bet amount
-        try:
-            bet_amount = int(bet_amount)
-        except ValueError:
-            bet_amount = util.EMOJI_ROLLS.get(bet_amount,-1)
-        if bet_amount < 1:
-            return 2, bet_ops[0]
+        bet_amount, game, *game_ops = bet_ops
+        # Check bet amount, number or emoji
+        amount = bet_amount.number(-1)
+        if amount < 1:
+            return 2, bet_amount.text
         # Check game
-        if game not in self.GAMES:
-            return 3, bet_ops[1]
+        if game.norm not in self.GAMES:
+            return 3, game.text
         # Return everything
-        return 0, [bet_amount, game, game_ops]
+        return 0, [amount, game.norm, game_ops]
     #}}}
 
-    # Get the seconds until next pull refresh
-    # Params: None
-    # Return: Seconds unil daily pulls refresh
-    def _getRefreshTime(self):
+    # Parse a leaderboard name off the front of some tokens
+    # Params: parms - list of tokens, the first may name a board
+    # Return: board id and the tokens left after it
+    def _parseBoard(self, parms):
     #{{{
-        # Get current time
-        current_time = datetime.now().replace(year = 1, month = 1, day = 1)
-        # Send back diff
-        return (self.REFRESH_TIME - current_time).seconds
+        if parms and parms[0].norm in self.BOARDS:
+            return self.BOARDS[parms[0].norm], parms[1:]
+        return Bank.BALANCE_BOARD, parms
+    #}}}
+
+    # Describe one ledger entry
+    # Params: kind   - ledger kind
+    #         amount - bux moved or pull id
+    #         other  - user id on the other side or None
+    # Return: line for the history message
+    def _historyLine(self, kind, amount, other):
+    #{{{
+        item = (self.GACHA_NAMES[amount] if 0 <= amount < len(self.GACHA_NAMES)
+                else str(amount))
+        return self.HISTORY_LINES[kind].format(
+            amount=amount, signed="{:+}".format(amount), currency=self.CURRENCY,
+            item=item, other="<@" + other + ">" if other else "Someone")
     #}}}
 
     # Do the gacha pull
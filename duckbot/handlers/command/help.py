@@ -1,4 +1,4 @@
-# Last Updated: 2.2
+# Last Updated: 2.4.0
 import util.common as util
 
 # Help handler class
@@ -50,6 +50,18 @@ class HelpHandler:
                 "Usage: <@" + bot_id + "> BET <amount> <game> <game-options>\n"
                 "List of currently supported games: " + ", ".join(util.GAMES) + "\n"
                 "Use HELP BET <game> for details on options")
+            ,util.COMMANDS["LEADERBOARD"] :\
+                ("Show the top players by balance or by gacha collection\n"
+                "Usage: <@" + bot_id + "> LEADERBOARD [BUX|POOL] [count]\n"
+                "Defaults to the top 10 by balance :duck:")
+            ,util.COMMANDS["RANK"] :\
+                ("Check where yourself or others rank on a leaderboard\n"
+                "Usage: <@" + bot_id + "> RANK [BUX|POOL] [target]\n"
+                "No target defaults to yourself :duck:")
+            ,util.COMMANDS["HISTORY"] :\
+                ("Page through your recent transactions, newest first\n"
+                "Usage: <@" + bot_id + "> HISTORY [page]\n"
+                "No page defaults to the newest :duck:")
         }
         #}}}
         #{{{ - Game help messages
@@ -65,21 +77,22 @@ class HelpHandler:
     #}}}
 
     # Retrieve help message based on passed values
-    # Params: parms - list of strings to check for help commands
+    # Params: parms - list of tokens to check for help commands
     # Return: requested help messages or generic one if no specific
     def act(self, parms):
     #{{{
         if parms:
-            command = util.COMMANDS.get(parms[0],0)
-            command = util.COMMANDS_ALT.get(parms[0],0) if not command else command
+            c_word = parms[0].norm
+            command = util.COMMANDS.get(c_word,0)
+            command = util.COMMANDS_ALT.get(c_word,0) if not command else command
             if command == util.COMMANDS["BET"] and len(parms) > 1:
-                subcommand = util.GAMES.get(parms[1],0)
+                subcommand = util.GAMES.get(parms[1].norm,0)
                 response = self.game_help_messages.get(subcommand,
-                    parms[1] + " is not a recognized game")
+                    parms[1].norm + " is not a recognized game")
                 return response
             else:
                 response = self.help_messages.get(command,
-                    parms[0] + " is not a recognized command")
+                    c_word + " is not a recognized command")
                 return response
         else:
             return ("Duckbot is a general purpose slackbot for doing various things\n"
@@ -1,13 +1,9 @@
-# Last Updated: 2.2
-# Python imports
-import re
-import shlex
+# Last Updated: 2.4.0
 # Project imports
 import util.common as util
 
 # Roll handler class
 class RollHandler:
-    ROLL_REGEX="^(:[a-z0-9_-]+:|\d+)?D(:[a-z0-9_-]+:|\d+)$"
     #{{{ - CHARACTER_ROLLS
     CHARACTER_ROLLS = [
          ":DRAGON:"
@@ -28,7 +24,7 @@ class RollHandler:
     #}}}
 
     # Parse roll command parms and return values
-    # Params: roll_parms - list of roll parameters
+    # Params: roll_parms - list of roll parameter tokens
     # Return:  0, list of rolls
     #          1, list of stats
     #         -1, None for bad param
@@ -38,44 +34,16 @@ class RollHandler:
         if not roll_parms:
             return -2, None
         # Check for character roll
-        elif roll_parms[0] in self.CHARACTER_ROLLS:
+        elif roll_parms[0].norm in self.CHARACTER_ROLLS:
             return 1, self.characterRoll()
 
-        results = re.search(self.ROLL_REGEX, roll_parms[0])
-
-        # If we matched a dX or YdX case
-        if results:
-        #{{{
-            # YdX case
-            if results.group(1):
-                # Numeric
-                try:
-                    die_num = int(results.group(1))
-                # Or emoji
-                except ValueError:
-                    die_num = util.EMOJI_ROLLS.get(results.group(1),-1)
-            else:
-                die_num = 1
-
-            # dX half
-            # Numeric
-            try:
-                die_size = int(results.group(2))
-            # Or emoji
-            except ValueError:
-                die_size = util.EMOJI_ROLLS.get(results.group(2),-1)
-        #}}}
-        # Just X case
+        # dX or YdX case, the tokenizer already split and converted it
+        if roll_parms[0].kind == "DICE":
+            die_num, die_size = roll_parms[0].value
+        # Just X case, numeric or emoji
         else:
-        #{{{
             die_num = 1
-            # Numeric
-            try:
-                die_size = int(roll_parms[0])
-            # Or emoji
-            except ValueError:
-                die_size = util.EMOJI_ROLLS.get(roll_parms[0],-1)
-        #}}}
+            die_size = roll_parms[0].number(-1)
 
         # Check range for valid rolls
         if (die_num in self.die_range and die_size in self.die_range):
@@ -124,20 +92,23 @@ class RollHandler:
     #}}}
 
     # Roll for pickit response
-    # Params: pick_parms - string to split and pick from
+    # Params: pick_parms - list of tokens to pick from
     # Return: 0, chosen thing
     #         1, range to pick from for error
+    #         2, None for unmatched quotes
     def pickitRoll(self, pick_parms):
     #{{{
-        try:
-            # Split on spaces while preserving quoted strings,
-            # then remove empty strings because people suck
-            pick_parms = shlex.split(" ".join(pick_parms))
-            pick_parms = [val for val in pick_parms if val != ""]
-        except ValueError:
-            return 2, None
-        if len(pick_parms) in self.pick_range:
-            return 0, pick_parms[util.doRolls(len(pick_parms))[0]-1]
+        # Quoted strings are already single tokens, anything still starting
+        # with a quote never got closed
+        for token in pick_parms:
+            if token.kind == "WORD" and token.text[0] in "\"'":
+                return 2, None
+        # Drop empty quotes because people suck
+        choices = [token.value if token.kind == "QUOTED" else token.text
+                   for token in pick_parms]
+        choices = [val for val in choices if val != ""]
+        if len(choices) in self.pick_range:
+            return 0, choices[util.doRolls(len(choices))[0]-1]
         else:
             return 1, self.pick_range
     #}}}
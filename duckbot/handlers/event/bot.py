@@ -1,5 +1,6 @@
-# Last Updated: 2.2
+# Last Updated: 2.4.0
 import util.common as util
+from util.diagMessage import DiagMessage
 
 # Bot handler class
 class BotHandler:
@@ -8,8 +9,9 @@ class BotHandler:
     # Return: BotHandler instance
     def __init__(self):
     #{{{
-        self.logger = util.logger
-        self.bots   = {}
+        self.logger  = util.logger
+        self.bots    = {}
+        self.lookups = {}
     #}}}
 
     # Handle bot interaction
@@ -18,24 +20,42 @@ class BotHandler:
     def act(self, event):
     #{{{
         if event.user in self.bots:
-            util.sendMessage(event.channel, "Check this out, kweh :duck:")
-            util.sendMessage(event.channel, "Hello", self.bots[event.user])
+            util.sendMessage(event.channel, "Check this out, kweh :duck:",
+                             priority=util.PRIORITIES["BOT"])
+            util.sendMessage(event.channel, "Hello", self.bots[event.user],
+                             priority=util.PRIORITIES["BOT"])
     #}}}
 
-    # Check if bot id is known and add it if not
+    # Check if bot id is known and look it up if not
     # Params: bot_id - bot id to check
-    # Return: None
+    # Return: Future that resolves once the bot id has been looked up
     def checkBotId(self, bot_id):
     #{{{
-        # Add the bot to the list if it's not in there
-        if bot_id not in self.bots:
-            response = util.sc.api_call("bots.info", token=util.sc.token, bot=bot_id)
-            if response["ok"]:
-                self.bots[bot_id] = response["bot"]["user_id"]
-                self.logger.log(DiagMessage("BOT0051D")) if util.debug else None
-            else:
-                self.logger.log(DiagMessage("BOT0040E"))
-                self.logger.log(DiagMessage("BOT0041E", response["error"]))
+        # Start a lookup if there isn't one done or in flight
+        lookup = self.lookups.get(bot_id)
+        if not lookup:
+            lookup = util.apiCall("bots.info", token=util.sc.token, bot=bot_id)
+            self.lookups[bot_id] = lookup
+            # Failed lookups drop out of the list, possibly right away
+            lookup.add_done_callback(
+                lambda future: self._addBot(bot_id, future.result()))
         else:
             self.logger.log(DiagMessage("BOT0050D")) if util.debug else None
+        return lookup
+    #}}}
+
+    # Add looked up bot to the list
+    # Params: bot_id   - bot id that was looked up
+    #         response - bots.info response
+    # Return: None
+    def _addBot(self, bot_id, response):
+    #{{{
+        if response["ok"]:
+            self.bots[bot_id] = response["bot"]["user_id"]
+            self.logger.log(DiagMessage("BOT0051D")) if util.debug else None
+        else:
+            # Forget the lookup so the next message tries again
+            self.lookups.pop(bot_id, None)
+            self.logger.log(DiagMessage("BOT0040E"))
+            self.logger.log(DiagMessage("BOT0041E", response["error"]))
     #}}}
@@ -1,9 +1,8 @@
-# Last Updated: 2.2
-# Python imports
-import re
+# Last Updated: 2.4.0
 # Project imports
 import util.common as util
 from util.diagMessage import DiagMessage
+from util.tokenizer import tokenize
 
 # Message handler class
 class MessageHandler:
@@ -25,12 +24,8 @@ class MessageHandler:
     # Return: string message to send to slack
     def act(self, event):
     #{{{
-        u_parms = ""
-        # Split text into command word and params
-        command, o_parms = self._getCommand(event.text)
-        # Save old params for nicer messages if needed
-        if o_parms:
-            u_parms = [str.upper(val) for val in o_parms]
+        # Split text into command word and param tokens
+        command, parms = self._getCommand(event.text)
 
         # Log command being processed
         if util.debug and command:
@@ -49,12 +44,12 @@ class MessageHandler:
 
         # HELP command
         elif command == util.COMMANDS["HELP"]:
-            return self.help_handler.act(u_parms)
+            return self.help_handler.act(parms)
 
         # ROLL command
         elif command == util.COMMANDS["ROLL"]:
         #{{{
-            return_code, rolls = self.roll_handler.roll(u_parms)
+            return_code, rolls = self.roll_handler.roll(parms)
             # Regular dice roll
             if return_code == 0:
             #{{{
@@ -86,7 +81,7 @@ class MessageHandler:
                 return output
             #}}}
             elif return_code == -1:
-                return o_parms[0] + " is not a valid roll."
+                return parms[0].text + " is not a valid roll."
             else:
                 return "Can't roll without parameters, kweh! :duck:"
         #}}}
@@ -106,7 +101,7 @@ class MessageHandler:
         # PICKIT command
         elif command == util.COMMANDS["PICKIT"]:
         #{{{
-            return_code, response = self.roll_handler.pickitRoll(o_parms)
+            return_code, response = self.roll_handler.pickitRoll(parms)
             # Number of choices out of range
             if return_code == 1:
                 return ("Must pick between " + str(min(response)) + " "
@@ -124,23 +119,36 @@ class MessageHandler:
 
         # CHECKBUX command
         elif command == util.COMMANDS["CHECKBUX"]:
-            target = u_parms[0] if u_parms else None
+            target = parms[0] if parms else None
             return self.gamble_handler.checkbux(event.user, target)
 
         # BET command
         elif command == util.COMMANDS["BET"]:
-            return self.gamble_handler.bet(event.user, event.channel, o_parms)
+            return self.gamble_handler.bet(event.user, event.channel, parms)
 
         # PULL command
         elif command == util.COMMANDS["PULL"]:
-            amount = u_parms[0] if u_parms else None
+            amount = parms[0] if parms else None
             return self.gamble_handler.pull(event.user, event.channel, amount)
 
         # CHECKPOOL command
         elif command == util.COMMANDS["CHECKPOOL"]:
-            target = u_parms[0] if u_parms else None
+            target = parms[0] if parms else None
             return self.gamble_handler.checkPool(event.user, target)
 
+        # LEADERBOARD command
+        elif command == util.COMMANDS["LEADERBOARD"]:
+            return self.gamble_handler.leaderboard(parms)
+
+        # RANK command
+        elif command == util.COMMANDS["RANK"]:
+            return self.gamble_handler.rank(event.user, parms)
+
+        # HISTORY command
+        elif command == util.COMMANDS["HISTORY"]:
+            page = parms[0] if parms else None
+            return self.gamble_handler.history(event.user, page)
+
         # No command or unrecognized, either way I don't care
         else:
             return ""
@@ -148,7 +156,7 @@ class MessageHandler:
 
     # Parse message for mention, command, and parms
     # Params: text - message text to parse
-    # Return: command word and params or None,None if no command
+    # Return: command word and param tokens or None,None if no command
     def _getCommand(self, text):
     #{{{
         # Message event with no text? Don't even know if it's possible
@@ -157,17 +165,18 @@ class MessageHandler:
             return None, None
 
         # Break up the text and try to match the trigger with the bot_id
-        text_arr = re.split(r'\s+',text.strip())
-        trigger = text_arr.pop(0).upper()
-        id_str = util.matchUserId(trigger)
+        tokens = tokenize(text)
+        if len(tokens) < 2:
+            return None, None
+        trigger = tokens[0].norm
 
         # Check for mention from id or trigger, then get command
-        if ((id_str == self.bot_id) or
-           (trigger   == ":DUCKBOT:")) and text_arr:
-            c_word = text_arr.pop(0).upper()
+        if (util.matchUserId(trigger) == self.bot_id or
+            trigger == ":DUCKBOT:"):
+            c_word = tokens[1].norm
             command = util.COMMANDS.get(c_word,0)
             command = util.COMMANDS_ALT.get(c_word,0) if not command else command
-            return command, text_arr
+            return command, tokens[2:]
 
         # No mention or no command word, ignore
         else:
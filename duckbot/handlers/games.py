@@ -1,4 +1,4 @@
-# Last Updated: 2.2
+# Last Updated: 2.4.0
 import util.common as util
 from util.bidict import bidict
 
@@ -24,7 +24,7 @@ GAME_OPS = {
 }
 
 # Play the coin game
-# Params: game_ops - list of strings to check for options
+# Params: game_ops - list of tokens to check for options
 # Return: result return code and message
 def coinGame(game_ops):
 #{{{
@@ -44,7 +44,7 @@ def coinGame(game_ops):
 #}}}
 
 # Play the dice game
-# Params: game_ops - list of strings to check for options
+# Params: game_ops - list of tokens to check for options
 # Return: result return code and message
 def diceGame(game_ops):
 #{{{
@@ -66,7 +66,7 @@ def diceGame(game_ops):
 #}}}
 
 # Game option preprocessor
-# Params: game_ops - list of strings to check for options
+# Params: game_ops - list of tokens to check for options
 #         req_ops  - number of required options
 #         game     - string of game checking
 def processOps(game_ops, req_ops, game):
@@ -77,7 +77,7 @@ def processOps(game_ops, req_ops, game):
                     "Use HELP BET " + game + " command "
                     "for required options :duck:")
     # Check for valid options
-    choice = GAME_OPS[game+"_OPS"].get(game_ops[0].upper(),-1)
+    choice = GAME_OPS[game+"_OPS"].get(game_ops[0].norm,-1)
     if choice == -1:
         return -1, ("Invalid options\n"
                     "Use HELP BET " + game + "command "
@@ -1,9 +1,10 @@
-# Last Updated: 2.2
+# Last Updated: 2.4.0
 # Python imports
 import sys
 import os
 import time
 import argparse
+import select
 
 # Slack import
 from slackclient import SlackClient
@@ -12,6 +13,12 @@ from slackclient import SlackClient
 import util.common as util
 from util.diagMessage import DiagMessage
 from util.logger import Logger
+from util.apiPool import ApiPool
+from util.outbox import Outbox
+from util.replay import Recorder
+from util.reconnect import Reconnector
+from util.startCache import StartCache
+from util.channels import ChannelStream
 
 from duckbot import Duckbot
 
@@ -24,7 +31,14 @@ def main():
     initProgram()
     return_code, duckbot = duckboot()
     if not return_code:
-        return_code = run(duckbot)
+        return_code = start(duckbot)
+        # Clean exits and update restarts keep the bank up to the last command
+        if return_code in (0, 2):
+            duckbot.saveBank()
+    util.api_pool.shutdown()
+    util.work_pool.shutdown()
+    if util.recorder:
+        util.recorder.close()
     util.logger.log(DiagMessage("LOG0011I"), flush=True)
     return return_code
 #}}}
@@ -43,9 +57,20 @@ def initProgram():
     cl_parser.add_argument('--debug', action='store_true')
     cl_parser.add_argument('--nolog', dest='log', action='store_false', default=True)
     cl_parser.add_argument('--nobnk', dest='bnk', action='store_false', default=True)
+    cl_parser.add_argument('--async', dest='aio', action='store_true')
+    cl_parser.add_argument('--record', metavar='FILE', default=None)
+    cl_parser.add_argument('--reload', dest='hot_reload', action='store_true')
+    cl_parser.add_argument('--nocache', dest='cache', action='store_false', default=True)
+    cl_parser.add_argument('--store', dest='bank_store', default='file',
+                           choices=['file', 'sqlite', 'journal', 'binary'])
     args = cl_parser.parse_args()
     util.debug = args.debug
     util.bank_file = args.bnk
+    util.bank_store = args.bank_store
+    util.aio = args.aio
+    util.hot_reload = args.hot_reload
+    util.start_cache = StartCache() if args.cache else None
+    util.recorder = Recorder(args.record) if args.record else None
 
     # Start the logger with logging mode
     util.logger = Logger(log=args.log)
@@ -53,35 +78,50 @@ def initProgram():
 #}}}
 
 # Set up and start the bot
-# Params: None
+# Params: bot_token - token to connect with, read from the env file if None
+#         client    - slack client class (or factory taking the token)
 # Return: 0 return code and Duckbot instance on success
 #         Non 0 return code and None on failure
 # Credit: Name courtesy of Katie. What a thinker, what a genius, wow
-def duckboot():
+def duckboot(bot_token = None, client = SlackClient):
 #{{{
     # Get bot token from the env file
-    with open("../.env") as env_file:
-        bot_token = env_file.readline().rstrip().split("=")[1]
+    if not bot_token:
+        with open("../.env") as env_file:
+            bot_token = env_file.readline().rstrip().split("=")[1]
     util.logger.log(DiagMessage("INI0010I", bot_token))
 
     # Create the slack client
-    util.sc = SlackClient(bot_token)
+    util.sc = client(bot_token)
     util.logger.log(DiagMessage("INI0020I"))
+    # Web api calls run on the pool from here on, disk work on its own
+    util.api_pool = ApiPool()
+    util.work_pool = ApiPool(ApiPool.WORK_SIZE, ApiPool.WORK_QUEUE, "work")
 
-    # Get bot info
-    bot_str, bot_channels = util.getBotInfo(bot_token)
+    # Channels stream in the background either way, start off the cache if
+    # there is one and otherwise with what's come in by the time we're up
+    stream = ChannelStream()
+    stream.start()
+    cached = util.start_cache.load(bot_token) if util.start_cache else None
+    if cached:
+        bot_str, bot_channels = cached
+    else:
+        bot_str, bot_channels = util.getBotInfo(bot_token), {}
     bot_id = util.matchUserId(bot_str)
     if not bot_id:
         util.logger.log(DiagMessage("INI0030E",bot_str))
         return util.EXIT_CODES["INVALID_BOT_ID"], None
     util.logger.log(DiagMessage("INI0030I",bot_id))
+    if util.recorder:
+        util.recorder.header(bot_id, bot_channels)
 
     # Connect to rtm and create bot if successful
     return_code = connect()
     if return_code:
         return return_code, None
-    else:
-        return return_code, Duckbot(bot_id, bot_channels)
+    duckbot = Duckbot(bot_id, bot_channels)
+    duckbot.watchChannels(stream)
+    return return_code, duckbot
 #}}}
 
 # Connect to the rtm and test connection
@@ -96,7 +136,9 @@ def connect():
         event_list = []
         # Wait for the connection event
         while not event_list:
-            event_list = util.sc.rtm_read()
+            return_code, event_list = doRead()
+            if return_code:
+                return return_code
         event = event_list.pop(0)
         if event["type"] == "hello":
             # Connection was good
@@ -115,7 +157,21 @@ def connect():
         return util.EXIT_CODES["RTM_CONNECT_FAILED"]
 #}}}
 
-# Running loop, polls for events and hands them to the bot, then ticks the bot
+# Start the outbound sender and run the bot in the configured mode
+# Params: duckbot - Duckbot instance
+# Return: Bot exit code (documented in util.py)
+def start(duckbot):
+#{{{
+    util.outbox = Outbox(util.sc.rtm_send_message)
+    if util.aio:
+        # Only pulled in for --async, it's a good chunk of startup otherwise
+        import asyncio
+        return asyncio.run(arun(duckbot))
+    else:
+        return run(duckbot)
+#}}}
+
+# Running loop, waits for events and hands them to the bot, then runs timers
 # Params: duckbot - Duckbot instance
 # Return: Bot exit code (documented in util.py)
 def run(duckbot):
@@ -125,29 +181,153 @@ def run(duckbot):
     else:
         util.logger.log(DiagMessage("INI0050I"))
 
+    util.outbox.start()
+    websocket = util.sc.server.websocket
+    sock = websocket.sock if websocket else None
+    reconnector = Reconnector(connect)
     running = True
     return_code = 0
     # Keep going until bot signals to stop
     while running:
     # {{{
-        # Pause between reads to reduce the cycles spent spinning
-        # Delay may need to be adjusted if bot feels sluggish to respond
-        time.sleep(util.RTM_READ_DELAY)
-
-        return_code, event_list = doRead()
-        if event_list and not return_code:
-            # Process all the events returned
-            for event in event_list:
+        # Sleep until the rtm has something or the next timer is due
+        timeout = duckbot.nextTimer()
+        if sock:
+            select.select([sock], [], [], timeout)
+        else:
+            time.sleep(min(timeout, util.RTM_READ_DELAY)
+                       if timeout is not None else util.RTM_READ_DELAY)
+
+        # rtm_read hands back one frame at a time, keep going until empty
+        event_list = True
+        while event_list and not return_code:
+            return_code, event_list = doRead()
+            for event in event_list or []:
                 return_code = duckbot.handleEvent(event)
-        # Tick bot internal counter
-        duckbot.tick()
+                if return_code:
+                    break
+        # Dropped connections get brought back instead of exiting
+        if reconnector.handles(return_code):
+            return_code = reconnector.reconnect(return_code)
+            websocket = util.sc.server.websocket
+            sock = websocket.sock if websocket else None
+        # Fire off any timers that came due
+        duckbot.runTimers()
         if return_code:
             running = False
     # }}}
+    # Let any queued messages (like the update notice) go out first
+    util.outbox.close()
+    # Bot signalled to stop, return to mainline
+    return return_code
+#}}}
+
+# Asyncio running loop, wakes up when the rtm socket has data or a timer is
+# due. Outbound messages run as a separate task
+# Params: duckbot - Duckbot instance
+# Return: Bot exit code (documented in util.py)
+async def arun(duckbot):
+#{{{
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    util.logger.log(DiagMessage("INI0051I"))
+    loop = asyncio.get_running_loop()
+
+    # Wake the reader whenever the websocket has something for us
+    readable = asyncio.Event()
+    fd = util.sc.server.websocket.sock.fileno()
+    loop.add_reader(fd, readable.set)
+    reconnector = Reconnector(connect)
+
+    # Outbound messages go out from their own task
+    send_task = loop.create_task(util.outbox.arun())
+    # Handlers and timers block, so they run on one bot thread of their own,
+    # in order, while the loop keeps reading. Events that come in meanwhile
+    # wait in events for the next batch
+    bot_thread = ThreadPoolExecutor(1, "bot")
+    reading = loop.create_task(readable.wait())
+    working = None
+    events = []
+    wait = duckbot.nextTimer()
+    due = None if wait is None else loop.time() + wait
+
+    return_code = 0
+    try:
+        while not return_code:
+        #{{{
+            # Sleep until the rtm has something, the bot thread is done or
+            # the next timer is due, timers ride along with a running batch
+            timeout = None
+            if working is None and due is not None:
+                timeout = max(0, due - loop.time())
+            waiting = {reading} if working is None else {reading, working}
+            done, _ = await asyncio.wait(waiting, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+
+            if reading in done:
+                readable.clear()
+                reading = loop.create_task(readable.wait())
+                # rtm_read hands back one frame at a time, keep going until
+                # empty
+                event_list = True
+                while event_list and not return_code:
+                    return_code, event_list = doRead()
+                    events += event_list or []
+            if working in done:
+                handled, wait = working.result()
+                working = None
+                due = None if wait is None else loop.time() + wait
+                return_code = return_code or handled
+            # Dropped connections get brought back instead of exiting, once
+            # the bot thread is done with the old one
+            if reconnector.handles(return_code):
+                if working is not None:
+                    await working
+                    working = None
+                loop.remove_reader(fd)
+                fd = None
+                return_code = await reconnector.areconnect(return_code)
+                if not return_code:
+                    fd = util.sc.server.websocket.sock.fileno()
+                    loop.add_reader(fd, readable.set)
+                due = loop.time()
+            # Hand over whatever has piled up, or just the timers that are due
+            if (not return_code and working is None and
+                (events or due is not None and loop.time() >= due)):
+                batch, events = events, []
+                working = asyncio.wrap_future(
+                    bot_thread.submit(dispatch, duckbot, batch))
+        #}}}
+    finally:
+        reading.cancel()
+        # Let the batch in hand finish, it may be saving the bank
+        if working is not None:
+            await asyncio.wait({working})
+        bot_thread.shutdown()
+        if fd is not None:
+            loop.remove_reader(fd)
+        # Let any queued messages (like the update notice) go out first
+        util.outbox.close()
+        await send_task
     # Bot signalled to stop, return to mainline
     return return_code
 #}}}
 
+# Hand a batch of events to the bot then run the timers, on the bot thread
+# Params: duckbot - Duckbot instance
+#         events  - list of raw rtm events
+# Return: Bot exit code from the handlers and seconds until the next timer
+def dispatch(duckbot, events):
+#{{{
+    return_code = 0
+    for event in events:
+        return_code = duckbot.handleEvent(event)
+        if return_code:
+            break
+    duckbot.runTimers()
+    return return_code, duckbot.nextTimer()
+#}}}
+
 # Attempt an rtm_read, catching errors on failure
 # Params: None
 # Return: 0 return code and populated event list on success
@@ -158,7 +338,12 @@ def doRead():
     # When new errors are experienced, they will be added specifically
     try:
         event_list = util.sc.rtm_read()
+        if util.recorder:
+            util.recorder.record(event_list)
         return 0, event_list
+    # Non ssl sockets (local testing) raise when there's nothing to read
+    except BlockingIOError:
+        return 0, []
     except TimeoutError:
         util.logger.log(DiagMessage("BOT0031E"))
         return util.EXIT_CODES["RTM_TIMEOUT_ERROR"], None
@@ -0,0 +1,107 @@
+# Last Updated: 2.4.0
+# Python imports
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+# Project imports
+import util.common as util
+from util.diagMessage import DiagMessage
+
+# Api pool class
+# Runs slack web api calls on worker threads so the rtm loop doesn't have to
+# sit through the http round trip. A second, smaller pool of the same kind
+# takes the disk and background work (bank saves, git pull) so a slow save
+# can't fill the queue replies wait in
+class ApiPool:
+    POOL_SIZE  = 4
+    QUEUE_MAX  = 32
+    WORK_SIZE  = 2
+    WORK_QUEUE = 8
+
+    # Constructor for api pool
+    # Params: pool_size - number of worker threads
+    #         queue_max - number of calls allowed to wait for a worker
+    #         name      - pool name for the logs and worker threads
+    # Return: ApiPool instance
+    def __init__(self, pool_size = POOL_SIZE, queue_max = QUEUE_MAX,
+                 name = "api"):
+    #{{{
+        self.pool_size = pool_size
+        self.queue_max = queue_max
+        self.executor = ThreadPoolExecutor(max_workers=pool_size,
+                                           thread_name_prefix=name)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        util.logger.log(DiagMessage("INI0021I", name,
+            "size " + str(pool_size), "queue " + str(queue_max)))
+    #}}}
+
+    # Make a web api call on the pool
+    # Params: method - api method to call
+    #         kwargs - arguments for the api call
+    # Return: Future resolving to the api response dict
+    def call(self, method, **kwargs):
+        return self.submit(method, util.sc.api_call, method, **kwargs)
+
+    # Run a function on the pool
+    # Params: name   - name to log the call under
+    #         func   - function to run
+    #         args   - positional arguments for func
+    #         kwargs - keyword arguments for func
+    # Return: Future resolving to the function result
+    #         Failed calls resolve to a slack style error response
+    def submit(self, name, func, *args, **kwargs):
+    #{{{
+        with self.lock:
+            # Queue is full, fail now instead of backing up the caller
+            if self.queued >= self.queue_max:
+                util.logger.log(DiagMessage("BOT0071E", name))
+                future = Future()
+                future.set_result({"ok": False, "error": "api_queue_full"})
+                return future
+            self.queued += 1
+        return self.executor.submit(self._run, name, time.monotonic(),
+                                    func, *args, **kwargs)
+    #}}}
+
+    # Stop taking calls and let the workers finish up
+    # Params: wait - wait for running calls to complete
+    # Return: None
+    def shutdown(self, wait = False):
+        self.executor.shutdown(wait=wait)
+
+    # Worker side of a call, times the call and logs the pool state
+    # Params: name      - name to log the call under
+    #         submitted - monotonic time the call was submitted
+    #         func      - function to run
+    #         args      - positional arguments for func
+    #         kwargs    - keyword arguments for func
+    # Return: function result or error response
+    def _run(self, name, submitted, func, *args, **kwargs):
+    #{{{
+        started = time.monotonic()
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            result = func(*args, **kwargs)
+        except Exception as err:
+            util.logger.log(DiagMessage("BOT0072E", name, str(err)))
+            result = {"ok": False, "error": str(err)}
+        finished = time.monotonic()
+        with self.lock:
+            self.active -= 1
+            depth = self.queued
+        util.logger.log(DiagMessage("BOT0070I", name,
+            "wait " + self._ms(started - submitted),
+            "call " + self._ms(finished - started),
+            "depth " + str(depth)))
+        return result
+    #}}}
+
+    # Format seconds as milliseconds
+    # Params: seconds - time to format
+    # Return: string of milliseconds
+    def _ms(self, seconds):
+        return "{:.1f}ms".format(seconds * 1000)
@@ -1,22 +1,172 @@
-# Last Updated: 2.3.0
-import random
+# Last Updated: 2.4.0
+import time
 import copy
-import util.choiceFunctions as cFunc
+import threading
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import compress, repeat
+from operator import add, mul
 import util.common as util
+from util.diagMessage import DiagMessage
+from util.bankStore import STORES
+from util.indexedSet import IndexedSet
+from util.ledger import Ledger
+from util.rankedList import RankedList
+
+# Rows out of a set of bank columns
+# Params: users    - list of user ids by row
+#         balances - balance array by row
+#         pools    - pool matrix, POOL_SIZE counts per row
+#         pulled   - refresh day of the last free pull by row
+#         settled  - regen tick each balance is settled up to by row
+#         rows     - rows to get, all of them by default
+# Return: generator of (user, balance, pool list, pulled, since) tuples
+def bankRows(users, balances, pools, pulled, settled, rows = None):
+#{{{
+    size = Bank.POOL_SIZE
+    for row in range(len(users)) if rows is None else rows:
+        base = row * size
+        yield (users[row], balances[row], pools[base:base + size].tolist(),
+               pulled[row], settled[row])
+#}}}
+
+# Regen owed to a balance, +REGEN_AMOUNT for every regen tick since it was
+# settled, up to REGEN_CAP. Same as running the old five minute job that
+# many times
+# Params: balance - balance as of tick since
+#         since   - regen tick the balance is settled up to
+#         tick    - regen tick to settle up to
+# Return: balance as of tick
+def regenBalance(balance, since, tick):
+#{{{
+    if balance >= Bank.REGEN_CAP or tick <= since:
+        return balance
+    return min(Bank.REGEN_CAP, balance + Bank.REGEN_AMOUNT * (tick - since))
+#}}}
+
+# Where a balance stands on the balance board. A balance under REGEN_CAP
+# grows REGEN_AMOUNT a tick from when it was settled, so taking that off
+# for every tick up to then orders it where its regen puts it. Settling
+# leaves it alone unless the cap is hit, so the board never goes stale
+# Params: balance - balance as of tick since
+#         since   - regen tick the balance is settled up to
+# Return: board standing, REGEN_CAP and up is the balance itself
+def boardStanding(balance, since):
+#{{{
+    if balance >= Bank.REGEN_CAP:
+        return balance
+    return balance - Bank.REGEN_AMOUNT * since
+#}}}
+
+# Balance a board standing comes to, see boardStanding
+# Params: standing - board standing
+#         tick     - regen tick to settle up to
+# Return: balance as of tick
+def standingBalance(standing, tick):
+#{{{
+    if standing >= Bank.REGEN_CAP:
+        return standing
+    return min(Bank.REGEN_CAP, standing + Bank.REGEN_AMOUNT * tick)
+#}}}
+
+# Snapshot class
+# Copy of the bank columns that a background save writes out
+class Snapshot:
+    __slots__ = ("users", "balances", "pools", "pulled", "settled", "gacha_pool",
+                 "day")
+
+    # Constructor for snapshot, copies are all C level array copies
+    # Params: bank - Bank to copy
+    # Return: Snapshot instance
+    def __init__(self, bank):
+    #{{{
+        self.users = bank.users[:]
+        self.balances = bank.balances[:]
+        self.pools = bank.pools[:]
+        self.pulled = bank.pulled[:]
+        self.settled = bank.settled[:]
+        self.gacha_pool = copy.copy(bank.gacha_pool)
+        self.day = bank.day
+    #}}}
+
+    # Get every row of the snapshot
+    # Params: None
+    # Return: generator of (user, balance, pool list, pulled, since) tuples
+    def rows(self):
+        return bankRows(self.users, self.balances, self.pools, self.pulled,
+                        self.settled)
 
 # Bank class
+# Kept in columns, one row per player. Bulk jobs like nuke are whole array
+# operations instead of a walk over everyone
+#   users    - user id by row, index maps user id back to row
+#   balances - signed 64 bit balance by row
+#   pools    - POOL_SIZE unsigned counts per row, row major
+#   pulled   - refresh day each player last used their free pull on, the
+#              free pull is back once day moves past it
+#   settled  - regen tick each balance is settled up to. Regen isn't a job
+#              over everyone anymore, it's worked out from this the next
+#              time the balance is looked at
+# Indexes over the pools, kept up as counts change so stealing and losing
+# never scan
+#   holders  - rows holding at least one of each pool id
+#   tops     - best pool id held by row, -1 for an empty pool
+# Leaderboards, built the first time one is asked for and kept up after
+#   boards   - RankedList per board of -score * BOARD_SPAN + row, so the
+#              front is the highest score and ties go to the older row.
+#              Balances score their boardStanding, so regen owed counts
+#              without settling anyone. Players owed up to REGEN_CAP rank
+#              after the ones already holding it
+# Transactions each player did go in the ledger, see util.ledger
+# Safe to use from more than one thread. Players are locked in stripes by
+# user id and the pools, which pulls and steals share, have a lock of their
+# own. Anything that has to check and then change goes through one of the
+# transactions (settleBet, pull, transfer) so it all happens under the locks
 class Bank:
     DEFAULT_POOL  = [-1,-1,500,100,50,10,3,1]
     STARTING_POOL = [0,0,0,0,0,0,0,0]
     STARTING_BUX  = 100
+    POOL_SIZE     = len(DEFAULT_POOL)
+    REGEN_AMOUNT  = 5
+    REGEN_CAP     = 100
+    REFRESH_TIME  = datetime(1,1,1,12)
+    LOCK_STRIPES  = 64
+    POOL_WEIGHTS  = [0,1,5,10,20,50,100,1000]
+    BOARD_SPAN    = 1 << 32
+    BALANCE_BOARD = 0
+    POOL_BOARD    = 1
 
     # Constructor for bank class
-    # Params: None
+    # Params: store - storage backend, picked from util.bank_store by default
     # Return: Bank instance
-    def __init__(self):
+    def __init__(self, store = None):
     #{{{
-        self.players = {}
-        if util.bank_file:
+        self.users = []
+        self.index = {}
+        self.balances = array("q")
+        self.pools = array("I")
+        self.pulled = array("i")
+        self.settled = array("q")
+        self.holders = [IndexedSet() for _ in range(self.POOL_SIZE)]
+        self.tops = array("b")
+        self.stripes = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self.pool_lock = threading.Lock()
+        self.boards = None
+        # Taken last, under whatever player or pool locks changed the score
+        self.board_lock = threading.Lock()
+        # Wall clock, regen ticks and refresh days carry on while the bot is
+        # down
+        self.clock = time.time
+        self.day = self._refreshDay()
+        # Changed since the last save
+        self.dirty = False
+        self.saving = None
+        if store is None and util.bank_file:
+            store = STORES[util.bank_store]()
+        self.store = store
+        self.ledger = Ledger(self) if store else Ledger(self, None)
+        if self.store:
             self.readState()
         else:
             self.gacha_pool = self.DEFAULT_POOL
@@ -27,41 +177,200 @@ class Bank:
     # Return: None
     def addUser(self, user):
     #{{{
-        self.players[user] = {
-             "balance" : self.STARTING_BUX
-            ,"pool"    : copy.copy(self.STARTING_POOL)
-            ,"pull"    : True
-        }
+        # The pool lock also keeps two new rows from going in at once
+        with self.locked((user,), pool = True):
+            self._addUser(user)
     #}}}
 
-    # Get balance of user and adjust
+    # Get balance of user and adjust, settling any regen owed first
     # Params: user   - user to get balance of
     #         adjust - amount to adjust user balance
     # Return: int val of user balance
     def balance(self, user, adjust = 0):
     #{{{
+        with self.locked((user,)):
+            return self._balance(user, adjust)
+    #}}}
+
+    # Settle a bet in one go, the balance can't move between the check and
+    # the payout
+    # Params: user   - user id that bet
+    #         amount - amount bet
+    #         won    - True if the bet was won
+    # Return: balance after, None if the balance was too low for the bet
+    def settleBet(self, user, amount, won):
+    #{{{
+        with self.locked((user,)):
+            if self._balance(user) < amount:
+                return None
+            return self._balance(user, amount if won else -amount, Ledger.BET)
+    #}}}
+
+    # Move bux from one player to another
+    # Params: source - user id paying
+    #         dest   - user id getting paid
+    #         amount - amount to move
+    # Return: True if moved, False if the source was too low
+    def transfer(self, source, dest, amount):
+    #{{{
+        with self.locked((source, dest)):
+            if self._balance(source) < amount:
+                return False
+            self._balance(source, -amount, Ledger.GIVE, dest)
+            self._balance(dest, amount, Ledger.GET, source)
+            return True
+    #}}}
+
+    # Buy and do a run of pulls in one go. Free pull, cost and every pull,
+    # including anything stolen from other players, all go through together
+    # Params: user   - user id pulling
+    #         amount - number of pulls
+    #         cost   - cost of each pull
+    #         roll   - function giving a pull id, -1 for losing the best item
+    #                  and -2 for a nuke
+    # Return: None if the balance was too low, otherwise True if the free pull
+    #         was used and a list of (pull id, result) with the removeBest or
+    #         addPool result of each pull, ending early on a nuke
+    def pull(self, user, amount, cost, roll):
+    #{{{
+        with self.locked((user,), pool = True):
+            free = self.hasFreePull(user)
+            charge = (amount - free) * cost
+            if charge > self._balance(user):
+                return None
+            self._balance(user, -charge, Ledger.PULL)
+            if free:
+                self._setFreePull(False, user)
+            results = []
+            for _ in range(amount):
+                pull_id = roll()
+                if pull_id == -2:
+                    self._nuke(user)
+                    results.append((pull_id, None))
+                    break
+                elif pull_id == -1:
+                    results.append((pull_id, self._removeBest(user)))
+                else:
+                    results.append((pull_id, self._addPool(pull_id, user)))
+            return free, results
+    #}}}
+
+    # Hold the locks of some players, and the pools if asked. Always taken in
+    # the same order, stripes low to high then the pool lock, so transactions
+    # can't end up waiting on each other
+    # Params: users - user ids to lock
+    #         pool  - True to lock the pools too
+    # Return: context manager holding the locks
+    @contextmanager
+    def locked(self, users, pool = False):
+    #{{{
+        locks = [self.stripes[stripe] for stripe in
+                 sorted({hash(user) % self.LOCK_STRIPES for user in users})]
+        if pool:
+            locks.append(self.pool_lock)
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+    #}}}
+
+    # Hold every lock, for whole bank jobs that need nothing moving under them
+    # Params: None
+    # Return: context manager holding the locks
+    @contextmanager
+    def exclusive(self):
+    #{{{
+        for lock in self.stripes:
+            lock.acquire()
+        self.pool_lock.acquire()
+        try:
+            yield
+        finally:
+            self.pool_lock.release()
+            for lock in reversed(self.stripes):
+                lock.release()
+    #}}}
+
+    # Add user to bank, locks held
+    # Params: user - user id to add to bank
+    # Return: None
+    def _addUser(self, user):
+    #{{{
+        row = self.index.get(user)
+        # Rejoining starts over in the same row
+        if row is not None:
+            base = row * self.POOL_SIZE
+            tick = self._tick()
+            self._rescore(self.BALANCE_BOARD, row,
+                          boardStanding(self.balances[row], self.settled[row]),
+                          boardStanding(self.STARTING_BUX, tick))
+            self._rescore(self.POOL_BOARD, row, self._poolValue(row), 0)
+            self.balances[row] = self.STARTING_BUX
+            self.pools[base:base + self.POOL_SIZE] = array("I", self.STARTING_POOL)
+            self.settled[row] = tick
+            self.pulled[row] = 0
+            for holders in self.holders:
+                holders.discard(row)
+            self.tops[row] = -1
+        else:
+            row = len(self.users)
+            self.index[user] = row
+            self.users.append(user)
+            tick = self._tick()
+            self.balances.append(self.STARTING_BUX)
+            self.pools.extend(self.STARTING_POOL)
+            self.settled.append(tick)
+            self.pulled.append(0)
+            self.tops.append(-1)
+            if self.boards is not None:
+                with self.board_lock:
+                    self.boards[self.BALANCE_BOARD].add(row - boardStanding(
+                        self.STARTING_BUX, tick) * self.BOARD_SPAN)
+                    self.boards[self.POOL_BOARD].add(row)
+        self.ledger.join(user, self.STARTING_BUX)
+        self._mark(user)
+    #}}}
+
+    # Get balance of user and adjust, player lock held
+    # Params: user   - user to get balance of
+    #         adjust - amount to adjust user balance
+    #         kind   - ledger kind to note the adjustment as
+    #         other  - user id on the other side of the adjustment, if any
+    # Return: int val of user balance
+    def _balance(self, user, adjust = 0, kind = Ledger.ADJUST, other = None):
+    #{{{
+        row = self.index[user]
+        old = boardStanding(self.balances[row], self.settled[row])
+        tick = self._tick()
+        if self.settled[row] != tick:
+            balance = regenBalance(self.balances[row], self.settled[row], tick)
+            self.settled[row] = tick
+            # Settling alone doesn't need writing, the stored balance and
+            # tick still come out the same
+            if balance != self.balances[row]:
+                self.ledger.record(user, Ledger.REGEN,
+                                   balance - self.balances[row])
+                self.balances[row] = balance
+                self._mark(user)
         if adjust:
-            self.players[user]["balance"] += adjust
-        return self.players[user]["balance"]
+            self.balances[row] += adjust
+            self.ledger.record(user, kind, adjust, other)
+            self._mark(user)
+        self._rescore(self.BALANCE_BOARD, row, old,
+                      boardStanding(self.balances[row], tick))
+        return self.balances[row]
     #}}}
 
     # Get pool of user
     # Params: user - user to get pool of
     # Return: gacha pool
     def getPool(self, user):
-        return self.players[user]["pool"]
-
-    # Regen bux for low players
-    # Params: None
-    # Return: None
-    def regen(self):
     #{{{
-        for player in self.players:
-            balance = self.players[player]["balance"]
-            if balance <= 95:
-                self.players[player]["balance"] += 5
-            elif balance < 100:
-                self.players[player]["balance"] = 100
+        base = self.index[user] * self.POOL_SIZE
+        return self.pools[base:base + self.POOL_SIZE].tolist()
     #}}}
 
     # Wipe all player's gacha pools
@@ -69,8 +378,8 @@ class Bank:
     # Return: None
     def nuke(self):
     #{{{
-        for player in self.players:
-            self.players[player]["pool"] = self.STARTING_POOL
+        with self.locked((), pool = True):
+            self._nuke()
     #}}}
 
     # Remove the best item from a users gacha pool
@@ -78,15 +387,8 @@ class Bank:
     # Return: pull id of removed value or -1 if pool was empty
     def removeBest(self, user):
     #{{{
-        pool = self.players[user]["pool"]
-        try:
-            pid = max([ind for ind, val in enumerate(pool) if val > 0])
-            pool[pid] -= 1
-            self.gacha_pool[pid] += 1
-            return pid
-        # Pool was empty
-        except ValueError:
-            return -1
+        with self.locked((), pool = True):
+            return self._removeBest(user)
     #}}}
 
     # Add value to user pool
@@ -94,122 +396,448 @@ class Bank:
     #         user - user id to add to
     # Return: True if added, False otherwise
     def addPool(self, pid, user):
+    #{{{
+        with self.locked((), pool = True):
+            return self._addPool(pid, user)
+    #}}}
+
+    # Wipe all player's gacha pools, pool lock held
+    # Params: user - user id that set it off, None if nobody
+    # Return: None
+    def _nuke(self, user = None):
+    #{{{
+        self.pools = array("I", self.STARTING_POOL) * len(self.users)
+        self.holders = [IndexedSet() for _ in range(self.POOL_SIZE)]
+        self.tops = array("b", [-1]) * len(self.users)
+        if self.boards is not None:
+            with self.board_lock:
+                self.boards[self.POOL_BOARD] = RankedList(range(len(self.users)))
+        self.ledger.nuke(user)
+        self.dirty = True
+        if self.store:
+            self.store.nuke(self.STARTING_POOL)
+    #}}}
+
+    # Remove the best item from a users gacha pool, pool lock held
+    # Params: user - user id to remove from
+    # Return: pull id of removed value or -1 if pool was empty
+    def _removeBest(self, user):
+    #{{{
+        row = self.index[user]
+        pid = self.tops[row]
+        # Pool was empty
+        if pid < 0:
+            return -1
+        self._take(row, pid)
+        self.gacha_pool[pid] += 1
+        self.ledger.record(user, Ledger.LOSE, pid)
+        self._mark(user, True)
+        return pid
+    #}}}
+
+    # Add value to user pool, pool lock held
+    # Params: pid  - pull id to increase
+    #         user - user id to add to
+    # Return: user that got it, the one stolen from if it was stolen, or
+    #         None if there were none left
+    def _addPool(self, pid, user):
     #{{{
         result = user
         # Attempt to steal because pool was empty
         if (self.gacha_pool[pid] == 0):
             chosen = self._steal(pid, user)
             if chosen: # another user was stolen from
-                self.players[chosen]["pool"][pid] -= 1
+                self._take(self.index[chosen], pid)
+                self.ledger.record(user, Ledger.STEAL, pid, chosen)
+                self.ledger.record(chosen, Ledger.STOLEN, pid, user)
+                self._mark(chosen)
                 result = chosen
             else:      # the user owns them all
                 return None
         # Taking from non infinite pool
         elif (self.gacha_pool[pid] > 0):
             self.gacha_pool[pid] -= 1
-        self.players[user]["pool"][pid] += 1
+        row = self.index[user]
+        self.pools[row * self.POOL_SIZE + pid] += 1
+        self.holders[pid].add(row)
+        if pid > self.tops[row]:
+            self.tops[row] = pid
+        self._repool(row, self.POOL_WEIGHTS[pid])
+        self._mark(user, True)
         return result
     #}}}
 
-    # Read in bank state file and initialize
+    # Read in bank state from the store and initialize
     # Params: None
     # Return: None
-    # Notes : Please don't write your own bank file.
-    # You make mistakes, the bot doesn't
     def readState(self):
     #{{{
-        reading_players = True
-        try:
-            with open("bank.dat","r") as data:
-                for line in data:
-                    line = line.strip()
-                    # Skip comments
-                    if line.startswith("#"):
-                        pass
-                    # Signal switch to pool
-                    elif line.startswith(";"):
-                        reading_players = False
-                    # Parse line for player data
-                    elif reading_players and line:
-                        player_data = self._parsePlayerData(line.split(":"))
-                        if player_data:
-                            self.players[player_data[0]] = {
-                                 "balance" : player_data[1]
-                                ,"pool"    : player_data[2]
-                                ,"pull"    : player_data[3]
-                            }
-                    # Parse line for gacha data
-                    elif line:
-                        self.gacha_pool = [int(val) for val in line.split(",")]
-        # File doesn't exist, can't be read or gacha pool format error
-        except (OSError, ValueError):
-            self.gacha_pool = self.DEFAULT_POOL
+        if self.store.COLUMNS:
+            columns = self.store.loadColumns()
+            if columns is None:
+                rows, gacha_pool = self.store.importRows()
+            elif len(columns[5]) == self.POOL_SIZE:
+                self._adoptColumns(columns)
+                self._buildIndex()
+                return
+            # Another pool size goes in a row at a time like the text stores
+            # do, a copy of the original is kept and the converted bank saved
+            else:
+                rows, gacha_pool = self.store.columnRows(columns), columns[5]
+                if columns[0]:
+                    util.logger.log(DiagMessage("BOT0144I", self.store.fn,
+                        str(len(gacha_pool)), self.store.keepAside("pool")))
+                    self.dirty = True
+        else:
+            rows, gacha_pool = self.store.load()
+        tick = self._tick()
+        for user, balance, pool, pulled, since in rows:
+            # Pools from before ids were added get none of the new ones, ones
+            # too long don't fit the matrix and are dropped like bad lines
+            if len(pool) < self.POOL_SIZE:
+                pool = pool + self.STARTING_POOL[len(pool):]
+            if len(pool) != self.POOL_SIZE or user in self.index:
+                continue
+            row = len(self.users)
+            self.index[user] = row
+            self.users.append(user)
+            self.balances.append(balance)
+            self.pools.extend(pool)
+            # Unknown means no regen owed from before
+            self.settled.append(since if since > 0 else tick)
+            # Stores from before refresh days only know the pull was used,
+            # today's the best guess and gets written back
+            if pulled < 0:
+                pulled = self.day
+                self._mark(user)
+            self.pulled.append(pulled)
+        if not gacha_pool or len(gacha_pool) > self.POOL_SIZE:
+            gacha_pool = self.DEFAULT_POOL
+        # New ids start out as many as the default has
+        self.gacha_pool = gacha_pool + self.DEFAULT_POOL[len(gacha_pool):]
+        self._buildIndex()
     #}}}
 
-    # Save bank state into file
+    # Take over columns a store read in whole, nothing per player gets built
+    # but the user index
+    # Params: columns - (users, balances, pools, pulled, settled, gacha_pool)
+    # Return: None
+    def _adoptColumns(self, columns):
+    #{{{
+        (self.users, self.balances, self.pools, self.pulled, self.settled,
+         self.gacha_pool) = columns
+        self.index = dict(zip(self.users, range(len(self.users))))
+    #}}}
+
+    # Save bank state through the store if anything changed. Stores that
+    # write the whole bank do it on a worker from a snapshot of the columns
+    # Params: wait - save on this thread, after any save still going
+    # Return: None
+    def saveState(self, wait = False):
+    #{{{
+        if not self.store:
+            return
+        saving = self.saving
+        if saving is not None and not saving.done():
+            # Changes since it started stay dirty for the next one
+            if not wait:
+                return
+            saving.result()
+        if not self.dirty:
+            return
+
+        self.dirty = False
+        if wait or not self.store.BACKGROUND or util.work_pool is None:
+            with self.exclusive():
+                saved = self.store.save(self)
+            if not saved:
+                self.dirty = True
+            return
+        # Copying the columns is a handful of memcpys, the worker gets its
+        # own and the bank carries on changing
+        with self.exclusive():
+            snapshot = self.snapshot()
+        self.saving = util.work_pool.submit("bank save", self.store.save,
+                                            snapshot)
+        self.saving.add_done_callback(self._saved)
+    #}}}
+
+    # Write out changes marked since the last flush, stores that only save
+    # whole ignore it. Buffered ledger entries go out too
     # Params: None
     # Return: None
-    def saveState(self):
+    def flush(self):
     #{{{
-        try:
-            with open("bank.dat","w") as data:
-                # Write out player data
-                data.write("# Players\n")
-                for key in self.players:
-                    data.write(key + ":" + str(self.players[key]["balance"]))
-                    data.write(":" + ",".join(map(str,self.players[key]["pool"])))
-                    data.write(":" + str(self.players[key]["pull"]))
-                    data.write("\n")
-                data.write(";\n")
-                # Write pool data
-                data.write("# Gacha Pool\n")
-                data.write(",".join(map(str,self.gacha_pool)))
-        # File couldn't be written
-        except OSError:
-            pass
+        self.ledger.flush()
+        if self.store:
+            with self.exclusive():
+                self.store.flush(self)
+    #}}}
+
+    # Copy the columns for writing out off the event thread, bank held
+    # Params: None
+    # Return: Snapshot instance
+    def snapshot(self):
+        return Snapshot(self)
+
+    # Get every row of the bank
+    # Params: None
+    # Return: generator of (user, balance, pool list, pulled, since) tuples
+    def rows(self):
+        return bankRows(self.users, self.balances, self.pools, self.pulled,
+                        self.settled)
+
+    # Get one row of the bank
+    # Params: user - user id
+    # Return: (user, balance, pool list, pulled, since) tuple or None if not
+    #         a member
+    def row(self, user):
+    #{{{
+        row = self.index.get(user)
+        if row is None:
+            return None
+        return next(bankRows(self.users, self.balances, self.pools,
+                             self.pulled, self.settled, (row,)))
+    #}}}
+
+    # Get the top of a leaderboard, balances with any regen owed
+    # Params: board - BALANCE_BOARD or POOL_BOARD
+    #         count - number of players to get
+    # Return: list of up to count (user, score) tuples, best first
+    def leaders(self, board, count):
+    #{{{
+        boards = self._getBoards()
+        span = self.BOARD_SPAN
+        with self.board_lock:
+            keys = boards[board].top(count)
+        if board == self.POOL_BOARD:
+            return [(self.users[key % span], -(key // span)) for key in keys]
+        tick = self._tick()
+        return [(self.users[key % span], standingBalance(-(key // span), tick))
+                for key in keys]
+    #}}}
+
+    # Get where a player stands on a leaderboard, settling their balance
+    # first
+    # Params: board - BALANCE_BOARD or POOL_BOARD
+    #         user  - user id to rank
+    # Return: (rank, score, players on the board), players tied on score
+    #         share a rank
+    def rank(self, board, user):
+    #{{{
+        boards = self._getBoards()
+        with self.locked((user,), pool = board == self.POOL_BOARD):
+            if board == self.BALANCE_BOARD:
+                score = self._balance(user)
+                # Under the cap, anyone owed past the score is ahead
+                standing = boardStanding(score, self.settled[self.index[user]])
+            else:
+                score = standing = self._poolValue(self.index[user])
+            with self.board_lock:
+                ranked = boards[board]
+                return (ranked.rank(-standing * self.BOARD_SPAN) + 1, score,
+                        len(ranked))
+    #}}}
+
+    # Get some of a player's transactions, settling their balance first so
+    # regen owed shows up
+    # Params: user  - user id to get
+    #         start - number of newest transactions to skip
+    #         count - number of transactions to get
+    # Return: list of (time, ledger kind, amount, other user id or None)
+    #         tuples, newest first
+    def history(self, user, start, count):
+    #{{{
+        self.balance(user)
+        return self.ledger.history(user, start, count)
     #}}}
 
     # Check if user in bank
     # Params: user - user id to check member status of
     # Return: True if member, false otherwise
     def isMember(self, user):
-        return user in self.players
+        return user in self.index
 
     # Check for free pull available
     # Params: user - uid to check
     # Return: True if available, False otherwise
     def hasFreePull(self, user):
-        return self.players[user]['pull'] == True
+        return self.pulled[self.index[user]] < self.day
 
-    # Set free pull value of users
-    # Params: value - boolean value to set user pull to
-    #         user  - user id to set, if null sets all users
+    # Set free pull value of a user
+    # Params: value - True to give the free pull back, False to use it up
+    #         user  - user id to set
     # Return: None
-    def setFreePull(self, value, user = None):
+    def setFreePull(self, value, user):
     #{{{
-        if user:
-            self.players[user]["pull"] = value
-        else:
-            for player in self.players:
-                self.players[player]["pull"] = value
+        with self.locked((user,)):
+            self._setFreePull(value, user)
     #}}}
 
-    # Parse player data of line
-    # Params: data - line data
-    # Return: player data list or None
-    def _parsePlayerData(self, data):
+    # Move on to the next refresh day, giving everyone their free pull back.
+    # Only the day changes, nobody's row needs touching or writing
+    # Params: None
+    # Return: None
+    def refreshPulls(self):
     #{{{
-        try:
-            if len(data) == 4:
-                player_data = [util.matchUserId(data[0])]
-                player_data.append(int(data[1]))
-                player_data.append([int(val) for val in data[2].split(",")])
-                player_data.append(data[3] == "True")
-                if player_data[0]:
-                    return player_data
-        except ValueError:
-            pass
-        return None
+        # Timers fire a touch early, and the wall clock wins after a suspend
+        self.day = max(self.day + 1, self._refreshDay())
+    #}}}
+
+    # Set free pull value of a user, player lock held
+    # Params: value - True to give the free pull back, False to use it up
+    #         user  - user id to set
+    # Return: None
+    def _setFreePull(self, value, user):
+    #{{{
+        self.pulled[self.index[user]] = 0 if value else self.day
+        self._mark(user)
+    #}}}
+
+    # Background save finished, keep dirty if it failed
+    # Params: future - future from the save, True when it went through
+    # Return: None
+    def _saved(self, future):
+    #{{{
+        if future.result() is not True:
+            self.dirty = True
+    #}}}
+
+    # Current regen tick
+    # Params: None
+    # Return: number of REGEN_TIME intervals since the epoch
+    def _tick(self):
+        return int(self.clock() // util.REGEN_TIME)
+
+    # Current refresh day, counted in days that start at REFRESH_TIME
+    # Params: None
+    # Return: ordinal of the day the last refresh happened on
+    def _refreshDay(self):
+    #{{{
+        refresh = self.REFRESH_TIME
+        return (datetime.fromtimestamp(self.clock()) -
+                timedelta(hours=refresh.hour, minutes=refresh.minute,
+                          seconds=refresh.second)).toordinal()
+    #}}}
+
+    # Tell the store a player changed
+    # Params: user - user id that changed
+    #         pool - True if the gacha pool changed too
+    # Return: None
+    def _mark(self, user, pool = False):
+    #{{{
+        self.dirty = True
+        if self.store:
+            self.store.mark(user)
+            if pool:
+                self.store.markPool()
+    #}}}
+
+    # Take one of a pool id from a row, keeping the indexes up
+    # Params: row - row to take from, holding at least one
+    #         pid - pool id to take
+    # Return: None
+    def _take(self, row, pid):
+    #{{{
+        spot = row * self.POOL_SIZE + pid
+        self.pools[spot] -= 1
+        self._repool(row, -self.POOL_WEIGHTS[pid])
+        if self.pools[spot]:
+            return
+        self.holders[pid].discard(row)
+        # Gave up the best one, next best is somewhere underneath
+        if self.tops[row] == pid:
+            base = row * self.POOL_SIZE
+            while pid >= 0 and not self.pools[base + pid]:
+                pid -= 1
+            self.tops[row] = pid
+    #}}}
+
+    # Weighted value of a row's pool
+    # Params: row - row to value
+    # Return: sum of each count times its POOL_WEIGHTS weight
+    def _poolValue(self, row):
+    #{{{
+        base = row * self.POOL_SIZE
+        return sum(map(mul, self.pools[base:base + self.POOL_SIZE],
+                       self.POOL_WEIGHTS))
+    #}}}
+
+    # Move a row on a leaderboard, if the boards are built
+    # Params: board - BALANCE_BOARD or POOL_BOARD
+    #         row   - row that changed
+    #         old   - score the row is on the board with
+    #         new   - score to move it to
+    # Return: None
+    def _rescore(self, board, row, old, new):
+    #{{{
+        if self.boards is None or old == new:
+            return
+        span = self.BOARD_SPAN
+        with self.board_lock:
+            ranked = self.boards[board]
+            ranked.remove(row - old * span)
+            ranked.add(row - new * span)
+    #}}}
+
+    # Move a row on the pool board after its pool changed, pool lock held
+    # Params: row    - row that changed
+    #         change - weight of what was added, negative for taken
+    # Return: None
+    def _repool(self, row, change):
+    #{{{
+        if self.boards is not None and change:
+            value = self._poolValue(row)
+            self._rescore(self.POOL_BOARD, row, value - change, value)
+    #}}}
+
+    # Get the leaderboards, building them off the columns the first time.
+    # Scores are kept up from then on so this only sorts once
+    # Params: None
+    # Return: list of RankedList by board
+    def _getBoards(self):
+    #{{{
+        if self.boards is None:
+            with self.exclusive():
+                if self.boards is None:
+                    self.boards = self._buildBoards()
+        return self.boards
+    #}}}
+
+    # Build the leaderboards from scratch, all locks held
+    # Params: None
+    # Return: list of RankedList by board
+    def _buildBoards(self):
+    #{{{
+        size = self.POOL_SIZE
+        span = self.BOARD_SPAN
+        rows = range(len(self.users))
+        # Pool values a pid column at a time, same as the index build
+        values = [0] * len(self.users)
+        for pid, weight in enumerate(self.POOL_WEIGHTS):
+            if weight:
+                values = list(map(add, values, map(mul, self.pools[pid::size],
+                                                   repeat(weight))))
+        keys = lambda scores: sorted(map(lambda score, row: row - score * span,
+                                         scores, rows))
+        return [RankedList(keys(map(boardStanding, self.balances, self.settled))),
+                RankedList(keys(values))]
+    #}}}
+
+    # Build the holder sets and top pool ids from scratch off the pools
+    # Params: None
+    # Return: None
+    def _buildIndex(self):
+    #{{{
+        size = self.POOL_SIZE
+        # One strided slice pulls the whole pid column out in C
+        rows = range(len(self.users))
+        self.holders = [IndexedSet(compress(rows, self.pools[pid::size]))
+                        for pid in range(size)]
+        self.tops = array("b", [-1]) * len(self.users)
+        for pid, holders in enumerate(self.holders):
+            for row in holders:
+                self.tops[row] = pid
     #}}}
 
     # Steal pool id from a player
@@ -218,10 +846,10 @@ class Bank:
     # Return: user id stolen from or None if nothing to steal
     def _steal(self, pid, user):
     #{{{
-        players = self._getPlayersWithPid(pid, [user])
-        if players: # there's people to steal from
-            return cFunc.randomChoice(players)
-        else:       # nobody has one
+        row = self.holders[pid].choice(self.index[user])
+        if row is not None: # there's people to steal from
+            return self.users[row]
+        else:               # nobody has one
             return None
     #}}}
 
@@ -231,7 +859,7 @@ class Bank:
     # Return: list of player ids that have at least one specified pool id
     def _getPlayersWithPid(self, pid, exclude):
     #{{{
-        return [player for player in self.players if
-                self.players[player]["pool"][pid] and
-                player not in exclude]
+        users = self.users
+        return [users[row] for row in self.holders[pid]
+                if users[row] not in exclude]
     #}}}
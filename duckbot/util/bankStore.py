@@ -0,0 +1,971 @@
+# Last Updated: 2.4.0
+# Storage backends for the bank. The bank marks what it changes and the
+# store decides when and how that gets written
+#   file    - bank.dat text file, rewritten whole on save
+#   sqlite  - bank.db in WAL mode, changed players committed in small batches
+#   journal - bank.dat as a snapshot plus an append only bank.journal of
+#             changes, folded back into the snapshot once it grows
+#   binary  - bank.bin, columns written out as they sit in memory and mapped
+#             straight back in, rewritten whole on save
+# Usage to copy a bank between formats by hand, picked by extension out of
+# .dat, .db and .bin (from the duckbot directory):
+#   python -m util.bankStore [bank.dat] [bank.db]
+# Python imports
+import os
+import sys
+import time
+import mmap
+import shutil
+import struct
+import sqlite3
+from array import array
+# Project imports
+import util.common as util
+from util.diagMessage import DiagMessage
+
+# FileStore class
+# The original bank.dat format, one line per player then the gacha pool.
+# Player lines stay the way releases before 2.4.0 read them, free pull as
+# True/False. The refresh day of the last free pull and the regen tick each
+# balance is settled up to go in DAYS comment lines on the end, which those
+# releases skip, so going back a release keeps every player. Five field
+# player lines written by 2.4.0 builds before that still load
+class FileStore:
+    # Whole bank goes out on every save, worth doing off the event thread
+    BACKGROUND = True
+    # Loads rows, not columns
+    COLUMNS    = False
+    # Start of a user:pulled:since line
+    DAYS       = "#+"
+
+    # Constructor for file store
+    # Params: fn     - bank file name
+    #         legacy - write only what releases before 2.4.0 keep, regen owed
+    #                  is paid into the balances since they don't settle it
+    # Return: FileStore instance
+    def __init__(self, fn = "bank.dat", legacy = False):
+        self.fn = fn
+        self.legacy = legacy
+
+    # Read in bank state file
+    # Params: None
+    # Return: list of (user, balance, pool, pulled, since) rows and gacha pool list,
+    #         None for the pool if the file is missing or the pool is bad
+    # Notes : Please don't write your own bank file.
+    # You make mistakes, the bot doesn't
+    def load(self):
+    #{{{
+        rows = []
+        days = {}
+        gacha_pool = None
+        reading_players = True
+        try:
+            with open(self.fn,"r") as data:
+                for line in data:
+                    line = line.strip()
+                    # Refresh day and regen tick for a player
+                    if line.startswith(self.DAYS):
+                        self._parseDays(line[len(self.DAYS):].split(":"), days)
+                    # Skip comments
+                    elif line.startswith("#"):
+                        pass
+                    # Signal switch to pool
+                    elif line.startswith(";"):
+                        reading_players = False
+                    # Parse line for player data
+                    elif reading_players and line:
+                        player_data = self._parsePlayerData(line.split(":"))
+                        if player_data:
+                            rows.append(player_data)
+                    # Parse line for gacha data
+                    elif line:
+                        gacha_pool = [int(val) for val in line.split(",")]
+        # File doesn't exist, can't be read or gacha pool format error
+        except (OSError, ValueError):
+            gacha_pool = None
+        for player_data in rows:
+            if player_data[0] in days:
+                player_data[3:] = days[player_data[0]]
+        return list(map(tuple, rows)), gacha_pool
+    #}}}
+
+    # Changes only get written by save, nothing to track
+    def mark(self, user):
+        pass
+    def markAll(self):
+        pass
+    def markPool(self):
+        pass
+    def nuke(self, pool):
+        pass
+    def flush(self, bank):
+        pass
+
+    # Save bank state into file. Written to a temp file and renamed over, a
+    # crash mid write leaves the last save in place
+    # Params: bank - Bank or bank Snapshot to write out
+    # Return: True if saved, False otherwise
+    def save(self, bank):
+    #{{{
+        temp_fn = self.fn + ".tmp"
+        try:
+            with open(temp_fn,"w") as data:
+                self.write(data, bank)
+                data.flush()
+                os.fsync(data.fileno())
+            os.replace(temp_fn, self.fn)
+            return True
+        # File couldn't be written
+        except OSError as error:
+            util.logger.log(DiagMessage("BOT0141E", str(error)))
+            return False
+    #}}}
+
+    # Write bank state in bank.dat format
+    # Params: data - open text file
+    #         bank - Bank to write out
+    # Return: None
+    def write(self, data, bank):
+    #{{{
+        if self.legacy:
+            # Bank needs this module loaded first
+            from util.bank import regenBalance
+            tick = int(time.time() // util.REGEN_TIME)
+        # Write out player data
+        data.write("# Players\n")
+        for user, balance, pool, pulled, since in bank.rows():
+            if self.legacy:
+                balance = regenBalance(balance, since, tick)
+            data.write(user + ":" + str(balance))
+            data.write(":" + ",".join(map(str,pool)))
+            data.write(":" + str(pulled < bank.day))
+            data.write("\n")
+        data.write(";\n")
+        # Write pool data
+        data.write("# Gacha Pool\n")
+        data.write(",".join(map(str,bank.gacha_pool)))
+        if self.legacy:
+            return
+        # Write refresh days and regen ticks
+        data.write("\n# Days\n")
+        for user, balance, pool, pulled, since in bank.rows():
+            data.write(self.DAYS + user + ":" + str(pulled) + ":" + str(since))
+            data.write("\n")
+    #}}}
+
+    def close(self):
+        pass
+
+    # Parse player data of line
+    # Params: data - line data
+    # Return: player data list or None
+    def _parsePlayerData(self, data):
+    #{{{
+        try:
+            if len(data) in (4, 5):
+                player_data = [util.matchUserId(data[0])]
+                player_data.append(int(data[1]))
+                player_data.append([int(val) for val in data[2].split(",")])
+                player_data.append(self._parsePulled(data[3]))
+                # No regen tick, owed nothing from before
+                player_data.append(int(data[4]) if len(data) == 5 else 0)
+                if player_data[0]:
+                    return player_data
+        except ValueError:
+            pass
+        return None
+    #}}}
+
+    # Parse a DAYS line, bad ones are skipped like bad player lines
+    # Params: data - line data after DAYS
+    #         days - dict of user id to [pulled, since] to add to
+    # Return: None
+    def _parseDays(self, data, days):
+    #{{{
+        try:
+            if len(data) == 3:
+                days[data[0]] = [int(data[1]), int(data[2])]
+        except ValueError:
+            pass
+    #}}}
+
+    # Parse the free pull field of a line
+    # Params: field - refresh day, or True/False from before days were kept
+    # Return: refresh day of the last free pull, -1 if used on an unknown day
+    @staticmethod
+    def _parsePulled(field):
+    #{{{
+        if field == "True":
+            return 0
+        if field == "False":
+            return -1
+        return int(field)
+    #}}}
+
+# SqliteStore class
+# One row per player keyed on user id. Changed players pile up in a dirty
+# set and go out together in one transaction on flush, so a crash loses at
+# most one flush interval instead of the hour between full saves
+class SqliteStore:
+    # Saves only write what changed, and the connection stays on one thread
+    BACKGROUND = False
+    COLUMNS    = False
+    #{{{ - Schema
+    SCHEMA = (
+         "CREATE TABLE IF NOT EXISTS players ("
+            "id TEXT PRIMARY KEY, balance INTEGER NOT NULL, "
+            "pool TEXT NOT NULL, pulled INTEGER NOT NULL, "
+            "since INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID"
+        ,"CREATE TABLE IF NOT EXISTS gacha ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), pool TEXT NOT NULL)"
+    )
+    #}}}
+
+    # Constructor for sqlite store
+    # Params: fn        - database file name
+    #         import_fn - bank.dat to import from when the database is new
+    # Return: SqliteStore instance
+    def __init__(self, fn = "bank.db", import_fn = "bank.dat"):
+    #{{{
+        self.fn = fn
+        self.import_fn = import_fn
+        self.conn = sqlite3.connect(fn)
+        # WAL keeps commits to an append, NORMAL only syncs on checkpoints
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        # Databases from before regen ticks were kept
+        columns = [column[1] for column in
+                   self.conn.execute("PRAGMA table_info(players)")]
+        if "since" not in columns:
+            self.conn.execute("ALTER TABLE players ADD COLUMN "
+                              "since INTEGER NOT NULL DEFAULT 0")
+        self.conn.commit()
+        self.dirty = set()
+        self.all_dirty = False
+        self.pool_dirty = False
+        # Whole table updates, run ahead of the changed rows on flush
+        self.bulk = []
+    #}}}
+
+    # Read the bank out of the database, importing bank.dat the first time
+    # and bringing older databases up to date
+    # Params: None
+    # Return: list of (user, balance, pool, pulled, since) rows and gacha pool list,
+    #         None for the pool if unset
+    def load(self):
+    #{{{
+        # user_version marks a database that's been set up, import only once
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if not version:
+            if self.import_fn and os.path.exists(self.import_fn):
+                self.importFile(self.import_fn)
+        # Version 1 kept a free pull flag, now it's the day it was last used
+        elif version < 2:
+            with self.conn:
+                self.conn.execute("ALTER TABLE players RENAME COLUMN "
+                                  "pull TO pulled")
+                self.conn.execute("UPDATE players SET pulled = "
+                                  "CASE WHEN pulled THEN 0 ELSE -1 END")
+        self.conn.execute("PRAGMA user_version = 2")
+
+        row = self.conn.execute("SELECT pool FROM gacha WHERE id = 0").fetchone()
+
+        rows = [(user, balance, [int(val) for val in pool.split(",")],
+                 pulled, since)
+                for user, balance, pool, pulled, since in self.conn.execute(
+                    "SELECT id, balance, pool, pulled, since FROM players")]
+        gacha_pool = [int(val) for val in row[0].split(",")] if row else None
+        return rows, gacha_pool
+    #}}}
+
+    # Copy a bank.dat into the database in one transaction
+    # Params: fn - bank.dat file name
+    # Return: number of players imported
+    def importFile(self, fn):
+    #{{{
+        rows, gacha_pool = FileStore(fn).load()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?, ?)",
+                map(self._row, rows))
+            if gacha_pool is not None:
+                self._writePool(gacha_pool)
+        return len(rows)
+    #}}}
+
+    # Note a player changed
+    # Params: user - user id of the changed player
+    # Return: None
+    def mark(self, user):
+        self.dirty.add(user)
+
+    # Note every player changed
+    # Params: None
+    # Return: None
+    def markAll(self):
+        self.all_dirty = True
+
+    # Note the gacha pool changed
+    # Params: None
+    # Return: None
+    def markPool(self):
+        self.pool_dirty = True
+
+    # Note every player's pool got wiped
+    # Params: pool - pool everyone has now
+    # Return: None
+    def nuke(self, pool):
+        self.bulk.append(("UPDATE players SET pool = ?",
+                          (",".join(map(str, pool)),)))
+
+    # Commit everything marked since the last flush in one transaction
+    # Params: bank - Bank to read the changed values from
+    # Return: True if written, False otherwise
+    def flush(self, bank):
+    #{{{
+        if not (self.dirty or self.all_dirty or self.pool_dirty or self.bulk):
+            return True
+        rows = (bank.rows() if self.all_dirty else
+                filter(None, map(bank.row, self.dirty)))
+        try:
+            with self.conn:
+                for statement, parms in self.bulk:
+                    self.conn.execute(statement, parms)
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?, ?)",
+                    map(self._row, rows))
+                if self.pool_dirty:
+                    self._writePool(bank.gacha_pool)
+        # Rolled back, everything stays marked for the next flush
+        except sqlite3.Error as error:
+            util.logger.log(DiagMessage("BOT0140E", str(error)))
+            return False
+        self.dirty.clear()
+        self.all_dirty = False
+        self.pool_dirty = False
+        self.bulk = []
+        return True
+    #}}}
+
+    # Full save is just a flush, rows are already up to date otherwise
+    # Params: bank - Bank to read the changed values from
+    # Return: True if written, False otherwise
+    def save(self, bank):
+        return self.flush(bank)
+
+    def close(self):
+        self.conn.close()
+
+    # Build a players table row
+    # Params: row - (user, balance, pool, pulled, since) row from the bank
+    # Return: row tuple
+    def _row(self, row):
+        return (row[0], row[1], ",".join(map(str, row[2])), row[3], row[4])
+
+    # Write the gacha pool row, inside the caller's transaction
+    # Params: gacha_pool - gacha pool list
+    # Return: None
+    def _writePool(self, gacha_pool):
+        self.conn.execute("INSERT OR REPLACE INTO gacha VALUES (0, ?)",
+                          (",".join(map(str, gacha_pool)),))
+
+# JournalStore class
+# bank.dat stays the snapshot, changes go on the end of bank.journal as one
+# line each and get synced together on flush. Startup reads the snapshot and
+# plays the journal over it. Records
+#   P user balance pool pulled since - player row as it is now
+#   G pool                           - gacha pool as it is now
+#   N pool                           - every player's pool set to pool
+# Older journals can also have P records with a 1/0 free pull flag and no
+# since, and F pull records setting everyone's flag
+# Every record sets values rather than adjusting them, so playing a journal
+# twice over the same snapshot comes out the same
+# Compacting moves the journal aside to bank.journal.old and starts a new one,
+# then writes the snapshot on a worker from a copy of the columns and drops
+# the old journal. Until then startup plays the old journal before the new
+class JournalStore:
+    # Saves line up with the journal, writes and compacts go to a worker
+    BACKGROUND  = False
+    COLUMNS     = False
+    COMPACT_MIN = 1 << 20 # bytes of journal before compacting is worth it
+
+    # Constructor for journal store
+    # Params: fn         - snapshot file name, bank.dat format
+    #         journal_fn - journal file name
+    # Return: JournalStore instance
+    def __init__(self, fn = "bank.dat", journal_fn = "bank.journal"):
+    #{{{
+        self.snapshot = FileStore(fn)
+        self.journal_fn = journal_fn
+        self.old_fn = journal_fn + ".old"
+        self.journal = None
+        self.compacting = None
+        self.writing = None
+        self.written = []
+        self.pending = []
+        self.dirty = set()
+        self.all_dirty = False
+        self.pool_dirty = False
+    #}}}
+
+    # Read the snapshot and play the journal over it
+    # Params: None
+    # Return: list of (user, balance, pool, pulled, since) rows and gacha pool list,
+    #         None for the pool if unset
+    def load(self):
+    #{{{
+        rows, gacha_pool = self.snapshot.load()
+        # Rows by user while the journals play over them
+        players = {row[0]: list(row) for row in rows}
+        # A compact that didn't finish left its journal in front of this one
+        if os.path.exists(self.old_fn):
+            gacha_pool = self._replayFile(self.old_fn, players, gacha_pool)
+        gacha_pool = self._replayFile(self.journal_fn, players, gacha_pool)
+        self.journal = open(self.journal_fn, "a")
+        return list(map(tuple, players.values())), gacha_pool
+    #}}}
+
+    # Note a player changed
+    # Params: user - user id of the changed player
+    # Return: None
+    def mark(self, user):
+        self.dirty.add(user)
+
+    # Note every player changed
+    # Params: None
+    # Return: None
+    def markAll(self):
+        self.all_dirty = True
+
+    # Note the gacha pool changed
+    # Params: None
+    # Return: None
+    def markPool(self):
+        self.pool_dirty = True
+
+    # Note every player's pool got wiped
+    # Params: pool - pool everyone has now
+    # Return: None
+    def nuke(self, pool):
+        self.pending.append("N " + ",".join(map(str, pool)) + "\n")
+
+    # Append everything marked since the last flush and sync it once, then
+    # compact if the journal outgrew the snapshot. Only the records are taken
+    # here with the bank held, a worker writes and syncs them
+    # Params: bank - Bank to read the changed values from
+    #         wait - write them before returning, the last write too
+    # Return: True if written or handed off, False otherwise
+    def flush(self, bank, wait = False):
+    #{{{
+        if self.writing is not None:
+            # One write at a time keeps the journal in order, these go out
+            # behind it
+            if not (wait or self.writing.done()):
+                self.pending = self._records(bank)
+                return True
+            self._written(self.writing.result() is True, bank)
+        lines = self._records(bank)
+        if not lines:
+            return True
+        if wait or util.work_pool is None:
+            self.written = lines
+            return self._written(self._write(lines), bank)
+        self.written = lines
+        self.writing = util.work_pool.submit("journal write", self._write,
+                                             lines)
+        return True
+    #}}}
+
+    # Save is a flush and a compact
+    # Params: bank - Bank to write out
+    # Return: True if written, False otherwise
+    def save(self, bank):
+    #{{{
+        if not self.flush(bank, wait=True):
+            return False
+        if self.journal.tell():
+            self.compact(bank)
+        return True
+    #}}}
+
+    # Move the journal aside and write a new snapshot from a copy of the bank,
+    # on a worker if there is one. The snapshot goes in with a rename, a
+    # crash before the old journal is dropped only means it plays over a
+    # snapshot it's already in
+    # Params: bank - Bank to snapshot, everything in it already journaled
+    # Return: None
+    def compact(self, bank):
+    #{{{
+        # The one going already takes the journal so far, the rest waits for
+        # the next compact
+        if self.compacting is not None and not self.compacting.done():
+            return
+        if not self._rotate():
+            return
+        snapshot = bank.snapshot()
+        if util.work_pool is None:
+            self._compact(snapshot)
+        else:
+            self.compacting = util.work_pool.submit("journal compact",
+                                                    self._compact, snapshot)
+    #}}}
+
+    # Finish the journal writes and a compact still going, then close it
+    # Params: None
+    # Return: None
+    def close(self):
+    #{{{
+        # Records taken while the last write was going still need writing
+        if self.writing is not None and self.writing.result() is not True:
+            self.pending[:0] = self.written
+        if self.pending:
+            self._write(self.pending)
+        if self.compacting is not None:
+            self.compacting.result()
+        if self.journal:
+            self.journal.close()
+    #}}}
+
+    # Turn everything marked into journal records, bank held
+    # Params: bank - Bank to read the changed values from
+    # Return: list of record lines, any not written yet first
+    def _records(self, bank):
+    #{{{
+        rows = (bank.rows() if self.all_dirty else
+                filter(None, map(bank.row, self.dirty)))
+        lines = self.pending
+        for user, balance, pool, pulled, since in rows:
+            lines.append("P " + user + " " + str(balance) + " " +
+                         ",".join(map(str, pool)) + " " + str(pulled) +
+                         " " + str(since) + "\n")
+        if self.pool_dirty:
+            lines.append("G " + ",".join(map(str, bank.gacha_pool)) + "\n")
+        self.pending = []
+        self.dirty.clear()
+        self.all_dirty = False
+        self.pool_dirty = False
+        return lines
+    #}}}
+
+    # Append records to the journal and sync them, runs on a worker with no
+    # bank locks held
+    # Params: lines - list of record lines
+    # Return: True if written, False otherwise
+    def _write(self, lines):
+    #{{{
+        try:
+            self.journal.write("".join(lines))
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        except OSError as error:
+            util.logger.log(DiagMessage("BOT0140E", str(error)))
+            return False
+        return True
+    #}}}
+
+    # Wrap up a write, bank held. Failed records go back in front of anything
+    # newer for the next flush, records are safe to write twice
+    # Params: written - True if the write went through
+    #         bank    - Bank to compact from if the journal outgrew it
+    # Return: written
+    def _written(self, written, bank):
+    #{{{
+        self.writing = None
+        if not written:
+            self.pending[:0] = self.written
+        elif self.journal.tell() > max(self.COMPACT_MIN, self._snapshotSize()):
+            self.compact(bank)
+        self.written = []
+        return written
+    #}}}
+
+    # Start a new journal, the current one goes on the end of the old one if
+    # an earlier compact never got to drop it. Runs with the bank held
+    # Params: None
+    # Return: True if there's a new journal, False otherwise
+    def _rotate(self):
+    #{{{
+        try:
+            self.journal.close()
+            if os.path.exists(self.old_fn):
+                with open(self.old_fn, "a") as old, \
+                     open(self.journal_fn, "r") as journal:
+                    old.write(journal.read())
+                    old.flush()
+                    os.fsync(old.fileno())
+                os.remove(self.journal_fn)
+            else:
+                os.replace(self.journal_fn, self.old_fn)
+            return True
+        except OSError as error:
+            util.logger.log(DiagMessage("BOT0140E", str(error)))
+            return False
+        finally:
+            self.journal = open(self.journal_fn, "a")
+    #}}}
+
+    # Write the snapshot and drop the old journal it now covers, runs on a
+    # worker
+    # Params: snapshot - bank Snapshot taken when the journal was moved aside
+    # Return: True if compacted, False otherwise
+    def _compact(self, snapshot):
+    #{{{
+        if not self.snapshot.save(snapshot):
+            return False
+        try:
+            os.remove(self.old_fn)
+        except OSError as error:
+            util.logger.log(DiagMessage("BOT0140E", str(error)))
+            return False
+        return True
+    #}}}
+
+    # Play a journal file over the players. A crash mid write leaves a line
+    # with no newline, it's cut off so the next record doesn't get glued on
+    # Params: fn         - journal file name
+    #         players    - dict of user id to row lists to apply to
+    #         gacha_pool - gacha pool so far
+    # Return: gacha pool after the journal
+    def _replayFile(self, fn, players, gacha_pool):
+    #{{{
+        try:
+            with open(fn, "r+") as journal:
+                text = journal.read()
+                end = text.rfind("\n") + 1
+                if end != len(text):
+                    journal.truncate(end)
+        except OSError:
+            return gacha_pool
+        for line in text[:end].splitlines():
+            gacha_pool = self._replay(line.split(), players, gacha_pool)
+        return gacha_pool
+    #}}}
+
+    # Apply one journal record
+    # Params: record     - split journal line
+    #         players    - dict of user id to row lists to apply to
+    #         gacha_pool - gacha pool so far
+    # Return: gacha pool after the record
+    def _replay(self, record, players, gacha_pool):
+    #{{{
+        try:
+            if record[0] == "P" and len(record) == 6:
+                players[record[1]] = [record[1], int(record[2]),
+                                      [int(val) for val in record[3].split(",")],
+                                      int(record[4]), int(record[5])]
+            elif record[0] == "P" and len(record) == 5:
+                players[record[1]] = [record[1], int(record[2]),
+                                      [int(val) for val in record[3].split(",")],
+                                      0 if record[4] == "1" else -1, 0]
+            elif record[0] == "G" and len(record) == 2:
+                gacha_pool = [int(val) for val in record[1].split(",")]
+            elif record[0] == "N" and len(record) == 2:
+                pool = [int(val) for val in record[1].split(",")]
+                for player in players.values():
+                    player[2] = list(pool)
+            elif record[0] == "F" and len(record) == 2:
+                for player in players.values():
+                    player[3] = 0 if record[1] == "1" else -1
+        # Bad record, the rest still counts
+        except (IndexError, ValueError):
+            pass
+        return gacha_pool
+    #}}}
+
+    # Size of the snapshot on disk
+    # Params: None
+    # Return: bytes, 0 if there isn't one
+    def _snapshotSize(self):
+    #{{{
+        try:
+            return os.path.getsize(self.snapshot.fn)
+        except OSError:
+            return 0
+    #}}}
+
+# BinaryStore class
+# bank.bin, the bank columns one after another behind a header. Loading maps
+# the file and copies each column into its array whole, so no player is
+# parsed or built on the way in. The copy can't be skipped, the bank's
+# columns grow as players join. Rows only get made if something asks for
+# them. A file that can't be read gets a copy kept before it's saved over.
+# Layout, all little endian
+#   header   - magic, version, pool size, players, user id width
+#   gacha    - pool size signed 64 bit counts
+#   users    - players fixed width ascii ids, NUL padded
+#   balances - players signed 64 bit
+#   pools    - players * pool size unsigned 32 bit, row major
+#   pulled   - players signed 32 bit refresh days
+#   settled  - players signed 64 bit regen ticks
+class BinaryStore:
+    # Whole bank goes out on every save, worth doing off the event thread
+    BACKGROUND = True
+    # Loads straight into the bank columns
+    COLUMNS    = True
+    MAGIC      = b"DKBK"
+    VERSION    = 1
+    HEADER     = struct.Struct("<4sHHIH")
+    #{{{ - Column typecodes in file order, after the user ids
+    COLUMN_TYPES = (
+         ("balances", "q")
+        ,("pools",    "I")
+        ,("pulled",   "i")
+        ,("settled",  "q")
+    )
+    #}}}
+
+    # Constructor for binary store
+    # Params: fn        - bank file name
+    #         import_fn - bank.dat to import from when there's no bank file
+    # Return: BinaryStore instance
+    def __init__(self, fn = "bank.bin", import_fn = "bank.dat"):
+        self.fn = fn
+        self.import_fn = import_fn
+
+    # Map the bank file in and copy the columns out of it
+    # Params: None
+    # Return: (users, balances, pools, pulled, settled, gacha_pool) or None
+    #         if there's no bank file to read. A file that can't be read is
+    #         copied aside and comes back as no players and no gacha pool,
+    #         not None, so an older bank.dat doesn't get imported in its place
+    def loadColumns(self):
+    #{{{
+        try:
+            with open(self.fn, "rb") as data:
+                if not os.fstat(data.fileno()).st_size:
+                    return None
+                with mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return self._readColumns(mapped)
+        # No bank file yet
+        except FileNotFoundError:
+            return None
+        # Can't be read or doesn't add up, copied before the next save
+        # writes over it so it's still there to look at
+        except (OSError, ValueError, struct.error) as error:
+            util.logger.log(DiagMessage("BOT0142E", self.fn, str(error),
+                                        self.keepAside("bad")))
+            return [], array("q"), array("I"), array("i"), array("q"), []
+    #}}}
+
+    # Turn columns into rows, the pool size comes from the gacha pool
+    # Params: columns - (users, balances, pools, pulled, settled, gacha_pool)
+    # Return: list of (user, balance, pool, pulled, since) rows
+    def columnRows(self, columns):
+    #{{{
+        users, balances, pools, pulled, settled, gacha_pool = columns
+        size = len(gacha_pool)
+        return [(users[row], balances[row],
+                 pools[row * size:row * size + size].tolist(),
+                 pulled[row], settled[row]) for row in range(len(users))]
+    #}}}
+
+    # Copy the bank file aside before the next save writes over it. The
+    # file stays put, a restart before that save reads it again rather than
+    # importing bank.dat
+    # Params: reason - why, goes on the end of the copy's name
+    # Return: name the copy was kept as, or the error making it
+    def keepAside(self, reason):
+    #{{{
+        kept = self.fn + "." + str(int(time.time())) + "." + reason
+        try:
+            shutil.copyfile(self.fn, kept)
+        except OSError as error:
+            return str(error)
+        return kept
+    #}}}
+
+    # Read the bank as rows, for copying into other formats. Falls back on
+    # importing bank.dat when there's no bank file
+    # Params: None
+    # Return: (user, balance, pool, pulled, since) rows and gacha pool list,
+    #         None for the pool if unset
+    def load(self):
+    #{{{
+        columns = self.loadColumns()
+        if columns is None:
+            return self.importRows()
+        return self.columnRows(columns), columns[5] or None
+    #}}}
+
+    # Read the bank.dat being imported from, for when there's no bank file
+    # Params: None
+    # Return: (user, balance, pool, pulled, since) rows and gacha pool list,
+    #         None for the pool if unset
+    def importRows(self):
+    #{{{
+        if self.import_fn:
+            return FileStore(self.import_fn).load()
+        return [], None
+    #}}}
+
+    # Changes only get written by save, nothing to track
+    def mark(self, user):
+        pass
+    def markAll(self):
+        pass
+    def markPool(self):
+        pass
+    def nuke(self, pool):
+        pass
+    def flush(self, bank):
+        pass
+
+    # Save bank state into file. Written to a temp file and renamed over, a
+    # crash mid write leaves the last save in place
+    # Params: bank - Bank or bank Snapshot to write out
+    # Return: True if saved, False otherwise
+    def save(self, bank):
+    #{{{
+        temp_fn = self.fn + ".tmp"
+        try:
+            with open(temp_fn, "wb") as data:
+                self.write(data, bank)
+                data.flush()
+                os.fsync(data.fileno())
+            os.replace(temp_fn, self.fn)
+            return True
+        # File couldn't be written
+        except OSError as error:
+            util.logger.log(DiagMessage("BOT0141E", str(error)))
+            return False
+    #}}}
+
+    # Write bank state in bank.bin format
+    # Params: data - open binary file
+    #         bank - Bank or bank Snapshot to write out
+    # Return: None
+    def write(self, data, bank):
+    #{{{
+        users = bank.users
+        width = max(map(len, users), default=0)
+        # Slack ids are mostly one length, padding is only paid for if not
+        if users and min(map(len, users)) != width:
+            users = [user.ljust(width, "\0") for user in users]
+        data.write(self.HEADER.pack(self.MAGIC, self.VERSION,
+                                    len(bank.gacha_pool), len(users), width))
+        data.write(self._bytes(array("q", bank.gacha_pool)))
+        data.write("".join(users).encode("ascii"))
+        for name, _ in self.COLUMN_TYPES:
+            data.write(self._bytes(getattr(bank, name)))
+    #}}}
+
+    def close(self):
+        pass
+
+    # Copy the columns out of a mapped bank file
+    # Params: mapped - mmap of the whole file
+    # Return: (users, balances, pools, pulled, settled, gacha_pool)
+    def _readColumns(self, mapped):
+    #{{{
+        magic, version, size, count, width = self.HEADER.unpack_from(mapped)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError("not a version " + str(self.VERSION) + " bank file")
+        view = memoryview(mapped)
+        try:
+            spot = self.HEADER.size
+            gacha_pool, spot = self._column(view, spot, "q", size)
+            # Ids come off as one string and get cut up at C speed
+            ids = bytes(view[spot:spot + count * width]).decode("ascii")
+            spot += count * width
+            users = [ids[start:start + width]
+                     for start in range(0, count * width, width)]
+            if "\0" in ids:
+                users = [user.rstrip("\0") for user in users]
+            columns = [users]
+            for name, typecode in self.COLUMN_TYPES:
+                column, spot = self._column(view, spot, typecode,
+                                            count * size if name == "pools" else count)
+                columns.append(column)
+            if spot != len(mapped):
+                raise ValueError("size doesn't match the header")
+        # Views have to go before the map can close
+        finally:
+            view.release()
+        columns.append(gacha_pool.tolist())
+        return tuple(columns)
+    #}}}
+
+    # Copy one column out of a view of the file
+    # Params: view     - memoryview of the file
+    #         spot     - offset the column starts at
+    #         typecode - array typecode of the column
+    #         count    - number of values
+    # Return: array and the offset after it
+    def _column(self, view, spot, typecode, count):
+    #{{{
+        column = array(typecode)
+        end = spot + count * column.itemsize
+        if end > len(view):
+            raise ValueError("file ends early")
+        column.frombytes(view[spot:end])
+        if sys.byteorder == "big":
+            column.byteswap()
+        return column, end
+    #}}}
+
+    # Column bytes in file order
+    # Params: column - array to write
+    # Return: little endian bytes of the column
+    def _bytes(self, column):
+    #{{{
+        if sys.byteorder == "big":
+            column = array(column.typecode, column)
+            column.byteswap()
+        return column.tobytes()
+    #}}}
+
+#{{{ - Stores by name
+STORES = {
+     "file"    : FileStore
+    ,"sqlite"  : SqliteStore
+    ,"journal" : JournalStore
+    ,"binary"  : BinaryStore
+}
+#}}}
+
+#{{{ - Stores by file extension, for copying by hand
+EXTENSIONS = {
+     ".dat" : lambda fn: FileStore(fn)
+    ,".db"  : lambda fn: SqliteStore(fn, import_fn=None)
+    ,".bin" : lambda fn: BinaryStore(fn, import_fn=None)
+}
+#}}}
+
+# Copy a bank from one format into another by hand. With --legacy the copy
+# is a bank.dat for releases before 2.4.0, to go back a release
+# Params: None
+# Return: 0 if copied, 1 otherwise
+def main():
+#{{{
+    # Bank needs this module loaded first
+    from util.bank import Bank
+    args = [arg for arg in sys.argv[1:] if arg != "--legacy"]
+    legacy = len(args) < len(sys.argv) - 1
+    from_fn = args[0] if len(args) > 0 else "bank.dat"
+    to_fn = args[1] if len(args) > 1 else "bank.db"
+    makers = [EXTENSIONS.get(os.path.splitext(fn)[1]) for fn in (from_fn, to_fn)]
+    if None in makers:
+        print("Bank files have to end in one of " + ", ".join(EXTENSIONS))
+        return 1
+    if legacy and makers[1] is not EXTENSIONS[".dat"]:
+        print("Releases before 2.4.0 only read .dat bank files")
+        return 1
+    from_store, to_store = makers[0](from_fn), makers[1](to_fn)
+    if legacy:
+        to_store = FileStore(to_fn, legacy=True)
+    bank = Bank(store=from_store)
+    to_store.markAll()
+    to_store.markPool()
+    copied = to_store.save(bank)
+    from_store.close()
+    to_store.close()
+    if not copied:
+        return 1
+    print("Copied " + str(len(bank.users)) + " players into " + to_fn)
+    return 0
+#}}}
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# Last Updated: 2.4.0
+# Python imports
+import threading
+# Project imports
+import util.common as util
+
+# Channel class
+# The few channel fields the bot actually uses, instead of the whole
+# conversations.list payload
+class Channel:
+    __slots__ = ("id", "name", "purpose", "labels")
+
+    # Constructor for channel
+    # Params: channel_id - channel id
+    #         name       - channel name
+    #         purpose    - channel purpose text
+    #         labels     - parsed labels, parsed from purpose if None
+    # Return: Channel instance
+    def __init__(self, channel_id, name = "", purpose = "", labels = None):
+    #{{{
+        self.id = channel_id
+        self.name = name
+        self.purpose = purpose
+        self.labels = util.parseLabels(purpose) if labels is None else labels
+    #}}}
+
+    # Build a channel from slack channel data or a saved record
+    # Params: data - channel dict, raw from slack or from toDict
+    # Return: Channel instance
+    @classmethod
+    def fromData(cls, data):
+    #{{{
+        purpose = data.get("purpose") or ""
+        if isinstance(purpose, dict):
+            purpose = purpose.get("value", "")
+        return cls(data["id"], data.get("name", ""), purpose, data.get("labels"))
+    #}}}
+
+    # Change the purpose and labels that go with it
+    # Params: purpose - new purpose text
+    # Return: None
+    def setPurpose(self, purpose):
+    #{{{
+        self.purpose = purpose
+        self.labels = util.parseLabels(purpose)
+    #}}}
+
+    # Turn the channel into a dict for saving
+    # Params: None
+    # Return: dict of channel fields
+    def toDict(self):
+    #{{{
+        return {
+             "id"      : self.id
+            ,"name"    : self.name
+            ,"purpose" : self.purpose
+            ,"labels"  : self.labels
+        }
+    #}}}
+
+# Channel stream class
+# Walks conversations.list a page at a time on the api pool, following the
+# cursor, and hands over channels as each page lands so the bot can keep
+# serving events in the meantime
+class ChannelStream:
+    PAGE_LIMIT = 200
+
+    # Constructor for channel stream
+    # Params: None
+    # Return: ChannelStream instance, not started
+    def __init__(self):
+    #{{{
+        self.lock = threading.Lock()
+        self.ready = []
+        self.seen = set()
+        self.pages = 0
+        self.done = False
+        self.error = None
+    #}}}
+
+    # Request the first page
+    # Params: None
+    # Return: None
+    def start(self):
+        self._fetch("")
+
+    # Take the channels that have come in since last time
+    # Params: None
+    # Return: list of Channel
+    def drain(self):
+    #{{{
+        with self.lock:
+            ready, self.ready = self.ready, []
+        return ready
+    #}}}
+
+    # Request a page
+    # Params: cursor - cursor from the last page, empty for the first
+    # Return: None
+    def _fetch(self, cursor):
+    #{{{
+        future = util.apiCall("conversations.list", limit=self.PAGE_LIMIT,
+                              cursor=cursor)
+        future.add_done_callback(self._page)
+    #}}}
+
+    # Take in a page and ask for the next one, runs on the api pool
+    # Params: future - finished conversations.list future
+    # Return: None
+    def _page(self, future):
+    #{{{
+        response = future.result()
+        if not response.get("ok"):
+            with self.lock:
+                self.error = response.get("error", "unknown")
+                self.done = True
+            return
+        channels = [Channel.fromData(data) for data in response["channels"]]
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        with self.lock:
+            self.ready.extend(channels)
+            self.seen.update(channel.id for channel in channels)
+            self.pages += 1
+            self.done = not cursor
+        if cursor:
+            self._fetch(cursor)
+    #}}}
@@ -1,4 +1,4 @@
-# Last Updated: 2.3.0
+# Last Updated: 2.4.0
 # Python imports
 import re
 import random
@@ -51,6 +51,9 @@ COMMANDS = bidict({
     'BET'       : 11,
     'PULL'      : 12,
     'CHECKPOOL' : 13,
+    'LEADERBOARD' : 14,
+    'RANK'      : 15,
+    'HISTORY'   : 16,
 })
 COMMANDS_ALT = {
     'HELLO'      : 1, 'KWEH'       : 1,
@@ -89,10 +92,19 @@ EIGHTBALL_RESPONSES = [
     ,"Very doubtful"
     ]
 #}}}
+#{{{ - Message priorities
+PRIORITIES = {
+     'REPLY'     : 0
+    ,'BOT'       : 1
+    ,'SCHEDULED' : 2
+    ,'BULK'      : 3
+}
+#}}}
 #{{{ - Channel labels
 LABELS = {
      'DUCKBOT' : ':DUCKBOT:'
     ,'GAMBLE'  : ':SLOT_MACHINE:'
+    ,'OPTOUT'  : ':NO_ENTRY_SIGN:'
 }
 #}}}
 
@@ -100,24 +112,51 @@ LABELS = {
 LOG_TIME        = 1800 # 30 minutes
 REGEN_TIME      = 300  #  5 minutes
 SAVE_STATE_TIME = 3600 # 60 minutes
+BANK_FLUSH_TIME = 0.5  #  half a second
 
 # Slackclient, Logger instance
-# debug and permanent bank flag
-global sc, logger, debug, bank_file
+# debug, permanent bank and asyncio mode flag
+global sc, logger, debug, bank_file, aio
+# Reload in process on update instead of exiting
+hot_reload = False
+# Web api worker pool
+api_pool = None
+# Disk and background work pool, bank saves and update pulls
+work_pool = None
+# Outbound message queue
+outbox = None
+# Rtm capture recorder, set when recording
+recorder = None
+# Startup cache of bot id and channels, unset with --nocache
+start_cache = None
+# Bank storage backend, a name from util.bankStore.STORES
+bank_store = "file"
 
 # Send message to designated channel, and notify user if present
-# Params: channel - channel id to send message to
-#         message - string message to send
-#         user    - user id to notify, not required
+# Params: channel  - channel id to send message to
+#         message  - string message to send
+#         user     - user id to notify, not required
+#         priority - send priority from PRIORITIES, replies by default
 # Return: None
-def sendMessage(channel, message, user = None):
+def sendMessage(channel, message, user = None, priority = PRIORITIES["REPLY"]):
 #{{{
     # Prepend user notification if specified
     if user:
         message = "<@" + user + "> " + message
-    sc.rtm_send_message(channel, message)
+    # Queue it up for the sender if it's running
+    if outbox:
+        outbox.put(channel, message, priority)
+    else:
+        sc.rtm_send_message(channel, message)
 #}}}
 
+# Make a slack web api call on the api pool
+# Params: method - api method to call
+#         kwargs - arguments for the api call
+# Return: Future resolving to the api response dict
+def apiCall(method, **kwargs):
+    return api_pool.call(method, **kwargs)
+
 # Search for a user id in a string
 # Params: id_str - string to search for id
 # Return: user id if found, None otherwise
@@ -127,44 +166,29 @@ def matchUserId(id_str):
     return matches.group(0) if matches else None
 #}}}
 
-# Obtain bot id and workspace channels
-# Params: sc        - slackclient instance to make api calls
-#         bot_token - connection token for the bot
-# Return: bot user id and channel dict
+# Obtain bot id, channels are streamed in separately by ChannelStream
+# Params: bot_token - connection token for the bot
+# Return: bot user id
 def getBotInfo(bot_token):
-#{{{
-    bot_id = sc.api_call("auth.test")["user_id"]
-    channels = getChannelData(bot_token)
-    return bot_id, channels
-#}}}
-
-# Request channel list and build channel map
-# Params: sc        - slackclient instance to make api calls
-#         bot_token - connection token for the bot
-# Return: dict of channel ids to channel data
-def getChannelData(bot_token):
-#{{{
-    channels = {}
-    response = sc.api_call("conversations.list")
-    sc.server.parse_channel_data(response["channels"])
-    for channel in response["channels"]:
-        channels[channel["id"]] = channel
-        channels[channel["id"]]["labels"] = parseLabels(channel["purpose"]["value"])
-    return channels
-#}}}
+    return apiCall("auth.test").result().get("user_id", "")
 
 # Make changes to channels list based on event data
-# Params: channels - dict of channels to update
+# Params: channels - dict of channel ids to Channel
 #         event    - event to update from
 # Return: updated channel dict
 def updateChannels(channels, event):
 #{{{
+    # Imported here since util.channels needs this module loaded first
+    from util.channels import Channel
     channel = event.channel
     if event.subtype == 'channel_purpose':
-        channels[channel]["purpose"]["value"] = event.text
+        # Channel may not have been streamed in yet
+        if channel not in channels:
+            channels[channel] = Channel(channel)
+        channels[channel].setPurpose(event.text)
     elif event.subtype == 'channel_joined':
         if channel not in channels:
-            channels[channel] = event.channel_data
+            channels[channel] = Channel.fromData(event.channel_data)
     return channels
 #}}}
 
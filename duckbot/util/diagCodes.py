@@ -1,4 +1,4 @@
-# Last Updated: 2.2
+# Last Updated: 2.4.0
 ''' * Message format *
     INI 001 1 E
       |   | | |
@@ -54,8 +54,12 @@ DIAG_CODES = {
     ,"INI0010I" : "Bot token"
     # Slackclient connected
     ,"INI0020I" : "Slackclient connected"
+    # Worker pool started (name, size, queue)
+    ,"INI0021I" : "Worker pool started"
     # Display bot id
     ,"INI0030I" : "Bot id"
+    # Bot id and channels served from the startup cache
+    ,"INI0031I" : "Using startup cache"
     # Display bad bot id
     ,"INI0030E" : "Invalid bot id"
     # RTM connection good
@@ -70,6 +74,8 @@ DIAG_CODES = {
     ,"INI0050I" : "Duckbot now running"
     # Bot running in debug mode
     ,"INI0050D" : "Duckbot now running in debug mode"
+    # Bot running with asyncio loop
+    ,"INI0051I" : "Duckbot using asyncio event loop"
 
     # Bot Messages
     # Starting bot initialization
@@ -96,5 +102,49 @@ DIAG_CODES = {
     ,"BOT0051D" : "Bot id added to handler"
     # Gamble channel update
     ,"BOT0060D" : "Gamble channel list update"
+    # Api call finished (method, wait, call time, queue depth)
+    ,"BOT0070I" : "Api call complete"
+    # Api queue full, call rejected
+    ,"BOT0071E" : "Api queue full"
+    # Api call raised an error
+    ,"BOT0072E" : "Api call failed"
+    # RTM reconnected (downtime, reconnect count, total downtime)
+    ,"BOT0080I" : "RTM reconnected"
+    # RTM reconnect attempt
+    ,"BOT0081I" : "RTM reconnect attempt"
+    # RTM reconnect attempts used up
+    ,"BOT0082E" : "RTM reconnect failed, giving up after attempts"
+    # Outbound message failed to send
+    ,"BOT0090E" : "Message send failed"
+    # Hot reload went through (modules, objects moved, time taken)
+    ,"BOT0100I" : "Hot reload complete"
+    # Hot reload failed, old code put back
+    ,"BOT0101E" : "Hot reload failed, rolled back"
+    # Pulling update for hot reload
+    ,"BOT0102I" : "Pulling update"
+    # Update pull failed
+    ,"BOT0103E" : "Update pull failed"
+    # Channel list stream finished (channels, pages)
+    ,"BOT0110I" : "Channel list streamed in, channels"
+    # Channel list stream failed, channels so far kept
+    ,"BOT0110E" : "Channel list stream failed"
+    # Wish channel not in the channel list, wish skipped (channel name)
+    ,"BOT0111E" : "Wish channel not found"
+    # Prefilter counts (filtered, processed)
+    ,"BOT0120I" : "Message prefilter"
+    # Seen cache counts (hits, misses)
+    ,"BOT0130I" : "Seen message cache"
+    # Bank store flush failed, changes kept for the next one
+    ,"BOT0140E" : "Bank flush failed"
+    # Bank save failed, stays dirty for the next one
+    ,"BOT0141E" : "Bank save failed"
+    # Binary bank file unreadable, a copy kept and the bank starts empty
+    # (file, error, kept as)
+    ,"BOT0142E" : "Bank file unreadable"
+    # Ledger file couldn't be opened, written or read, entries dropped (file, error)
+    ,"BOT0143E" : "Bank ledger failed"
+    # Binary bank file from another pool size, converted and a copy of the
+    # original kept (file, pool size, kept as)
+    ,"BOT0144I" : "Bank file converted"
     #
 }
@@ -1,68 +1,100 @@
-# Last Updated: 2.2
+# Last Updated: 2.4.0
 # Event class
-# This may affect response time negatively, see how it goes
+# Slotted so each event is a single small object. Only the fields an event
+# type carries get set, same as before
 class Event:
+    __slots__ = ("type", "subtype", "user", "text", "ts", "channel", "name",
+                 "reaction", "file", "channel_data")
 
     # Constructor for Event
-    # Params: event_p - incoming slack event to parse
+    # Params: event_type - standardized event type
+    #         subtype    - standardized event subtype, if any
     # Return: Event instance
-    def __init__(self, event_p):
+    def __init__(self, event_type, subtype = None):
     #{{{
+        self.type = event_type
+        self.subtype = subtype
+    #}}}
 
-        if "type" in event_p:
-            self.type = event_p["type"]
-        else:
-            self.type = None
-
-        # Call the parser based on the event type
-        if self.type in self.EVENT_PARSERS:
-            self.EVENT_PARSERS[self.type](self, event_p)
+    # Create a standardized event from a slack event
+    # Params: event_p - incoming slack event to parse
+    # Return: Event instance, None for events nothing handles
+    @classmethod
+    def parse(cls, event_p):
+    #{{{
+        # Most of the rtm stream is typing and presence noise, those drop out
+        # here without building anything
+        parsers = cls.EVENT_PARSERS.get(event_p.get("type"))
+        if parsers is None:
+            return None
+        parser = parsers.get(event_p.get("subtype"))
+        return parser(event_p) if parser else None
     #}}}
 
-    # Parser for message type events
-    # Params: event_new - Event instance to add field data to
-    #         event_old - slack event to extract data from
-    # Return: None
-    def parseMessageEvent(event_new, event_old):
+    # Parser for plain message events
+    # Params: event_old - slack event to extract data from
+    # Return: Event instance or None
+    def parseMessageEvent(event_old):
     #{{{
-#         print(event_old)
         # Ignore slackbot's messages
-        if "user" in event_old and event_old["user"] == "USLACKBOT":
-            event_new.type = None
-            return
+        if event_old.get("user") == "USLACKBOT":
+            return None
+        event_new = Event("message")
+        event_new.channel = event_old["channel"]
+        event_new.user    = event_old["user"]
+        event_new.text    = event_old["text"]
+        event_new.ts      = event_old["ts"]
+        return event_new
+    #}}}
 
+    # Parser for edited message events
+    # Params: event_old - slack event to extract data from
+    # Return: Event instance
+    def parseMessageChangedEvent(event_old):
+    #{{{
+        event_new = Event("message")
         event_new.channel = event_old["channel"]
-        if "subtype" not in event_old:
-            event_new.user = event_old["user"]
-            event_new.text = event_old["text"]
-            event_new.ts   = event_old["ts"]
-        elif event_old["subtype"] == "message_changed":
-            event_new.user = event_old["message"]["user"]
-            event_new.text = event_old["message"]["text"]
-            event_new.ts   = event_old["message"]["ts"]
-        elif event_old["subtype"] == "channel_purpose":
-            event_new.user = event_old["user"]
-            event_new.text = event_old["purpose"]
-            event_new.ts   = event_old["ts"]
-            event_new.type = "update"
-            event_new.subtype = "channel_purpose"
-        elif event_old["subtype"] == "bot_message":
-            event_new.type = "bot_message"
-            event_new.text = event_old["text"]
-            event_new.user = event_old["bot_id"]
-            event_new.name = event_old["username"]
-            event_new.ts   = event_old["ts"]
-        # Ignore subtypes not handled
-        else:
-            event_new.type = None
+        event_new.user    = event_old["message"]["user"]
+        event_new.text    = event_old["message"]["text"]
+        event_new.ts      = event_old["message"]["ts"]
+        return event_new
+    #}}}
+
+    # Parser for channel purpose events
+    # Params: event_old - slack event to extract data from
+    # Return: Event instance
+    def parseChannelPurposeEvent(event_old):
+    #{{{
+        if event_old.get("user") == "USLACKBOT":
+            return None
+        event_new = Event("update", "channel_purpose")
+        event_new.channel = event_old["channel"]
+        event_new.user    = event_old["user"]
+        event_new.text    = event_old["purpose"]
+        event_new.ts      = event_old["ts"]
+        return event_new
+    #}}}
+
+    # Parser for bot message events
+    # Params: event_old - slack event to extract data from
+    # Return: Event instance
+    def parseBotMessageEvent(event_old):
+    #{{{
+        event_new = Event("bot_message")
+        event_new.channel = event_old["channel"]
+        event_new.text    = event_old["text"]
+        event_new.user    = event_old["bot_id"]
+        event_new.name    = event_old["username"]
+        event_new.ts      = event_old["ts"]
+        return event_new
     #}}}
 
     # Parser for reaction added events
-    # Params: event_new - Event instance to add field data to
-    #         event_old - slack event to extract data from
-    # Return: None
-    def parseReactionAddedEvent(event_new, event_old):
+    # Params: event_old - slack event to extract data from
+    # Return: Event instance
+    def parseReactionAddedEvent(event_old):
     #{{{
+        event_new = Event("reaction_added")
         event_new.user     = event_old["user"]
         event_new.reaction = {
              "emoji" : event_old["reaction"]
@@ -75,32 +107,40 @@ class Event:
         elif (event_new.reaction["type"] == "file" or
               event_new.reaction["type"] == "file_comment"):
             event_new.file = event_old["item"]["file"]
+        return event_new
     #}}}
 
     # Parser for team join events
-    # Params: event_new - Event instance to add field data to
-    #         event_old - slack event to extract data from
-    # Return: None
-    def parseTeamJoinEvent(event_new, event_old):
+    # Params: event_old - slack event to extract data from
+    # Return: Event instance
+    def parseTeamJoinEvent(event_old):
+    #{{{
+        event_new = Event("team_join")
         event_new.user = event_old["user"]["id"]
+        return event_new
+    #}}}
 
     # Parser for channel joined events
-    # Params: event_new - Event instance to add field data to
-    #         event_old - slack event to extract data from
-    # Return: None
-    def parseChannelJoinedEvent(event_new, event_old):
+    # Params: event_old - slack event to extract data from
+    # Return: Event instance
+    def parseChannelJoinedEvent(event_old):
     #{{{
-        event_new.type    = "update"
-        event_new.subtype = "channel_joined"
-        event_new.channel = event_old["channel"]["id"]
+        event_new = Event("update", "channel_joined")
+        event_new.channel      = event_old["channel"]["id"]
         event_new.channel_data = event_old["channel"]
+        return event_new
     #}}}
 
-    #{{{ - EVENT_PARSERS
+    #{{{ - EVENT_PARSERS, keyed on slack type then subtype
     EVENT_PARSERS = {
-         "message"        : parseMessageEvent
-        ,"reaction_added" : parseReactionAddedEvent
-        ,"team_join"      : parseTeamJoinEvent
-        ,"channel_joined" : parseChannelJoinedEvent
+        "message" : {
+             None              : parseMessageEvent
+            ,"message_changed" : parseMessageChangedEvent
+            ,"channel_purpose" : parseChannelPurposeEvent
+            ,"bot_message"     : parseBotMessageEvent
+        }
+        ,"reaction_added" : {None : parseReactionAddedEvent}
+        ,"team_join"      : {None : parseTeamJoinEvent}
+        ,"channel_joined" : {None : parseChannelJoinedEvent}
     }
     #}}}
@@ -0,0 +1,307 @@
+# Last Updated: 2.4.0
+# Python imports
+import json
+import time
+import base64
+import struct
+import asyncio
+import hashlib
+import threading
+from urllib.parse import parse_qs
+# Slack import
+import requests
+from slackclient import SlackClient
+from slackclient.slackrequest import SlackRequest
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Fake slack server class
+# Local stand in for the slack web api and rtm websocket, serving the calls
+# the bot makes (auth.test, conversations.list, bots.info, rtm.connect) and
+# a plain ws:// rtm stream on the same port
+class FakeSlackServer:
+
+    # Constructor for fake slack server
+    # Params: bot_id   - user id to answer auth.test with
+    #         channels - list of raw channel data for conversations.list
+    #         host     - interface to listen on
+    #         port     - port to listen on, 0 picks a free one
+    # Return: FakeSlackServer instance, not started
+    def __init__(self, bot_id = "UDUCKBOT0", channels = None,
+                 host = "127.0.0.1", port = 0):
+    #{{{
+        self.bot_id = bot_id
+        self.channels = channels or []
+        self.host = host
+        self.port = port
+        self.clients = []
+        self.received = []
+        # Hooks for load measurement, called from the server thread
+        #   on_send(event, stamp)    after an event is written to the wire
+        #   on_message(data, stamp)  when a frame comes in from the bot
+        self.on_send = None
+        self.on_message = None
+        # Seconds added to every web api answer, stands in for the network
+        self.api_delay = 0
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+    #}}}
+
+    # Start serving from a background thread
+    # Params: None
+    # Return: None
+    def start(self):
+    #{{{
+        self.thread = threading.Thread(target=self._serve, name="fakeslack",
+                                       daemon=True)
+        self.thread.start()
+        self.ready.wait()
+    #}}}
+
+    # Stop serving
+    # Params: None
+    # Return: None
+    def stop(self):
+    #{{{
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(5)
+    #}}}
+
+    # Build a slack client that talks to this server
+    # Params: token - bot token
+    # Return: LocalSlackClient instance
+    def client(self, token):
+        return LocalSlackClient(token, "http://" + self.host + ":" + str(self.port))
+
+    # Push an rtm event out to every connected client
+    # Params: event - raw rtm event dict
+    # Return: None
+    def push(self, event):
+        self.loop.call_soon_threadsafe(self._broadcast, event)
+
+    # Wait for the bot to connect to the rtm
+    # Params: timeout - most seconds to wait
+    # Return: True if a client is connected
+    def waitForClient(self, timeout = 10):
+    #{{{
+        deadline = time.monotonic() + timeout
+        while not self.clients and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return bool(self.clients)
+    #}}}
+
+    # Server thread body
+    # Params: None
+    # Return: None
+    def _serve(self):
+    #{{{
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port))
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            # Drop any open connections before closing up
+            server.close()
+            for writer in self.clients:
+                writer.close()
+            tasks = asyncio.all_tasks(self.loop)
+            if tasks:
+                self.loop.run_until_complete(asyncio.wait(tasks, timeout=1))
+            self.loop.close()
+    #}}}
+
+    # Handle a connection, either a web api post or a websocket upgrade
+    # Params: reader - asyncio StreamReader
+    #         writer - asyncio StreamWriter
+    # Return: None
+    async def _handle(self, reader, writer):
+    #{{{
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode("latin-1").split("\r\n")
+        verb, path, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+
+        if headers.get("upgrade", "").lower() == "websocket":
+            await self._websocket(reader, writer, headers)
+        else:
+            length = int(headers.get("content-length", 0))
+            body = await reader.readexactly(length) if length else b""
+            form = {key: val[0] for key, val in
+                    parse_qs(body.decode("utf-8")).items()}
+            if self.api_delay:
+                await asyncio.sleep(self.api_delay)
+            response = json.dumps(self._apiCall(path.rsplit("/", 1)[-1], form))
+            response = response.encode("utf-8")
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: application/json\r\n"
+                         b"Connection: close\r\n"
+                         b"Content-Length: " + str(len(response)).encode() +
+                         b"\r\n\r\n" + response)
+            await writer.drain()
+            writer.close()
+    #}}}
+
+    # Answer a web api call
+    # Params: method - api method called
+    #         form   - posted arguments
+    # Return: api response dict
+    def _apiCall(self, method, form):
+    #{{{
+        if method == "auth.test":
+            return {"ok": True, "user_id": self.bot_id}
+        elif method == "conversations.list":
+            start = int(form.get("cursor") or 0)
+            end = start + int(form.get("limit", 100))
+            return {"ok": True, "channels": self.channels[start:end],
+                    "response_metadata": {"next_cursor":
+                        str(end) if end < len(self.channels) else ""}}
+        elif method == "bots.info":
+            bot = form.get("bot", "B0")
+            return {"ok": True, "bot": {"id": bot,
+                    "user_id": "U" + bot[1:9].ljust(8, "0")}}
+        elif method == "rtm.connect":
+            return {"ok": True,
+                    "url": "ws://" + self.host + ":" + str(self.port) + "/rtm",
+                    "team": {"domain": "local"},
+                    "self": {"id": self.bot_id, "name": "duckbot"}}
+        return {"ok": False, "error": "unknown_method"}
+    #}}}
+
+    # Run the rtm side of a websocket connection
+    # Params: reader  - asyncio StreamReader
+    #         writer  - asyncio StreamWriter
+    #         headers - request headers
+    # Return: None
+    async def _websocket(self, reader, writer, headers):
+    #{{{
+        accept = base64.b64encode(hashlib.sha1(
+            (headers["sec-websocket-key"] + WS_GUID).encode()).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                     b"Upgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        self._writeFrame(writer, json.dumps({"type": "hello"}))
+        self.clients.append(writer)
+        try:
+            while True:
+            #{{{
+                opcode, payload = await self._readFrame(reader)
+                stamp = time.monotonic()
+                # Close
+                if opcode == 0x8:
+                    break
+                # Ping, pong it back
+                elif opcode == 0x9:
+                    self._writeFrame(writer, payload, opcode=0xA)
+                # Text
+                elif opcode == 0x1:
+                    data = json.loads(payload.decode("utf-8"))
+                    self.received.append((stamp, data))
+                    if data.get("type") == "ping":
+                        self._writeFrame(writer, json.dumps(
+                            {"type": "pong", "reply_to": data.get("id")}))
+                    elif self.on_message:
+                        self.on_message(data, stamp)
+            #}}}
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.remove(writer)
+            writer.close()
+    #}}}
+
+    # Write an event to every client
+    # Params: event - raw rtm event dict
+    # Return: None
+    def _broadcast(self, event):
+    #{{{
+        data = json.dumps(event)
+        for writer in self.clients:
+            self._writeFrame(writer, data)
+        if self.on_send:
+            self.on_send(event, time.monotonic())
+    #}}}
+
+    # Read one websocket frame, clients always mask
+    # Params: reader - asyncio StreamReader
+    # Return: opcode and unmasked payload bytes
+    async def _readFrame(self, reader):
+    #{{{
+        head = await reader.readexactly(2)
+        opcode = head[0] & 0x0F
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await reader.readexactly(8))[0]
+        mask = await reader.readexactly(4) if head[1] & 0x80 else None
+        payload = await reader.readexactly(length)
+        if mask:
+            payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        return opcode, payload
+    #}}}
+
+    # Write one unmasked websocket frame
+    # Params: writer - asyncio StreamWriter
+    #         data   - str or bytes payload
+    #         opcode - frame opcode, text by default
+    # Return: None
+    def _writeFrame(self, writer, data, opcode = 0x1):
+    #{{{
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        length = len(data)
+        if length < 126:
+            head = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            head = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        writer.write(head + data)
+    #}}}
+
+# Local slack request class
+# Posts web api calls to a plain http base url instead of https://slack.com
+class LocalSlackRequest(SlackRequest):
+
+    # Constructor for local slack request
+    # Params: base_url - http url of the fake server
+    # Return: LocalSlackRequest instance
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+
+    # Submit a web api call to the local server
+    # Params: same as SlackRequest.post_http_request
+    # Return: requests response
+    def post_http_request(self, token, api_method, post_data,
+                          files=None, timeout=None, domain=None):
+        return requests.post(self.base_url + "/api/" + api_method,
+                             headers={"Authorization": "Bearer " + str(token)},
+                             data=post_data, files=files, timeout=timeout)
+
+# Local slack client class
+# SlackClient pointed at a FakeSlackServer
+class LocalSlackClient(SlackClient):
+
+    # Constructor for local slack client
+    # Params: token    - bot token
+    #         base_url - http url of the fake server
+    # Return: LocalSlackClient instance
+    def __init__(self, token, base_url):
+        super().__init__(token)
+        self.server.api_requester = LocalSlackRequest(base_url)
@@ -0,0 +1,69 @@
+# Last Updated: 2.4.0
+# Python imports
+import random
+
+# IndexedSet class
+# Set that can also hand back a random member. Members sit in a list with a
+# dict of where each one is, removing swaps the last member into the hole so
+# adding, removing and picking are all constant time
+class IndexedSet:
+    __slots__ = ("items", "where")
+
+    # Constructor for indexed set
+    # Params: items - distinct members to start with
+    # Return: IndexedSet instance
+    def __init__(self, items = ()):
+    #{{{
+        self.items = list(items)
+        self.where = dict(zip(self.items, range(len(self.items))))
+    #}}}
+
+    # Add a member
+    # Params: item - hashable member to add
+    # Return: None
+    def add(self, item):
+    #{{{
+        if item not in self.where:
+            self.where[item] = len(self.items)
+            self.items.append(item)
+    #}}}
+
+    # Remove a member if it's there
+    # Params: item - member to remove
+    # Return: None
+    def discard(self, item):
+    #{{{
+        spot = self.where.pop(item, None)
+        if spot is None:
+            return
+        last = self.items.pop()
+        if spot < len(self.items):
+            self.items[spot] = last
+            self.where[last] = spot
+    #}}}
+
+    # Pick a member at random, every one as likely as the others
+    # Params: exclude - member that can't be picked
+    # Return: random member or None if there's nothing to pick
+    def choice(self, exclude = None):
+    #{{{
+        items = self.items
+        count = len(items)
+        if exclude in self.where:
+            # Pick from everyone but the last, the last stands in for exclude
+            count -= 1
+            if not count:
+                return None
+            item = items[random.randrange(count)]
+            return items[count] if item == exclude else item
+        return items[random.randrange(count)] if count else None
+    #}}}
+
+    def __contains__(self, item):
+        return item in self.where
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
@@ -0,0 +1,39 @@
+# Last Updated: 2.4.0
+
+# Lazy class
+# Stands in for an object that's costly to build, building it the first
+# time anything on it is used
+class Lazy:
+
+    # Constructor for lazy
+    # Params: factory - function that builds the real object
+    # Return: Lazy instance
+    def __init__(self, factory):
+    #{{{
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_target", None)
+    #}}}
+
+    # Get the real object, building it if needed
+    # Params: None
+    # Return: the built object
+    def lazyGet(self):
+    #{{{
+        if self._target is None:
+            object.__setattr__(self, "_target", self._factory())
+        return self._target
+    #}}}
+
+    # Check if the real object has been built yet
+    # Params: None
+    # Return: True if built
+    def lazyBuilt(self):
+        return self._target is not None
+
+    # Pass attribute reads through to the real object
+    def __getattr__(self, name):
+        return getattr(self.lazyGet(), name)
+
+    # Pass attribute writes through to the real object
+    def __setattr__(self, name, value):
+        setattr(self.lazyGet(), name, value)
@@ -0,0 +1,419 @@
+# Last Updated: 2.4.0
+# Python imports
+import os
+import heapq
+import struct
+import threading
+from array import array
+from itertools import islice, takewhile
+# Project imports
+import util.common as util
+from util.diagMessage import DiagMessage
+
+# Ledger class
+# Recent transactions of every player. Each player gets a ring of packed
+# entries, made on their first transaction after joining and grown an entry
+# at a time up to RING_SIZE. Once a ring is full the oldest entry is appended
+# to the ledger file on its way out, so memory stays at most RING_SIZE
+# entries a player and the file has everything older. Joins go straight to
+# the file, a player who never plays has no ring at all
+#   rings   - ring by user id, a count of entries ever written then up to
+#             RING_SIZE (time, kind, amount, other row) entries
+#   offsets - record numbers in the file by user id, kept up as records go
+#             in. Nukes are everyone's and go under "". Saved next to the
+#             file on close, and read back on a worker when it opens with
+#             only the records from after that save indexed again
+# Ledger file layout, fixed size records, little endian
+#   user id, time, kind, amount, other user id, ids NUL padded
+# Index file layout, a cache the file can always be indexed again without
+#   records covered, then per user: user id, count, record numbers
+# Amounts are bux for the bux kinds and pull ids for the item kinds. Writes
+# are buffered, the bank flush pushes them out
+class Ledger:
+    RING_SIZE    = 16
+    RING_STRIPES = 64
+    ID_WIDTH     = 16
+    COUNT  = struct.Struct("<Q")
+    ENTRY  = struct.Struct("<qBqi")
+    RECORD = struct.Struct("<" + str(ID_WIDTH) + "sqBq" + str(ID_WIDTH) + "s")
+    INDEX  = struct.Struct("<" + str(ID_WIDTH) + "sI")
+    #{{{ - Kinds
+    JOIN   = 0 # joined or rejoined, amount starting bux
+    BET    = 1 # bet won or lost
+    PULL   = 2 # paid for pulls
+    REGEN  = 3 # regen settled
+    GIVE   = 4 # bux sent to other
+    GET    = 5 # bux from other
+    STEAL  = 6 # stole a pull id from other
+    STOLEN = 7 # other stole a pull id
+    LOSE   = 8 # lost the best pull id on a bad pull
+    NUKE   = 9 # other set off a nuke, no other for a nuke from outside a pull
+    ADJUST = 10 # any other balance change
+    #}}}
+
+    # Constructor for ledger
+    # Params: bank - Bank whose rows other players are kept as
+    #         fn   - ledger file name, None to keep the rings only
+    # Return: Ledger instance
+    def __init__(self, bank, fn = "bank.ledger"):
+    #{{{
+        self.bank = bank
+        self.fn = fn
+        self.index_fn = None if fn is None else fn + ".idx"
+        self.rings = {}
+        self.offsets = None
+        self.unindexed = None
+        self.indexing = None
+        self.records = 0
+        self.file = None
+        # Rings are locked in stripes by user id of their own, players in a
+        # steal only share the pool lock so the bank's can't be counted on
+        self.ring_locks = [threading.Lock() for _ in range(self.RING_STRIPES)]
+        # Taken last, for the file and the offsets
+        self.lock = threading.Lock()
+        # Only one index build at a time, taken before the rest
+        self.index_lock = threading.Lock()
+        if fn is not None:
+            self._open()
+            if util.work_pool is None:
+                self._index()
+            else:
+                self.indexing = util.work_pool.submit("ledger index",
+                                                      self._index)
+    #}}}
+
+    # Note a transaction
+    # Params: user   - user id it happened to
+    #         kind   - one of the kinds
+    #         amount - bux moved or pull id
+    #         other  - user id on the other side, None if nobody
+    # Return: None
+    def record(self, user, kind, amount, other = None):
+    #{{{
+        other = -1 if other is None else self.bank.index[other]
+        when = int(self.bank.clock())
+        entry = self.ENTRY
+        with self._ringLock(user):
+            ring = self.rings.get(user)
+            if ring is None:
+                ring = self.rings[user] = bytearray(self.COUNT.size)
+            count = self.COUNT.unpack_from(ring)[0]
+            if count < self.RING_SIZE:
+                ring += entry.pack(when, kind, amount, other)
+            # Full, the oldest one is about to be written over
+            else:
+                spot = self.COUNT.size + count % self.RING_SIZE * entry.size
+                self._append(user, *entry.unpack_from(ring, spot))
+                entry.pack_into(ring, spot, when, kind, amount, other)
+            self.COUNT.pack_into(ring, 0, count + 1)
+    #}}}
+
+    # Note a player joining, or rejoining. It goes in the file behind
+    # whatever the player's ring had, so the file stays in time order and a
+    # rejoin gives the ring back. Rings only ledgers don't keep joins
+    # Params: user   - user id that joined
+    #         amount - starting bux
+    # Return: None
+    def join(self, user, amount):
+    #{{{
+        when = int(self.bank.clock())
+        with self._ringLock(user):
+            ring = self.rings.pop(user, None)
+            if ring is not None:
+                for entry in reversed(self._ringEntries(ring, False)):
+                    self._append(user, *entry)
+            self._append(user, when, self.JOIN, amount, -1)
+    #}}}
+
+    # Note a nuke, it's everyone's so it only goes in the file
+    # Params: user - user id that set it off, None if nobody
+    # Return: None
+    def nuke(self, user = None):
+    #{{{
+        other = -1 if user is None else self.bank.index[user]
+        self._append("", int(self.bank.clock()), self.NUKE, 0, other)
+    #}}}
+
+    # Get some of a player's transactions, newest first. Nukes since their
+    # first transaction are mixed in
+    # Params: user  - user id to get
+    #         start - number of newest transactions to skip
+    #         count - number of transactions to get
+    # Return: list of (time, kind, amount, other user id or None) tuples
+    def history(self, user, start, count):
+    #{{{
+        offsets = self._indexed()
+        # The ring and the offsets are read together so an entry on its way
+        # from one to the other can't show up twice or not at all
+        with self._ringLock(user):
+            ring = self.rings.get(user)
+            recent = self._ringEntries(ring) if ring else []
+            if offsets is None:
+                return recent[start:start + count]
+            with self.lock:
+                if self.file is None:
+                    return recent[start:start + count]
+                self.file.flush()
+                # Copies, appends after this are newer than asked for anyway
+                older = offsets.get(user, array("Q"))[:]
+                nukes = offsets.get("", array("Q"))[:]
+        if not recent and not older:
+            return []
+        try:
+            with open(self.fn, "rb") as data:
+                # Nukes only count from when the player shows up
+                first = (self._readRecord(data, older[0])[0] if older else
+                         recent[-1][0])
+                nukes = takewhile(lambda entry: entry[0] >= first,
+                                  self._readRecords(data, nukes))
+                entries = heapq.merge(recent, self._readRecords(data, older),
+                                      nukes, key=lambda entry: entry[0],
+                                      reverse=True)
+                return list(islice(entries, start, start + count))
+        except (OSError, struct.error) as error:
+            util.logger.log(DiagMessage("BOT0143E", self.fn, str(error)))
+            return recent[start:start + count]
+    #}}}
+
+    # Push buffered writes out to the ledger file
+    # Params: None
+    # Return: None
+    def flush(self):
+    #{{{
+        if self.file is None:
+            return
+        with self.lock:
+            try:
+                self.file.flush()
+            except OSError as error:
+                util.logger.log(DiagMessage("BOT0143E", self.fn, str(error)))
+    #}}}
+
+    # Write every ring out and start them over, for when the bot is exiting.
+    # The file then has the whole history in order for the next start, and
+    # the offsets are saved for it if they got built
+    # Params: None
+    # Return: None
+    def close(self):
+    #{{{
+        if self.file is None:
+            return
+        for user, ring in list(self.rings.items()):
+            with self._ringLock(user):
+                for entry in reversed(self._ringEntries(ring, False)):
+                    self._append(user, *entry)
+        self.rings = {}
+        with self.lock:
+            if self.offsets is not None:
+                self._writeIndex()
+            try:
+                self.file.close()
+            except OSError as error:
+                util.logger.log(DiagMessage("BOT0143E", self.fn, str(error)))
+            self.file = None
+    #}}}
+
+    # Open the ledger file for appending, cutting off a record a crash only
+    # half wrote so the next one lines up
+    # Params: None
+    # Return: None
+    def _open(self):
+    #{{{
+        try:
+            self.file = open(self.fn, "ab")
+            size = self.file.tell()
+            self.records = size // self.RECORD.size
+            if size % self.RECORD.size:
+                self.file.truncate(self.records * self.RECORD.size)
+                self.file.seek(0, os.SEEK_END)
+        except OSError as error:
+            util.logger.log(DiagMessage("BOT0143E", self.fn, str(error)))
+            self.file = None
+    #}}}
+
+    # Get the ring lock for a player
+    # Params: user - user id
+    # Return: Lock
+    def _ringLock(self, user):
+        return self.ring_locks[hash(user) % self.RING_STRIPES]
+
+    # Append one entry to the ledger file
+    # Params: user   - user id it happened to, "" for everyone
+    #         when   - time in seconds
+    #         kind   - one of the kinds
+    #         amount - bux moved or pull id
+    #         other  - row on the other side, -1 if nobody
+    # Return: None
+    def _append(self, user, when, kind, amount, other):
+    #{{{
+        other = self.bank.users[other] if other >= 0 else ""
+        record = self.RECORD.pack(user.encode(), when, kind, amount,
+                                  other.encode())
+        with self.lock:
+            if self.file is None:
+                return
+            try:
+                self.file.write(record)
+            except OSError as error:
+                util.logger.log(DiagMessage("BOT0143E", self.fn, str(error)))
+                return
+            if self.offsets is not None:
+                self.offsets.setdefault(user, array("Q")).append(self.records)
+            # Being indexed, these get added once it's done
+            elif self.unindexed is not None:
+                self.unindexed.append((user, self.records))
+            self.records += 1
+    #}}}
+
+    # Unpack a ring, newest first
+    # Params: ring  - ring to unpack
+    #         users - True to turn other rows into user ids
+    # Return: list of (time, kind, amount, other) tuples
+    def _ringEntries(self, ring, users = True):
+    #{{{
+        count = self.COUNT.unpack_from(ring)[0]
+        size = self.RING_SIZE
+        entries = []
+        for num in range(count - 1, max(count - size, 0) - 1, -1):
+            when, kind, amount, other = self.ENTRY.unpack_from(
+                ring, self.COUNT.size + num % size * self.ENTRY.size)
+            if users:
+                other = self.bank.users[other] if other >= 0 else None
+            entries.append((when, kind, amount, other))
+        return entries
+    #}}}
+
+    # Read one record out of the ledger file
+    # Params: data - ledger file open for reading
+    #         num  - record number
+    # Return: (time, kind, amount, other user id or None) tuple
+    def _readRecord(self, data, num):
+    #{{{
+        size = self.RECORD.size
+        data.seek(num * size)
+        _, when, kind, amount, other = self.RECORD.unpack(data.read(size))
+        return when, kind, amount, other.rstrip(b"\0").decode() or None
+    #}}}
+
+    # Read records out of the ledger file as they're needed, newest first
+    # Params: data - ledger file open for reading
+    #         nums - record numbers, oldest first
+    # Return: generator of (time, kind, amount, other user id or None) tuples
+    def _readRecords(self, data, nums):
+        return (self._readRecord(data, num) for num in reversed(nums))
+
+    # Get the offsets, waiting on the index if it's still being built. Runs
+    # with no locks held
+    # Params: None
+    # Return: dict of user id to array of record numbers, None without a file
+    def _indexed(self):
+    #{{{
+        if self.offsets is None and self.file is not None:
+            if self.indexing is not None:
+                self.indexing.result()
+            # Worker failed or the pool was full, build it here
+            if self.offsets is None:
+                self._index()
+        return self.offsets
+    #}}}
+
+    # Index the ledger file by user without holding up records. Whatever the
+    # saved index covers is read back, only the records after it are read
+    # from the file. Records that go in meanwhile are added after
+    # Params: None
+    # Return: None
+    def _index(self):
+    #{{{
+        with self.index_lock:
+            with self.lock:
+                if self.offsets is not None or self.file is None:
+                    return
+                try:
+                    self.file.flush()
+                except OSError as error:
+                    util.logger.log(DiagMessage("BOT0143E", self.fn,
+                                                str(error)))
+                covered = self.records
+                self.unindexed = []
+            offsets, start = self._readIndex(covered)
+            self._indexRecords(offsets, start, covered)
+            with self.lock:
+                for user, num in self.unindexed:
+                    offsets.setdefault(user, array("Q")).append(num)
+                self.offsets = offsets
+                self.unindexed = None
+    #}}}
+
+    # Read the saved index back
+    # Params: covered - records in the file, an index covering more is stale
+    # Return: dict of user id to array of record numbers and the number of
+    #         records it covers, empty and 0 if it's missing or no good
+    def _readIndex(self, covered):
+    #{{{
+        try:
+            with open(self.index_fn, "rb") as data:
+                contents = data.read()
+        except OSError:
+            return {}, 0
+        offsets = {}
+        width = self.INDEX.size
+        try:
+            records = self.COUNT.unpack_from(contents)[0]
+            if records > covered:
+                return {}, 0
+            spot = self.COUNT.size
+            while spot < len(contents):
+                user, size = self.INDEX.unpack_from(contents, spot)
+                spot += width
+                nums = array("Q", contents[spot:spot + size * 8])
+                spot += size * 8
+                if len(nums) != size or (nums and nums[-1] >= records):
+                    return {}, 0
+                offsets[user.rstrip(b"\0").decode()] = nums
+        except (struct.error, ValueError) as error:
+            util.logger.log(DiagMessage("BOT0143E", self.index_fn, str(error)))
+            return {}, 0
+        return offsets, records
+    #}}}
+
+    # Index records in the ledger file by user, one pass over them
+    # Params: offsets - dict of user id to array of record numbers to add to
+    #         start   - first record number to index
+    #         end     - record number to stop at
+    # Return: None
+    def _indexRecords(self, offsets, start, end):
+    #{{{
+        size = self.RECORD.size
+        width = self.ID_WIDTH
+        try:
+            with open(self.fn, "rb") as data:
+                data.seek(start * size)
+                contents = data.read((end - start) * size)
+        except OSError as error:
+            util.logger.log(DiagMessage("BOT0143E", self.fn, str(error)))
+            return
+        for num in range(len(contents) // size):
+            user = contents[num * size:num * size + width].rstrip(b"\0").decode()
+            nums = offsets.get(user)
+            if nums is None:
+                nums = offsets[user] = array("Q")
+            nums.append(start + num)
+    #}}}
+
+    # Save the offsets next to the ledger file, lock held. It's only a cache,
+    # a bad one gets found and the file indexed again
+    # Params: None
+    # Return: None
+    def _writeIndex(self):
+    #{{{
+        temp_fn = self.index_fn + ".tmp"
+        try:
+            with open(temp_fn, "wb") as data:
+                data.write(self.COUNT.pack(self.records))
+                for user, nums in self.offsets.items():
+                    data.write(self.INDEX.pack(user.encode(), len(nums)))
+                    data.write(nums.tobytes())
+            os.replace(temp_fn, self.index_fn)
+        except OSError as error:
+            util.logger.log(DiagMessage("BOT0143E", self.index_fn, str(error)))
+    #}}}
@@ -1,5 +1,7 @@
-# Last Updated: 2.2
+# Last Updated: 2.4.0
+import threading
 from datetime import datetime
+import util.common as util
 from util.diagMessage import DiagMessage
 
 # Logger class
@@ -17,6 +19,8 @@ class Logger:
         self.keep_log = log
         self.fn = fn
         self.log_buffer = []
+        # Api pool workers log from their own threads
+        self.lock = threading.RLock()
         if self.keep_log:
             self.log(DiagMessage("LOG0000I"))
     #}}}
@@ -28,9 +32,10 @@ class Logger:
     def log(self, diag, flush=False):
     #{{{
         if self.keep_log:
-            self.log_buffer.append(str(datetime.now()) + " - " + diag.msg)
-            if len(self.log_buffer) >= self.BUFFER_MAX or flush:
-                self._write()
+            with self.lock:
+                self.log_buffer.append(str(datetime.now()) + " - " + diag.msg)
+                if len(self.log_buffer) >= self.BUFFER_MAX or flush:
+                    self._write()
         elif not flush:
             print(diag.msg)
     #}}}
@@ -40,7 +45,7 @@ class Logger:
     # Return: None
     def _write(self):
     #{{{
-        print("Writing log...") if debug else None
+        print("Writing log...") if util.debug else None
         with open(self.fn,'a') as logfile:
             for line in self.log_buffer:
                 try:
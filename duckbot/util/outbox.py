@@ -0,0 +1,281 @@
+# Last Updated: 2.4.0
+# Python imports
+import time
+import heapq
+import threading
+from collections import deque
+# Project imports
+import util.common as util
+from util.diagMessage import DiagMessage
+
+# Token bucket class
+# Refills at a steady rate up to a burst size, one token per message
+class TokenBucket:
+
+    # Constructor for token bucket
+    # Params: rate  - tokens added per second
+    #         burst - most tokens the bucket can hold
+    #         now   - current monotonic time
+    # Return: TokenBucket instance, starting full
+    def __init__(self, rate, burst, now):
+    #{{{
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+    #}}}
+
+    # Take a token if one is available
+    # Params: now - current monotonic time
+    # Return: True if a token was taken, False otherwise
+    def take(self, now):
+    #{{{
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+    #}}}
+
+    # Take a token whether there's one or not, the bucket goes into debt
+    # and refills from there
+    # Params: now - current monotonic time
+    # Return: None
+    def spend(self, now):
+    #{{{
+        self._refill(now)
+        self.tokens -= 1
+    #}}}
+
+    # Time until the next token is available
+    # Params: now - current monotonic time
+    # Return: seconds to wait
+    def wait(self, now):
+    #{{{
+        self._refill(now)
+        return max(0, (1 - self.tokens) / self.rate)
+    #}}}
+
+    # Add tokens for the time passed since the last refill
+    # Params: now - current monotonic time
+    # Return: None
+    def _refill(self, now):
+    #{{{
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+    #}}}
+
+# Outbox class
+# Queues outbound messages and sends them from the background, keeping each
+# channel under the slack rate limit. Lower priority values go out first and
+# short messages queued back to back for a channel are sent as one post.
+# Replies don't wait on the channel's bucket, there's at most one per command
+# someone typed. They still spend from it, so bot, scheduled and bulk posts
+# to a busy channel are the ones that back off
+class Outbox:
+    CHANNEL_RATE  = 1    # messages per second per channel
+    CHANNEL_BURST = 3
+    COALESCE_MAX  = 500  # only messages shorter than this get merged
+    MESSAGE_MAX   = 4000
+
+    # Constructor for outbox
+    # Params: send - function taking channel and text that posts the message
+    # Return: Outbox instance
+    def __init__(self, send):
+    #{{{
+        self.send = send
+        self.lock = threading.Lock()
+        self.running = True
+        self.paused = False
+        self.thread = None
+        self._wake = lambda: None
+        # (channel, priority) to queue of (seq, text)
+        self.queues = {}
+        # Heap of (priority, seq, channel) for the head of each queue
+        self.ready = []
+        self.buckets = {}
+        self.seq = 0
+    #}}}
+
+    # Queue a message to send
+    # Params: channel  - channel id to send to
+    #         text     - message text
+    #         priority - send priority, see util.PRIORITIES
+    # Return: None
+    def put(self, channel, text, priority):
+    #{{{
+        with self.lock:
+            self.seq += 1
+            key = (channel, priority)
+            queue = self.queues.get(key)
+            if not queue:
+                queue = self.queues[key] = deque()
+                heapq.heappush(self.ready, (priority, self.seq, channel))
+            queue.append((self.seq, text))
+        self._wake()
+    #}}}
+
+    # Hold messages while the rtm is down
+    # Params: None
+    # Return: None
+    def pause(self):
+        self.paused = True
+
+    # Start sending again
+    # Params: None
+    # Return: None
+    def resume(self):
+    #{{{
+        self.paused = False
+        self._wake()
+    #}}}
+
+    # Check for messages still waiting to go out
+    # Params: None
+    # Return: True if anything is queued
+    def pending(self):
+        return bool(self.ready)
+
+    # Collect every message that can go out right now
+    # Params: now - current monotonic time
+    # Return: list of (channel, text) to send and seconds until more can go
+    #         out, None if the queue is empty
+    def flush(self, now):
+    #{{{
+        batch = []
+        held = []
+        wait = None
+        if self.paused:
+            return batch, wait
+        with self.lock:
+            while self.ready:
+            #{{{
+                priority, seq, channel = heapq.heappop(self.ready)
+                bucket = self.buckets.get(channel)
+                if not bucket:
+                    bucket = self.buckets[channel] = TokenBucket(
+                        self.CHANNEL_RATE, self.CHANNEL_BURST, now)
+                if priority == util.PRIORITIES["REPLY"]:
+                    bucket.spend(now)
+                # Channel is out of tokens, hold it for the next flush
+                elif not bucket.take(now):
+                    held.append((priority, seq, channel))
+                    channel_wait = bucket.wait(now)
+                    wait = channel_wait if wait is None else min(wait, channel_wait)
+                    continue
+
+                key = (channel, priority)
+                queue = self.queues[key]
+                text = self._coalesce(queue)
+                batch.append((channel, text))
+                if queue:
+                    heapq.heappush(self.ready, (priority, queue[0][0], channel))
+                else:
+                    del self.queues[key]
+            #}}}
+            for entry in held:
+                heapq.heappush(self.ready, entry)
+        return batch, wait
+    #}}}
+
+    # Start the background sender thread
+    # Params: None
+    # Return: None
+    def start(self):
+    #{{{
+        wakeup = threading.Event()
+        self._wake = wakeup.set
+        self.thread = threading.Thread(target=self._run, args=(wakeup,),
+                                       name="outbox", daemon=True)
+        self.thread.start()
+    #}}}
+
+    # Background sender as an asyncio task
+    # Params: None
+    # Return: None
+    async def arun(self):
+    #{{{
+        import asyncio
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        self._wake = lambda: loop.call_soon_threadsafe(wakeup.set)
+        while True:
+            wait = self._step(wakeup)
+            if wait is False:
+                break
+            try:
+                await asyncio.wait_for(wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+    #}}}
+
+    # Stop the sender once everything queued has gone out
+    # Params: timeout - most seconds to wait on the sender thread
+    # Return: None
+    def close(self, timeout = 10):
+    #{{{
+        self.running = False
+        self._wake()
+        if self.thread:
+            self.thread.join(timeout)
+    #}}}
+
+    # Sender thread loop. All the work is in _step so a hot reload picks it
+    # up on the next pass
+    # Params: wakeup - threading Event set when messages are queued
+    # Return: None
+    def _run(self, wakeup):
+    #{{{
+        while True:
+            wait = self._step(wakeup)
+            if wait is False:
+                break
+            wakeup.wait(wait)
+    #}}}
+
+    # One pass of the sender, send what can go out
+    # Params: wakeup - Event set when messages are queued
+    # Return: seconds to wait for more, None to wait for a put, False once
+    #         closed and everything is out
+    def _step(self, wakeup):
+    #{{{
+        # Cleared before the flush, a put landing during it wakes the next
+        # wait instead of getting lost
+        wakeup.clear()
+        batch, wait = self.flush(time.monotonic())
+        self._sendBatch(batch)
+        if not self.running and not self.pending():
+            return False
+        return wait
+    #}}}
+
+    # Send out collected messages
+    # Params: batch - list of (channel, text)
+    # Return: None
+    def _sendBatch(self, batch):
+    #{{{
+        for channel, text in batch:
+            try:
+                self.send(channel, text)
+            # Connection trouble gets dealt with by the read side
+            except Exception as err:
+                util.logger.log(DiagMessage("BOT0090E", channel, str(err)))
+    #}}}
+
+    # Pop the head of a queue, merging in short messages right behind it
+    # Params: queue - deque of (seq, text) for one channel and priority
+    # Return: text to post
+    def _coalesce(self, queue):
+    #{{{
+        _, text = queue.popleft()
+        if len(text) >= self.COALESCE_MAX:
+            return text
+        while queue:
+            _, next_text = queue[0]
+            if (len(next_text) >= self.COALESCE_MAX or
+                len(text) + len(next_text) + 1 > self.MESSAGE_MAX):
+                break
+            text += "\n" + queue.popleft()[1]
+        return text
+    #}}}
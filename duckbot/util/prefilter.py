@@ -0,0 +1,66 @@
+# Last Updated: 2.4.0
+# Python imports
+import re
+# Project imports
+import util.common as util
+
+# Prefilter class
+# Looks at raw message events before anything gets built from them and drops
+# the ones that aren't talking to the bot, along with everything from
+# channels that opted out
+class Prefilter:
+
+    # Constructor for prefilter
+    # Params: bot_id   - bot user id, mentions of it get through
+    #         channels - dict of channel ids to Channel, for opt outs
+    # Return: Prefilter instance
+    def __init__(self, bot_id, channels):
+    #{{{
+        # match only looks at the start of the text, nothing gets copied
+        self.trigger = re.compile(r"\s*(?:<@" + re.escape(bot_id) + r"[>|]|:duckbot:)",
+                                  re.IGNORECASE)
+        self.optouts = set()
+        self.filtered = 0
+        self.processed = 0
+        for channel in channels.values():
+            self.checkChannel(channel)
+    #}}}
+
+    # Check if a raw event should go on to the bot
+    # Params: event_p - incoming slack event
+    # Return: True to handle it, False to drop it
+    def check(self, event_p):
+    #{{{
+        if event_p.get("type") != "message":
+            return True
+        subtype = event_p.get("subtype")
+        # Purpose changes still go through so channels can opt back in
+        if (subtype != "channel_purpose" and
+            event_p.get("channel") in self.optouts):
+            self.filtered += 1
+            return False
+
+        if subtype is None:
+            text = event_p.get("text")
+        elif subtype == "message_changed":
+            text = event_p.get("message", {}).get("text")
+        # Bot messages and channel updates don't need a mention
+        else:
+            return True
+        if text and self.trigger.match(text):
+            self.processed += 1
+            return True
+        self.filtered += 1
+        return False
+    #}}}
+
+    # Add or remove a channel's opt out from its labels
+    # Params: channel - Channel to check
+    # Return: None
+    def checkChannel(self, channel):
+    #{{{
+        if util.LABELS["OPTOUT"] in channel.labels:
+            self.optouts.add(channel.id)
+        else:
+            self.optouts.discard(channel.id)
+    #}}}
@@ -0,0 +1,130 @@
+# Last Updated: 2.4.0
+# Python imports
+from bisect import bisect_left, insort
+from itertools import chain, islice
+
+# RankedList class
+# Sorted list that can also say where a key ranks. Keys live in a list of
+# sorted chunks with the last key of each chunk kept alongside, so adding and
+# removing is a bisect plus an insert into one short list. Chunk lengths are
+# kept in a Fenwick tree, so a rank is two bisects plus a log sized sum
+# rather than adding up every chunk in front. The tree is rebuilt when a
+# chunk splits or empties, once every LOAD or so changes
+class RankedList:
+    LOAD = 1000 # keys per chunk, chunks split at twice this
+
+    # Constructor for ranked list
+    # Params: keys - keys to start with, already sorted
+    # Return: RankedList instance
+    def __init__(self, keys = ()):
+    #{{{
+        keys = list(keys)
+        load = self.LOAD
+        self.chunks = [keys[start:start + load]
+                       for start in range(0, len(keys), load)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.size = len(keys)
+        self._buildTree()
+    #}}}
+
+    # Add a key
+    # Params: key - key to add
+    # Return: None
+    def add(self, key):
+    #{{{
+        if not self.chunks:
+            self.chunks.append([key])
+            self.maxes.append(key)
+            self.size = 1
+            self._buildTree()
+            return
+        spot = bisect_left(self.maxes, key)
+        # Past the end goes on the last chunk
+        if spot == len(self.maxes):
+            spot -= 1
+            self.chunks[spot].append(key)
+            self.maxes[spot] = key
+        else:
+            insort(self.chunks[spot], key)
+        self.size += 1
+        chunk = self.chunks[spot]
+        if len(chunk) > 2 * self.LOAD:
+            half = len(chunk) // 2
+            self.chunks[spot:spot + 1] = [chunk[:half], chunk[half:]]
+            self.maxes[spot:spot + 1] = [chunk[half - 1], chunk[-1]]
+            self._buildTree()
+        else:
+            self._bump(spot, 1)
+    #}}}
+
+    # Remove a key
+    # Params: key - key to remove, has to be in the list
+    # Return: None
+    def remove(self, key):
+    #{{{
+        spot = bisect_left(self.maxes, key)
+        chunk = self.chunks[spot]
+        del chunk[bisect_left(chunk, key)]
+        self.size -= 1
+        if not chunk:
+            del self.chunks[spot]
+            del self.maxes[spot]
+            self._buildTree()
+        else:
+            self.maxes[spot] = chunk[-1]
+            self._bump(spot, -1)
+    #}}}
+
+    # Count the keys sorting before a key
+    # Params: key - key to rank, doesn't have to be in the list
+    # Return: number of keys less than key
+    def rank(self, key):
+    #{{{
+        spot = bisect_left(self.maxes, key)
+        if spot == len(self.maxes):
+            return self.size
+        # Sum of the chunk lengths in front out of the tree
+        tree = self.tree
+        front = bisect_left(self.chunks[spot], key)
+        while spot:
+            front += tree[spot]
+            spot &= spot - 1
+        return front
+    #}}}
+
+    # Get the first keys
+    # Params: count - number of keys
+    # Return: list of up to count smallest keys
+    def top(self, count):
+        return list(islice(chain.from_iterable(self.chunks), count))
+
+    def __len__(self):
+        return self.size
+
+    # Build the Fenwick tree of chunk lengths from scratch, one pass
+    # Params: None
+    # Return: None
+    def _buildTree(self):
+    #{{{
+        tree = [0]
+        tree.extend(map(len, self.chunks))
+        size = len(tree)
+        for num in range(1, size):
+            parent = num + (num & -num)
+            if parent < size:
+                tree[parent] += tree[num]
+        self.tree = tree
+    #}}}
+
+    # Change one chunk's length in the tree
+    # Params: spot   - chunk number
+    #         change - amount the length changed by
+    # Return: None
+    def _bump(self, spot, change):
+    #{{{
+        tree = self.tree
+        spot += 1
+        while spot < len(tree):
+            tree[spot] += change
+            spot += spot & -spot
+    #}}}
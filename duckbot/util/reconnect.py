@@ -0,0 +1,121 @@
+# Last Updated: 2.4.0
+# Python imports
+import time
+import random
+# Project imports
+import util.common as util
+from util.diagMessage import DiagMessage
+
+# Reconnector class
+# Brings the rtm connection back after a read failure without restarting
+# the process, backing off exponentially with jitter between attempts
+class Reconnector:
+    BACKOFF_BASE = 1   # seconds
+    BACKOFF_MAX  = 60  # seconds
+    MAX_ATTEMPTS = 10
+    #{{{ - Return codes worth reconnecting for
+    RECONNECT_CODES = [
+         util.EXIT_CODES["RTM_GENERIC_ERROR"]
+        ,util.EXIT_CODES["RTM_TIMEOUT_ERROR"]
+    ]
+    #}}}
+
+    # Constructor for reconnector
+    # Params: connect - function that connects to the rtm, returns 0 if good
+    # Return: Reconnector instance
+    def __init__(self, connect):
+    #{{{
+        self.connect = connect
+        self.reconnects = 0
+        self.downtime = 0
+        self.down_since = None
+    #}}}
+
+    # Check if a return code is a dropped connection
+    # Params: return_code - bot return code
+    # Return: True if reconnecting should be tried
+    def handles(self, return_code):
+        return return_code in self.RECONNECT_CODES
+
+    # Reconnect, sleeping between attempts
+    # Params: return_code - return code the read failed with
+    # Return: 0 once reconnected, return_code if we gave up
+    def reconnect(self, return_code):
+    #{{{
+        self._down()
+        for attempt in range(self.MAX_ATTEMPTS):
+            time.sleep(self.backoff(attempt))
+            if self._attempt(attempt):
+                return 0
+        return self._giveUp(return_code)
+    #}}}
+
+    # Reconnect from the asyncio loop
+    # Params: return_code - return code the read failed with
+    # Return: 0 once reconnected, return_code if we gave up
+    async def areconnect(self, return_code):
+    #{{{
+        import asyncio
+        self._down()
+        for attempt in range(self.MAX_ATTEMPTS):
+            await asyncio.sleep(self.backoff(attempt))
+            if self._attempt(attempt):
+                return 0
+        return self._giveUp(return_code)
+    #}}}
+
+    # Time to wait before an attempt, full jitter on an exponential cap
+    # Params: attempt - attempt number, starting at 0
+    # Return: seconds to wait
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.BACKOFF_MAX,
+                                     self.BACKOFF_BASE * 2 ** attempt))
+
+    # Mark the connection as down and hold outbound messages
+    # Params: None
+    # Return: None
+    def _down(self):
+    #{{{
+        self.down_since = time.monotonic()
+        if util.outbox:
+            util.outbox.pause()
+    #}}}
+
+    # Make one attempt at reconnecting
+    # Params: attempt - attempt number, starting at 0
+    # Return: True if connected
+    def _attempt(self, attempt):
+    #{{{
+        util.logger.log(DiagMessage("BOT0081I", str(attempt + 1)))
+        # Get rid of the dead socket first
+        try:
+            util.sc.server.websocket.close()
+        except Exception:
+            pass
+        if self.connect():
+            return False
+
+        down = time.monotonic() - self.down_since
+        self.reconnects += 1
+        self.downtime += down
+        self.down_since = None
+        util.logger.log(DiagMessage("BOT0080I",
+            "down {:.2f}s".format(down),
+            "reconnects " + str(self.reconnects),
+            "total down {:.2f}s".format(self.downtime)))
+        if util.outbox:
+            util.outbox.resume()
+        return True
+    #}}}
+
+    # Give up reconnecting
+    # Params: return_code - return code the read failed with
+    # Return: return_code
+    def _giveUp(self, return_code):
+    #{{{
+        util.logger.log(DiagMessage("BOT0082E", str(self.MAX_ATTEMPTS)))
+        # Let the outbox finish up, sends will just fail now
+        if util.outbox:
+            util.outbox.resume()
+        return return_code
+    #}}}
@@ -0,0 +1,292 @@
+# Last Updated: 2.4.0
+# Python imports
+import sys
+import dis
+import time
+import types
+import importlib
+from array import array
+from collections import deque
+from itertools import chain
+# Project imports
+import util.common as util
+from util.diagMessage import DiagMessage
+
+# Reloader class
+# Re-imports the bot's own modules in place so an update can go live without
+# dropping the rtm connection. Every module's namespace is snapshotted first
+# and put back if anything fails, so the bot never runs half old, half new.
+# Live objects the bot keeps, the bank and everything hanging off it, the
+# scheduler, outbox and so on, are moved onto the new classes, and bound
+# methods stored away (timer jobs) are bound again to the new code
+class Reloader:
+    PACKAGES = ("handlers", "util")
+    MODULES  = ("duckbot",)
+    #{{{ - Runtime globals set by main that survive a reload
+    KEEP = {
+        "util.common" : ("sc", "logger", "debug", "bank_file", "aio",
+                         "hot_reload", "api_pool", "work_pool", "outbox",
+                         "recorder", "start_cache", "bank_store")
+    }
+    #}}}
+    # Values with nothing of ours inside, skipped without a look
+    ATOMIC = frozenset((str, int, float, bool, bytes, bytearray, array,
+                        type(None)))
+
+    # Constructor for reloader
+    # Params: None
+    # Return: Reloader instance
+    def __init__(self):
+        self.reloads = 0
+
+    # Reload the bot modules and hand the new code to the running bot
+    # Params: rebuild - function called once the modules are reloaded, any
+    #                   error it raises rolls the reload back too
+    #         roots   - live objects to move onto the new code along with
+    #                   everything they reach, the globals in KEEP are added
+    #         fresh   - objects in there that rebuild makes again, these don't
+    #                   have to fit the new constructors
+    # Return: None if the reload went through, error string otherwise
+    def reload(self, rebuild, roots = (), fresh = ()):
+    #{{{
+        start = time.perf_counter()
+        modules = self._order(self._modules())
+        saved = {module: dict(module.__dict__) for module in modules}
+        names = {module.__name__ for module in modules}
+        kept = [util.__dict__.get(name) for name in self.KEEP["util.common"]]
+        # Found before anything is reloaded, while the classes are the old ones
+        found = self._walk(list(roots) + kept, names)
+        try:
+            # Make sure every file at least compiles before touching anything
+            for module in modules:
+                source = module.__spec__.loader.get_source(module.__name__)
+                compile(source, module.__file__, "exec")
+            for module in modules:
+                kept = {name: module.__dict__[name]
+                        for name in self.KEEP.get(module.__name__, ())
+                        if name in module.__dict__}
+                importlib.reload(module)
+                module.__dict__.update(kept)
+            moves, rebinds = self._plan(found, saved,
+                                        set(map(id, fresh)))
+            rebuild()
+        except Exception as err:
+        #{{{
+            # Put every namespace back the way it was, without ever leaving
+            # one empty since the worker threads are still running
+            for module, namespace in saved.items():
+                module.__dict__.update(namespace)
+                for name in set(module.__dict__) - set(namespace):
+                    del module.__dict__[name]
+                sys.modules[module.__name__] = module
+            error = type(err).__name__ + ": " + str(err)
+            util.logger.log(DiagMessage("BOT0101E", error))
+            return error
+        #}}}
+        # Nothing left to fail, move the live objects over. Set on the object
+        # itself, a Lazy would pass the write on to what it stands in for
+        for obj, new in moves:
+            object.__setattr__(obj, "__class__", new)
+        for holder, key, method in rebinds:
+            bound = getattr(method.__self__, method.__func__.__name__)
+            if isinstance(holder, (dict, list)):
+                holder[key] = bound
+            else:
+                object.__setattr__(holder, key, bound)
+        self.reloads += 1
+        util.logger.log(DiagMessage("BOT0100I",
+            str(len(modules)) + " modules", str(len(moves)) + " objects",
+            "{:.1f}ms".format((time.perf_counter() - start) * 1000)))
+        return None
+    #}}}
+
+    # Find the loaded bot modules
+    # Params: None
+    # Return: list of module objects
+    def _modules(self):
+    #{{{
+        modules = []
+        for name, module in list(sys.modules.items()):
+            if module is None or not getattr(module, "__file__", None):
+                continue
+            if (name in self.MODULES or
+                name.split(".")[0] in self.PACKAGES and name != __name__):
+                modules.append(module)
+        return modules
+    #}}}
+
+    # Find every object of ours reachable from some roots, going through
+    # containers and the attributes of the roots and our own objects only
+    # Params: roots - objects to start from
+    #         names - names of the modules being reloaded
+    # Return: list of (object, stored bound methods as (holder, key, method))
+    def _walk(self, roots, names):
+    #{{{
+        found = []
+        seen = set()
+        atomic = self.ATOMIC
+        root_ids = set(map(id, roots))
+        stack = list(roots)
+        while stack:
+        #{{{
+            obj = stack.pop()
+            if type(obj) in atomic or id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            # Big columns of plain values get ruled out in one C level pass
+            if type(obj) is dict:
+                if (atomic.issuperset(map(type, obj)) and
+                    atomic.issuperset(map(type, obj.values()))):
+                    obj = None
+            elif type(obj) in (list, deque, tuple, set, frozenset):
+                if atomic.issuperset(map(type, obj)):
+                    obj = None
+            if obj is None:
+                continue
+            # (holder, key, value) for everything the object holds
+            if isinstance(obj, dict):
+                held = chain(((obj, key, value) for key, value in obj.items()),
+                             ((None, None, key) for key in obj))
+            elif isinstance(obj, (list, deque)):
+                held = ((obj, num, value) for num, value in enumerate(obj))
+            elif isinstance(obj, (tuple, set, frozenset)):
+                held = ((None, None, value) for value in obj)
+            elif (isinstance(obj, types.FunctionType) and obj.__closure__ and
+                  obj.__module__ in names):
+                # Our lambdas hold things too, like a Lazy's factory the bank
+                held = ((None, None, value) for value in self._cells(obj))
+            else:
+                held = ()
+            ours = type(obj).__module__ in names
+            if ours or id(obj) in root_ids:
+                slots = [name for cls in type(obj).__mro__
+                         for name in cls.__dict__.get("__slots__", ())
+                         if hasattr(obj, name)]
+                held = chain(held, ((obj, name, value) for name, value in
+                                    getattr(obj, "__dict__", {}).items()),
+                             ((obj, name, getattr(obj, name)) for name in slots))
+            methods = []
+            for holder, key, value in held:
+                if type(value) in atomic:
+                    continue
+                if isinstance(value, types.MethodType) and holder is not None:
+                    methods.append((holder, key, value))
+                    value = value.__self__
+                stack.append(value)
+            if ours or methods:
+                found.append((obj, methods))
+        #}}}
+        return found
+    #}}}
+
+    # Get what a function's closure holds, skipping cells not filled in yet
+    # Params: function - function to look in
+    # Return: list of values
+    def _cells(self, function):
+    #{{{
+        values = []
+        for cell in function.__closure__:
+            try:
+                values.append(cell.cell_contents)
+            except ValueError:
+                pass
+        return values
+    #}}}
+
+    # Work out the moves onto the new classes, checking each one can happen
+    # Params: found - objects from _walk
+    #         saved - old namespace by module
+    #         fresh - ids of objects that get made again by the new code
+    # Return: list of (object, new class) and list of bound methods to bind
+    #         again as (holder, key, method)
+    def _plan(self, found, saved, fresh):
+    #{{{
+        classes = {}
+        for module, namespace in saved.items():
+            for name, value in namespace.items():
+                self._mapClasses(value, module.__dict__.get(name),
+                                 module.__name__, classes)
+        moves = []
+        rebinds = []
+        for obj, methods in found:
+            new = classes.get(type(obj))
+            if new is not None:
+                old = type(obj)
+                # Same check __class__ assignment does, done up front so the
+                # moves after can't fail halfway
+                if (old.__basicsize__ != new.__basicsize__ or
+                    old.__itemsize__ != new.__itemsize__ or
+                    old.__dict__.get("__slots__") != new.__dict__.get("__slots__")):
+                    raise TypeError(old.__qualname__ + " changed layout, needs"
+                                    " a restart")
+                # A kept object never ran the new constructor, anything it
+                # sets up now would be missing
+                added = (set() if id(obj) in fresh else
+                         self._initAttrs(new) - self._initAttrs(old))
+                if added:
+                    raise TypeError(old.__qualname__ + " sets up new attributes"
+                                    " (" + ", ".join(sorted(added)) + "), needs"
+                                    " a restart")
+                moves.append((obj, new))
+            rebinds += [(holder, key, method) for holder, key, method in methods
+                        if type(method.__self__) in classes]
+        return moves, rebinds
+    #}}}
+
+    # Find the attributes a class's constructors set
+    # Params: cls - class to look at
+    # Return: set of attribute names
+    def _initAttrs(self, cls):
+    #{{{
+        attrs = set()
+        for base in cls.__mro__:
+            code = getattr(base.__dict__.get("__init__"), "__code__", None)
+            if code is not None:
+                attrs.update(instr.argval for instr in
+                             dis.get_instructions(code)
+                             if instr.opname == "STORE_ATTR")
+        return attrs
+    #}}}
+
+    # Pair an old class with its reloaded self, nested classes too
+    # Params: old     - value from the old namespace
+    #         new     - value of the same name in the new one
+    #         module  - module name the classes have to come from
+    #         classes - dict of old class to new class to fill in
+    # Return: None
+    def _mapClasses(self, old, new, module, classes):
+    #{{{
+        if (not isinstance(old, type) or not isinstance(new, type) or
+            old is new or old.__module__ != module):
+            return
+        classes[old] = new
+        for name, value in old.__dict__.items():
+            self._mapClasses(value, new.__dict__.get(name), module, classes)
+    #}}}
+
+    # Order modules so each one is reloaded after the modules it pulls names
+    # from, otherwise from imports would grab the old objects
+    # Params: modules - list of module objects
+    # Return: list of module objects, dependencies first
+    def _order(self, modules):
+    #{{{
+        names = {module.__name__: module for module in modules}
+        ordered = []
+        seen = set()
+
+        def visit(module):
+            if module.__name__ in seen:
+                return
+            seen.add(module.__name__)
+            for value in list(module.__dict__.values()):
+                dep = value if hasattr(value, "__spec__") else None
+                dep = names.get(dep.__name__ if dep else
+                                getattr(value, "__module__", None))
+                if dep is not None and dep is not module:
+                    visit(dep)
+            ordered.append(module)
+
+        for module in modules:
+            visit(module)
+        return ordered
+    #}}}
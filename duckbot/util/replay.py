@@ -0,0 +1,251 @@
+# Last Updated: 2.4.0
+# Python imports
+import os
+import json
+import time
+import random
+# Project imports
+import util.common as util
+from util.logger import Logger
+from util.apiPool import ApiPool
+from util.channels import Channel
+
+# Recorder class
+# Writes raw rtm_read event lists out to a json lines capture file
+class Recorder:
+
+    # Constructor for recorder
+    # Params: fn - capture file name
+    # Return: Recorder instance
+    def __init__(self, fn):
+    #{{{
+        self.fn = fn
+        self.capture = open(fn, "w")
+        self.start = time.monotonic()
+    #}}}
+
+    # Write the capture header with the workspace the events came from,
+    # written again once the channel stream finishes
+    # Params: bot_id   - bot user id
+    #         channels - dict of channel ids to Channel
+    # Return: None
+    def header(self, bot_id, channels):
+    #{{{
+        self.capture.write(json.dumps({"bot_id": bot_id, "channels":
+            {channel_id: channel.toDict()
+             for channel_id, channel in channels.items()}}))
+        self.capture.write("\n")
+    #}}}
+
+    # Record one rtm_read result
+    # Params: event_list - list of raw rtm events
+    # Return: None
+    def record(self, event_list):
+    #{{{
+        if event_list:
+            self.capture.write(json.dumps({
+                 "t"      : round(time.monotonic() - self.start, 6)
+                ,"events" : event_list
+            }))
+            self.capture.write("\n")
+    #}}}
+
+    # Close out the capture file
+    # Params: None
+    # Return: None
+    def close(self):
+        self.capture.close()
+
+# Fake slack client class
+# In memory stand in for SlackClient, answers the web api calls the bot
+# makes and keeps every message the bot sends
+class FakeSlackClient:
+
+    # Fake server, no rtm connection to speak of
+    class Server:
+        websocket = None
+
+    # Constructor for fake slack client
+    # Params: bot_id   - user id to answer auth.test with
+    #         channels - list of raw channel data for conversations.list
+    # Return: FakeSlackClient instance
+    def __init__(self, bot_id = "UDUCKBOT0", channels = None):
+    #{{{
+        self.token = "xoxb-fake"
+        self.server = self.Server()
+        self.bot_id = bot_id
+        self.channels = channels or []
+        self.frames = []
+        self.sent = []
+    #}}}
+
+    # Answer a web api call
+    # Params: method - api method called
+    #         kwargs - api call arguments
+    # Return: api response dict
+    def api_call(self, method, **kwargs):
+    #{{{
+        if method == "auth.test":
+            return {"ok": True, "user_id": self.bot_id}
+        elif method == "conversations.list":
+            start = int(kwargs.get("cursor") or 0)
+            end = start + kwargs.get("limit", 100)
+            return {"ok": True, "channels": self.channels[start:end],
+                    "response_metadata": {"next_cursor":
+                        str(end) if end < len(self.channels) else ""}}
+        elif method == "bots.info":
+            return {"ok": True, "bot": {"user_id": "U" + kwargs["bot"][1:].ljust(8, "0")}}
+        return {"ok": False, "error": "unknown_method"}
+    #}}}
+
+    # Queue frames for rtm_read to hand back
+    # Params: event_list - list of raw rtm events
+    # Return: None
+    def feed(self, event_list):
+        self.frames.extend(event_list)
+
+    # Hand back one queued frame like the real client does
+    # Params: None
+    # Return: list of events, empty if nothing queued
+    def rtm_read(self):
+        return [self.frames.pop(0)] if self.frames else []
+
+    # Keep a sent message
+    # Params: channel - channel id sent to
+    #         message - message text
+    # Return: None
+    def rtm_send_message(self, channel, message):
+        self.sent.append((channel, message))
+
+# Replayer class
+# Feeds a capture through a Duckbot running on a FakeSlackClient and
+# measures how long each event takes to handle
+class Replayer:
+
+    # Constructor for replayer
+    # Params: fn       - capture file name
+    #         realtime - replay at recorded speed instead of flat out
+    #         seed     - random seed so rolls and pulls repeat
+    # Return: Replayer instance
+    def __init__(self, fn, realtime = False, seed = 0):
+    #{{{
+        self.realtime = realtime
+        self.seed = seed
+        self.bot_id = None
+        self.channels = {}
+        self.frames = []
+        with open(fn) as capture:
+            for line in capture:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                # Last header wins, it has the whole channel list
+                if "bot_id" in record:
+                    self.bot_id = record["bot_id"]
+                    self.channels = {channel_id: Channel.fromData(data)
+                        for channel_id, data in record["channels"].items()}
+                else:
+                    self.frames.append((record["t"], record["events"]))
+    #}}}
+
+    # Replay the capture
+    # Params: None
+    # Return: dict of results, see report for the fields
+    def replay(self):
+    #{{{
+        from duckbot import Duckbot
+
+        random.seed(self.seed)
+        util.debug = False
+        util.bank_file = False
+        util.outbox = None
+        util.logger = Logger(fn=os.devnull)
+        util.sc = FakeSlackClient(self.bot_id or "UDUCKBOT0",
+            [channel.toDict() for channel in self.channels.values()])
+        util.api_pool = ApiPool()
+        util.work_pool = ApiPool(ApiPool.WORK_SIZE, ApiPool.WORK_QUEUE, "work")
+        # Timers run off the recorded clock unless we're going in real time
+        clock = [0.0]
+        duckbot = Duckbot(util.sc.bot_id, self.channels,
+            clock=time.monotonic if self.realtime else lambda: clock[0])
+
+        timings = {}
+        handled = 0
+        start = time.monotonic()
+        busy = 0
+        for stamp, event_list in self.frames:
+        #{{{
+            # Wait for the recorded time or just pretend it went by
+            if self.realtime:
+                delay = stamp - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            clock[0] = stamp
+            duckbot.runTimers()
+
+            for event in event_list:
+                before = time.perf_counter()
+                duckbot.handleEvent(event)
+                spent = time.perf_counter() - before
+                busy += spent
+                timings.setdefault(self._eventKey(event), []).append(spent)
+                handled += 1
+        #}}}
+        util.api_pool.shutdown(wait=True)
+        util.work_pool.shutdown(wait=True)
+
+        return {
+             "events"   : handled
+            ,"busy"     : busy
+            ,"elapsed"  : time.monotonic() - start
+            ,"timings"  : timings
+            ,"sent"     : util.sc.sent
+        }
+    #}}}
+
+    # Turn replay results into report lines
+    # Params: results - dict from replay
+    # Return: list of report strings
+    def report(self, results):
+    #{{{
+        lines = []
+        rate = results["events"] / results["busy"] if results["busy"] else 0
+        lines.append("Events handled: " + str(results["events"]) + " in "
+                     "{:.3f}s ({:.0f} events/sec handling)".format(
+                        results["elapsed"], rate))
+        lines.append("{:<28}{:>8}{:>10}{:>10}{:>10}{:>10}".format(
+            "Event type", "Count", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+        for key in sorted(results["timings"]):
+            times = sorted(results["timings"][key])
+            lines.append("{:<28}{:>8}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}".format(
+                key, len(times),
+                percentile(times, 50) * 1000,
+                percentile(times, 90) * 1000,
+                percentile(times, 99) * 1000,
+                times[-1] * 1000))
+        lines.append("Messages sent: " + str(len(results["sent"])))
+        return lines
+    #}}}
+
+    # Event type key to group timings under
+    # Params: event - raw rtm event
+    # Return: type string, with subtype if there is one
+    def _eventKey(self, event):
+    #{{{
+        key = event.get("type", "none")
+        if "subtype" in event:
+            key += "/" + event["subtype"]
+        return key
+    #}}}
+
+# Get a percentile out of sorted values
+# Params: values - sorted list of values
+#         pct    - percentile to get, 0 to 100
+# Return: value at that percentile
+def percentile(values, pct):
+#{{{
+    if not values:
+        return 0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+#}}}
@@ -0,0 +1,114 @@
+# Last Updated: 2.4.0
+# Python imports
+import time
+import heapq
+
+# Job class
+# A scheduled function call, one shot or repeating
+class Job:
+    __slots__ = ("name", "func", "interval", "deadline", "cancelled")
+
+    # Constructor for job
+    # Params: name     - name for logging
+    #         func     - function to call when the job fires
+    #         interval - seconds between runs, None for one shot
+    #         deadline - monotonic time of the first run
+    # Return: Job instance
+    def __init__(self, name, func, interval, deadline):
+    #{{{
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.deadline = deadline
+        self.cancelled = False
+    #}}}
+
+# Scheduler class
+# Heap of jobs keyed on the monotonic clock. Repeating jobs are rescheduled
+# off their last deadline rather than when they actually ran, so handling
+# time never pushes them back
+class Scheduler:
+
+    # Constructor for scheduler
+    # Params: clock - function returning the current time in seconds
+    # Return: Scheduler instance
+    def __init__(self, clock = time.monotonic):
+    #{{{
+        self.clock = clock
+        self.heap = []
+        self.seq = 0
+    #}}}
+
+    # Schedule a repeating job
+    # Params: interval - seconds between runs
+    #         func     - function to call
+    #         name     - name for logging
+    #         first    - seconds until the first run, defaults to interval
+    # Return: Job instance
+    def every(self, interval, func, name = None, first = None):
+    #{{{
+        first = interval if first is None else first
+        return self._push(Job(name or func.__name__, func, interval,
+                              self.clock() + first))
+    #}}}
+
+    # Schedule a one shot job
+    # Params: delay - seconds until the job runs
+    #         func  - function to call
+    #         name  - name for logging
+    # Return: Job instance
+    def after(self, delay, func, name = None):
+        return self._push(Job(name or func.__name__, func, None,
+                              self.clock() + delay))
+
+    # Cancel a job, it's dropped when it comes up
+    # Params: job - Job to cancel
+    # Return: None
+    def cancel(self, job):
+        job.cancelled = True
+
+    # Seconds until the next job is due
+    # Params: None
+    # Return: seconds to wait, 0 if something is due, None if no jobs
+    def nextDeadline(self):
+    #{{{
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(0, self.heap[0][0] - self.clock())
+    #}}}
+
+    # Run every job that's due
+    # Params: None
+    # Return: number of jobs run
+    def run(self):
+    #{{{
+        now = self.clock()
+        ran = 0
+        while self.heap and self.heap[0][0] <= now:
+            _, _, job = heapq.heappop(self.heap)
+            if job.cancelled:
+                continue
+            # Repeating jobs go back on before running so they can cancel
+            # themselves. Runs missed while stalled are skipped, not bunched
+            if job.interval:
+                job.deadline += job.interval
+                if job.deadline <= now:
+                    missed = (now - job.deadline) // job.interval + 1
+                    job.deadline += missed * job.interval
+                self._push(job)
+            job.func()
+            ran += 1
+        return ran
+    #}}}
+
+    # Put a job on the heap
+    # Params: job - Job to add
+    # Return: the job
+    def _push(self, job):
+    #{{{
+        self.seq += 1
+        heapq.heappush(self.heap, (job.deadline, self.seq, job))
+        return job
+    #}}}
@@ -0,0 +1,55 @@
+# Last Updated: 2.4.0
+# Python imports
+import time
+from collections import OrderedDict
+
+# SeenCache class
+# Remembers the messages the bot already acted on, keyed on channel and ts, so
+# edits and frames slack sends again after a reconnect don't run twice.
+# Holds at most size entries for at most ttl seconds, oldest go first
+class SeenCache:
+    SIZE = 4096 # entries kept
+    TTL  = 900  # seconds an entry counts
+
+    # Constructor for seen cache
+    # Params: size  - max entries to keep
+    #         ttl   - seconds before an entry stops counting
+    #         clock - monotonic clock, replays swap it out
+    # Return: SeenCache instance
+    def __init__(self, size = SIZE, ttl = TTL, clock = time.monotonic):
+    #{{{
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        # (channel, ts) to time first seen, oldest first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    #}}}
+
+    # Check if a message was seen already and remember it if not
+    # Params: channel - channel id of the message
+    #         ts      - slack timestamp of the message
+    # Return: True if it was seen already, False if it's new
+    def seen(self, channel, ts):
+    #{{{
+        now = self.clock()
+        key = (channel, ts)
+        stamp = self.entries.get(key)
+        if stamp is not None and now - stamp < self.ttl:
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        # Entries only go in at the end, so anything expired is at the front
+        entries = self.entries
+        if stamp is not None:
+            del entries[key]
+        while entries:
+            oldest = next(iter(entries.values()))
+            if now - oldest < self.ttl and len(entries) < self.size:
+                break
+            entries.popitem(last=False)
+        entries[key] = now
+        return False
+    #}}}
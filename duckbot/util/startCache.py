@@ -0,0 +1,75 @@
+# Last Updated: 2.4.0
+# Python imports
+import os
+import json
+import time
+import hashlib
+# Project imports
+import util.common as util
+from util.diagMessage import DiagMessage
+from util.channels import Channel
+
+# Start cache class
+# Keeps the bot id and channel map (labels included) from the last run so
+# startup can skip the web api and refresh in the background instead
+class StartCache:
+    DEFAULT_FN = "startup.cache"
+    VERSION    = 2
+
+    # Constructor for start cache
+    # Params: fn - cache file name
+    # Return: StartCache instance
+    def __init__(self, fn = DEFAULT_FN):
+        self.fn = fn
+
+    # Load the cache for a token
+    # Params: token - bot token the cache was saved for
+    # Return: bot id and channel dict, or None if there's no usable cache
+    def load(self, token):
+    #{{{
+        try:
+            with open(self.fn) as cache_file:
+                cache = json.load(cache_file)
+        # Missing or mangled, just go the slow way
+        except (OSError, ValueError):
+            return None
+        if (cache.get("version") != self.VERSION or
+            cache.get("token") != self._tokenKey(token)):
+            return None
+        util.logger.log(DiagMessage("INI0031I",
+            str(len(cache["channels"])) + " channels",
+            "saved " + time.ctime(cache["saved"])))
+        return cache["bot_id"], {channel_id: Channel.fromData(data)
+                                 for channel_id, data in cache["channels"].items()}
+    #}}}
+
+    # Save the cache, swapping the file in whole so a crash can't leave half
+    # of one behind
+    # Params: token    - bot token to save for
+    #         bot_id   - bot user id
+    #         channels - dict of channel ids to Channel
+    # Return: None
+    def save(self, token, bot_id, channels):
+    #{{{
+        temp_fn = self.fn + ".tmp"
+        try:
+            with open(temp_fn, "w") as cache_file:
+                json.dump({
+                     "version"  : self.VERSION
+                    ,"token"    : self._tokenKey(token)
+                    ,"saved"    : time.time()
+                    ,"bot_id"   : bot_id
+                    ,"channels" : {channel_id: channel.toDict()
+                                   for channel_id, channel in channels.items()}
+                }, cache_file)
+            os.replace(temp_fn, self.fn)
+        # Cache couldn't be written, next start is just slower
+        except OSError:
+            pass
+    #}}}
+
+    # Key the cache on a hash of the token so it isn't sitting in the file
+    # Params: token - bot token
+    # Return: hex digest string
+    def _tokenKey(self, token):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
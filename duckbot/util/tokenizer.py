@@ -0,0 +1,101 @@
+# Last Updated: 2.4.0
+# Python imports
+import re
+# Project imports
+import util.common as util
+
+EMOJI = r":[a-z0-9_+-]+:"
+#{{{ - Token regex, first alternative that fits wins
+TOKEN_REGEX = re.compile(r"""
+     (?P<QUOTED>"[^"]*"|'[^']*')
+    |(?P<MENTION><@(?P<user>""" + util.USER_REGEX + r""")(?:\|[^>]*)?>)(?=\s|$)
+    |(?P<DICE>(?P<die_num>\d+|""" + EMOJI + r""")?d(?P<die_size>\d+|""" + EMOJI + r"""))(?=\s|$)
+    |(?P<EMOJI>""" + EMOJI + r""")(?=\s|$)
+    |(?P<INTEGER>[+-]?\d+)(?=\s|$)
+    |(?P<WORD>\S+)
+""", re.VERBOSE | re.IGNORECASE)
+#}}}
+
+# Token class
+# One piece of command text, with the text as typed and a normalized form
+# (uppercase, mention user id or quote contents) next to each other
+class Token:
+    __slots__ = ("kind", "text", "norm", "value")
+
+    # Constructor for token
+    # Params: kind  - MENTION, EMOJI, INTEGER, DICE, QUOTED or WORD
+    #         text  - text as typed
+    #         norm  - normalized text for comparing
+    #         value - converted value, depends on the kind
+    #                 MENTION - user id
+    #                 EMOJI   - number for number emoji, None otherwise
+    #                 INTEGER - int
+    #                 DICE    - (number of dice, die size), -1 for bad emoji
+    #                 QUOTED  - text between the quotes
+    #                 WORD    - None
+    # Return: Token instance
+    def __init__(self, kind, text, norm, value = None):
+    #{{{
+        self.kind = kind
+        self.text = text
+        self.norm = norm
+        self.value = value
+    #}}}
+
+    # Get the token as a number, integers and number emoji count
+    # Params: default - value if the token isn't a number
+    # Return: int
+    def number(self, default):
+    #{{{
+        if self.kind == "INTEGER":
+            return self.value
+        elif self.kind == "EMOJI" and self.value is not None:
+            return self.value
+        return default
+    #}}}
+
+    def __repr__(self):
+        return "Token(" + self.kind + ", " + repr(self.text) + ")"
+
+# Split command text into tokens in one pass
+# Params: text - message text
+# Return: list of Token
+def tokenize(text):
+#{{{
+    tokens = []
+    for match in TOKEN_REGEX.finditer(text):
+    #{{{
+        kind = match.lastgroup
+        token_text = match.group()
+        if kind == "WORD":
+            tokens.append(Token(kind, token_text, token_text.upper()))
+        elif kind == "MENTION":
+            user = match.group("user").upper()
+            tokens.append(Token(kind, token_text, user, user))
+        elif kind == "INTEGER":
+            tokens.append(Token(kind, token_text, token_text, int(token_text)))
+        elif kind == "EMOJI":
+            norm = token_text.upper()
+            tokens.append(Token(kind, token_text, norm,
+                                util.EMOJI_ROLLS.get(norm)))
+        elif kind == "DICE":
+            die_num = match.group("die_num")
+            tokens.append(Token(kind, token_text, token_text.upper(),
+                (_dieValue(die_num) if die_num else 1,
+                 _dieValue(match.group("die_size")))))
+        else:
+            inner = token_text[1:-1]
+            tokens.append(Token(kind, token_text, inner.upper(), inner))
+    #}}}
+    return tokens
+#}}}
+
+# Convert half of a dice spec
+# Params: text - digits or a number emoji
+# Return: int value, -1 for an emoji that isn't a number
+def _dieValue(text):
+#{{{
+    if text[0] == ":":
+        return util.EMOJI_ROLLS.get(text.upper(), -1)
+    return int(text)
+#}}}